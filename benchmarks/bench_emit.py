@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+G-code posting speed, lines2gcodes_gen a command at a time against the
+bulk gcode_blocks writer (what write_lines_to_fp uses), into memory and
+into a file, checking they come out byte for byte the same. Then how much
+smaller compact mode makes it, absolute and relative, and how much quicker
+planned feeds (up to 5x feedrate) make the job.
+
+    python benchmarks/bench_emit.py [points ...]
+"""
+import copy
+import io
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from botaplot.models.plottable import Plottable
+from botaplot.post.gcode_base import GCodePost
+
+
+def drawing(points, rng):
+    """Polylines of 2 to 40 points wandering around a 230mm bed"""
+    lengths = rng.integers(2, 41, points // 20)
+    steps = rng.normal(0.0, 1.0, (int(lengths.sum()), 2))
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    starts = rng.uniform(0.0, 230.0, (len(lengths), 2))
+    lines = list()
+    for start, lo, hi in zip(starts, offsets[:-1], offsets[1:]):
+        lines.append(Plottable.Line(start + np.cumsum(steps[lo:hi], axis=0)))
+    return Plottable(lines)
+
+
+def by_line(post, plottable, fp):
+    for stanza in post.lines2gcodes_gen(plottable):
+        fp.write("%s\n" % stanza)
+
+
+def timed(fun, *args):
+    started = time.perf_counter()
+    fun(*args)
+    return time.perf_counter() - started
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100000, 1000000]
+    rng = np.random.default_rng(5)
+    post = GCodePost()
+    print("%10s %10s %12s %10s %10s %10s %8s" % ("points", "commands", "MB", "by line", "bulk",
+                                                 "bulk file", "speedup"))
+    for size in sizes:
+        plottable = drawing(size, rng)
+        old, new = io.StringIO(), io.StringIO()
+        line_seconds = timed(by_line, post, plottable, old)
+        bulk_seconds = timed(post.write_lines_to_fp, plottable, new)
+        if old.getvalue() != new.getvalue():
+            raise AssertionError("Bulk G-code doesn't match lines2gcodes_gen")
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bench.gcode")
+            file_seconds = timed(post.post_lines_to_file, plottable, path)
+        commands = old.getvalue().count("\n")
+        print("%10d %10d %12.1f %9.2fs %9.2fs %9.2fs %7.1fx" % (
+            sum(len(line) for line in plottable), commands, len(new.getvalue()) / 1e6,
+            line_seconds, bulk_seconds, file_seconds, line_seconds / bulk_seconds))
+        print("%33s %9.0f/s %9.0f/s" % ("commands", commands / line_seconds, commands / bulk_seconds))
+        compact = copy.copy(post)
+        compact.compact = True
+        print("%33s %s" % ("compact", compact.compaction(plottable)))
+        compact.relative = True
+        print("%33s %s" % ("relative", compact.compaction(plottable)))
+        planned = copy.copy(post)
+        planned.max_feedrate = 5 * post.feedrate
+        started = time.perf_counter()
+        stats = planned.feed_savings(plottable)
+        print("%33s %s, in %.2fs" % ("planned feeds", stats, time.perf_counter() - started))
+
+
+if __name__ == "__main__":
+    main()
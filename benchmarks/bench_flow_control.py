@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Commands per second through SimpleAsciiProtocol against a fake controller,
+for line counting vs character counting vs adaptive flow control, and
+the window adaptive settles on.
+
+    python benchmarks/bench_flow_control.py [commands]
+"""
+import random
+import sys
+import time
+
+from botaplot.protocols import SimpleAsciiProtocol
+from botaplot.transports.fake import FakeControllerTransport
+
+
+def make_commands(count, seed=1):
+    rand = random.Random(seed)
+    cmds = list()
+    x = y = 100.0
+    for i in range(count):
+        # Mostly tiny moves, like a flattened curve, and the odd long one.
+        step = rand.choice((0.2, 0.5, 1.0, 25.0))
+        x = min(max(x + rand.uniform(-step, step), 0.0), 230.0)
+        y = min(max(y + rand.uniform(-step, step), 0.0), 250.0)
+        cmds.append("G01 F1200.00 X%4.2f Y%4.2f" % (x, y))
+    return cmds
+
+
+def run(cmds, protocol, lookahead=None, **controller):
+    transport = FakeControllerTransport(**controller)
+    if lookahead is not None:
+        transport.lookahead = lookahead
+    try:
+        start = time.monotonic()
+        protocol.plot(cmds, transport)
+        elapsed = time.monotonic() - start
+    finally:
+        transport.close()
+    return elapsed, transport
+
+
+SCENARIOS = {
+    # Short segments: the link and its latency are the bottleneck.
+    "short moves": dict(rx_buffer_size=128, planner_size=16, baudrate=115200,
+                        move_time=0.002, latency=0.008),
+    # Long segments: the planner backs up and the RX buffer fills.
+    "long moves": dict(rx_buffer_size=128, planner_size=16, baudrate=115200,
+                       move_time=0.01, latency=0.008),
+}
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    cmds = make_commands(count)
+    modes = [
+        ("lines, lookahead 2", SimpleAsciiProtocol(), 2),
+        ("lines, lookahead 4", SimpleAsciiProtocol(), 4),
+        ("lines, lookahead 8", SimpleAsciiProtocol(), 8),
+        ("chars, 128 bytes", SimpleAsciiProtocol(flow_control="chars", rx_buffer_size=128), None),
+        ("adaptive", SimpleAsciiProtocol(flow_control="adaptive"), None),
+    ]
+    print("%d commands, %d bytes" % (count, sum(len(cmd) + 1 for cmd in cmds)))
+    for scenario, controller in SCENARIOS.items():
+        print("\n%s: %s" % (scenario, controller))
+        print("%-20s %10s %10s %10s %10s %10s %10s" % ("mode", "cmds/s", "seconds", "starved", "overflows",
+                                                     "window", "RTT p50"))
+        for name, protocol, lookahead in modes:
+            elapsed, transport = run(cmds, protocol, lookahead, **controller)
+            metrics = protocol.metrics()
+            print("%-20s %10.0f %10.2f %10.2f %10d %10d %8.1fms" % (
+                name, count / elapsed, elapsed, transport.starved, transport.overflows, metrics.lookahead,
+                1000.0 * metrics.rtt_p50))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Pen-up travel, pen lifts, estimated job time (all from GCodePost.metrics)
+and ordering time for the greedy (XYHash), tiled greedy and Hilbert curve
+orderings, on stippling and hatching style drawings.
+
+    python benchmarks/bench_ordering.py [chunks ...]
+
+Greedy gets skipped above GREEDY_LIMIT chunks, it takes too long. Tiled
+runs on every core, so it only beats greedy's time on a machine with a few.
+"""
+import sys
+import time
+
+import numpy as np
+
+from botaplot.models.plottable import Plottable
+from botaplot.post.gcode_base import GCodePost
+
+GREEDY_LIMIT = 200000
+
+
+def stipple(count, rng):
+    """Dots, as tiny two point strokes, denser in the middle"""
+    centers = np.clip(rng.normal(115.0, 45.0, (count, 2)), 0.0, 230.0)
+    return centers, centers + rng.uniform(-0.2, 0.2, (count, 2))
+
+
+def hatch(count, rng):
+    """Short parallel strokes in patches with different angles"""
+    patches = max(count // 500, 1)
+    corners = rng.uniform(0.0, 200.0, (patches, 2))
+    angles = rng.uniform(0.0, np.pi, patches)
+    which = rng.integers(0, patches, count)
+    starts = corners[which] + rng.uniform(0.0, 30.0, (count, 2))
+    direction = np.column_stack((np.cos(angles[which]), np.sin(angles[which])))
+    return starts, starts + direction * rng.uniform(1.0, 4.0, (count, 1))
+
+
+def run(starts, ends, method):
+    plottable = Plottable([Plottable.Line([s, e]) for s, e in zip(starts, ends)])
+    started = time.perf_counter()
+    plottable.optimize_lines(method=method)
+    return time.perf_counter() - started, GCodePost().metrics(plottable)
+
+
+def main(sizes):
+    post = GCodePost()
+    row = "%-8s %9s %-8s %10s %14s %9s %10s"
+    print(row % ("drawing", "chunks", "method", "order s", "pen-up mm", "lifts", "job min"))
+    for name, make in (("stipple", stipple), ("hatch", hatch)):
+        for size in sizes:
+            starts, ends = make(size, np.random.default_rng(size))
+            base = post.metrics(Plottable([Plottable.Line([s, e]) for s, e in zip(starts, ends)]))
+            print(row % (name, size, "none", "-", "%.0f" % base.pen_up_mm, base.lifts, "%.1f" % (base.seconds / 60)))
+            for method in ("hash", "tiled", "hilbert"):
+                if method == "hash" and size > GREEDY_LIMIT:
+                    continue
+                seconds, metrics = run(starts, ends, method)
+                print(row % (name, size, method, "%.3f" % seconds, "%.0f" % metrics.pen_up_mm,
+                             metrics.lifts, "%.1f" % (metrics.seconds / 60)))
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000])
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+Commands per second through SimpleAsciiProtocol over a real TelnetTransport
+(to a fake Smoothie on a local socket) and SerialTransport (to one on the
+other end of a PTY), writing every command as it comes and reading the OKs
+on the sending thread, like it used to, against coalesced writes and a
+reader thread.
+
+    python benchmarks/bench_transport.py [commands] [ack latency ms]
+"""
+import os
+import socket
+import sys
+import threading
+import time
+from queue import Queue
+
+from botaplot.protocols import SimpleAsciiProtocol
+from botaplot.transports import SerialTransport, TelnetTransport
+
+
+def controller(read, write, latency, done):
+    """Acks every line latency seconds after it arrives, until done() says
+    there's no more coming"""
+    acks = Queue()
+
+    def acker():
+        while True:
+            due = acks.get()
+            if due is None:
+                return
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            write(b"ok\r\n")
+
+    thread = threading.Thread(target=acker, daemon=True)
+    thread.start()
+    data = b""
+    while not done():
+        chunk = read()
+        if not chunk:
+            break
+        data += chunk
+        *lines, data = data.split(b"\n")
+        for _ in lines:
+            acks.put(time.monotonic() + latency)
+    acks.put(None)
+    thread.join()
+
+
+def telnet(cmds, protocol, latency):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+
+    def serve():
+        connection, _ = server.accept()
+        with connection:
+            connection.sendall(b"Smoothie command shell\r\n")
+            controller(lambda: connection.recv(65536), connection.sendall, latency, lambda: False)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    transport = TelnetTransport("127.0.0.1", server.getsockname()[1])
+    transport.file  # Connect before the clock starts
+    try:
+        return timed(cmds, protocol, transport)
+    finally:
+        transport.file.close()
+        transport.sock.close()
+        thread.join()
+        server.close()
+
+
+def serial_pty(cmds, protocol, latency):
+    master, slave = os.openpty()
+    finished = threading.Event()
+    thread = threading.Thread(target=controller, daemon=True, args=(
+        lambda: os.read(master, 65536), lambda data: os.write(master, data), latency, finished.is_set))
+    thread.start()
+    transport = SerialTransport(os.ttyname(slave))
+    transport.file
+    try:
+        return timed(cmds, protocol, transport)
+    finally:
+        finished.set()
+        os.write(slave, b"\n")  # Wake the controller up to see it's done
+        thread.join()
+        transport.file.close()
+        os.close(slave)
+        os.close(master)
+
+
+def timed(cmds, protocol, transport):
+    start = time.monotonic()
+    protocol.plot(cmds, transport)
+    return time.monotonic() - start
+
+
+def protocol(reader_thread, coalesce_writes, **kw):
+    protocol = SimpleAsciiProtocol(**kw)
+    protocol.reader_thread = reader_thread
+    protocol.coalesce_writes = coalesce_writes
+    return protocol
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    latency = float(sys.argv[2]) / 1000.0 if len(sys.argv) > 2 else 0.001
+    cmds = ["G01 F1200.00 X%4.2f Y%4.2f" % (i % 2300 * 0.1, i % 2500 * 0.1) for i in range(count)]
+    modes = [
+        ("write each, read inline", False, False),
+        ("coalesced", False, True),
+        ("coalesced + reader", True, True),
+    ]
+    print("%d commands, %.1fms ack latency" % (count, latency * 1000.0))
+    print("%-10s %-26s %10s %10s" % ("link", "mode", "cmds/s", "seconds"))
+    for link, run in (("telnet", telnet), ("serial pty", serial_pty)):
+        for name, reader_thread, coalesce_writes in modes:
+            for flow_control in ("lines", "chars"):
+                elapsed = run(cmds, protocol(reader_thread, coalesce_writes, flow_control=flow_control,
+                                             rx_buffer_size=1024), latency)
+                print("%-10s %-26s %10.0f %10.2f" % (link, "%s, %s" % (name, flow_control), count / elapsed,
+                                                     elapsed))
+
+
+if __name__ == "__main__":
+    main()
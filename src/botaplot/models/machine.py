@@ -1,6 +1,7 @@
 from botaplot.transports import SerialTransport, TelnetTransport
 from botaplot.protocols import SimpleAsciiProtocol
 from botaplot.post.gcode_base import GCodePost
+from botaplot.util.motion import simulate
 import logging
 logger = logging.getLogger(__name__)
 
@@ -11,20 +12,39 @@ class Machine(object):
     machine_catalog = {}
     post = GCodePost()
     transport = None
+    flow_control = "lines"  # Or "chars" to count bytes in the controller's RX buffer, or "adaptive"
+    rx_buffer_size = 128  # Bytes, GRBL's default. Only used for "chars" flow control.
+    acceleration = 1000.0  # mm/s^2, for estimating job times and planning feeds
+    junction_deviation = 0.05  # mm, how the controller slows for corners
 
-    def __init__(self, origin=None, scale=None, limits=None, post=None, transport=None, protocol=None):
+    def __init__(self, origin=None, scale=None, limits=None, post=None, transport=None, protocol=None,
+                 flow_control=None, rx_buffer_size=None, acceleration=None, junction_deviation=None):
         self.origin = origin or Machine.origin
         self.scale = scale or Machine.scale
         self.limits = limits or Machine.limits
-        self.post = post or Machine.post
+        # Our own post, which plans feeds with our acceleration and junction deviation
+        self.post = post or GCodePost()
+        self.post.machine = self
+        self.flow_control = flow_control or Machine.flow_control
+        self.rx_buffer_size = rx_buffer_size or Machine.rx_buffer_size
+        self.acceleration = acceleration or Machine.acceleration
+        self.junction_deviation = junction_deviation or Machine.junction_deviation
         # Note that this will blow up with no transport, so you better pass one.
         # ... I should probably write a dummy transport, just for testing
         self.transport = transport  # or SerialTransport("/dev/tty.usbmodem14322201")  # Brutal hack for now.
-        self.protocol = protocol or SimpleAsciiProtocol()
+        self.protocol = protocol or SimpleAsciiProtocol(
+            flow_control=self.flow_control, rx_buffer_size=self.rx_buffer_size)
 
     def plot(self, commands):
         raise NotImplementedError("Calling plot on base Machine class")
 
+    def estimate(self, commands):
+        """MotionEstimate of how long this machine takes to run commands (a
+        string, list of commands, PostStream or MotionProgram), acceleration
+        and all. See util.motion."""
+        return simulate(commands, self.acceleration, self.junction_deviation,
+                        self.post.travel_feedrate, self.post.feedrate)
+
 class BotAPlot(Machine):
     """
     This is the basic botaplot machine, with M280/281 height control and
@@ -32,20 +52,33 @@ class BotAPlot(Machine):
     It's also gonna change over time.
     """
 
-    def __init__(self, origin=None, scale=None, limits=None, post=None, transport=None, protocol=None):
+    def __init__(self, origin=None, scale=None, limits=None, post=None, transport=None, protocol=None,
+                 flow_control=None, rx_buffer_size=None, acceleration=None, junction_deviation=None):
         """Given a transport (either a serial or telnet transport), create
         a botaplot that can plot lines over serial/telnet. Expects gcode
         """
-        super().__init__(origin, scale, limits, post, transport, protocol)
+        super().__init__(origin, scale, limits, post, transport, protocol,
+                         flow_control, rx_buffer_size, acceleration, junction_deviation)
 
-    def plot(self, commands, callback=None):
+    def plot(self, commands, callback=None, idle=None):
         """Lines just needs to be a generator that contains a list of commands.
-        If you want to convert line segments to commands, you'll need to POST first
+        If you want to convert line segments to commands, you'll need to POST first.
+        commands can also be a whole program as one string, or a PostStream.
         """
+        if isinstance(commands, str):
+            commands = commands.split("\n")
         logger.info("Sending commands [%d items] with callback: %s", len(commands), callback)
-        self.protocol.plot(commands.split("\n"), self.transport, callback=callback)
+        self.protocol.plot(commands, self.transport, callback=callback, idle=idle)
 
 
-Machine.machine_catalog["generic_gcode"] = Machine()
-Machine.machine_catalog["botaplot_v1"] = BotAPlot(limits=[[0.0, 0.0], [235.0, 254.0]])
+# Every machine gets a post of its own, so settings like arc fitting or
+# planned feeds can be turned on for one without the rest, e.g.
+#     Machine.machine_catalog["botaplot_v1"].post.arc_tolerance = 0.02
+#     Machine.machine_catalog["botaplot_v1"].post.max_feedrate = 3000.0
+# Planning goes off the acceleration and junction deviation below, so
+# measure them on the machine before turning it on.
+Machine.machine_catalog["generic_gcode"] = Machine(post=GCodePost(), acceleration=1000.0,
+                                                   junction_deviation=0.05)
+Machine.machine_catalog["botaplot_v1"] = BotAPlot(limits=[[0.0, 0.0], [235.0, 254.0]], post=GCodePost(),
+                                                  acceleration=1000.0, junction_deviation=0.05)
 
@@ -2,12 +2,13 @@ from enum import Enum, auto
 import logging
 import threading
 import json
-from io import StringIO
+from collections import namedtuple
 from queue import Queue, Empty
-import time
 import re
+import time
 from PyQt5.QtCore import QObject, QThread, pyqtSignal
 from botaplot.models.machine import Machine
+from botaplot.post.stream import PostStream
 from botaplot.protocols import PlotJobCancelled
 
 logger = logging.getLogger(__name__)
@@ -38,6 +39,94 @@ class InvalidCommandState(ValueError):
     pass
 
 
+ProgressSnapshot = namedtuple(
+    "ProgressSnapshot", ["done", "total", "last", "rate", "eta", "seq", "flow"], defaults=(None,))
+
+
+class PlotProgress(object):
+    """
+    The latest progress of a plot job. The worker updates it for every
+    command it sends, and readers only ever see the most recent state, so
+    nothing piles up no matter how fast we're plotting.
+    rate is in commands/second (smoothed), and eta is in seconds, or None
+    if we don't know yet.
+    Given an estimate (the simulated seconds at the end of every command,
+    see util.motion) the eta comes from that instead, right from the
+    start, and once we've been going a while it gets scaled by how far
+    off the simulation turned out to be so far. Or given the program,
+    whenever it gets an estimate attribute (a PostStream gets one once
+    it's been simulated, which can be after we've started).
+    Given metrics (the protocol's metrics()), every snapshot carries the
+    FlowMetrics as of then in flow.
+    """
+
+    rate_window = 0.5  # Seconds between rate samples
+    smoothing = 0.3  # Weight of the newest rate sample
+    calibrate_after = 5.0  # Seconds of plotting before we trust our own timing over the estimate
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self, total=0, estimate=None, program=None, metrics=None):
+        with self._lock:
+            self._program = program
+            self._metrics = metrics
+            self._done = 0
+            self._total = total
+            self._last = ""
+            self._seq = 0
+            self._rate = None
+            self._mark = (time.monotonic(), 0)
+            self._started = self._mark[0]
+            self._estimate = estimate if estimate is not None and len(estimate) else None
+
+    def update(self, done, total, last):
+        with self._lock:
+            self._done = done
+            self._total = total
+            self._last = last
+            self._seq += 1
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def _estimated_eta(self, now):
+        estimate = self._estimate
+        done = min(self._done, len(estimate))
+        predicted = float(estimate[done - 1]) if done else 0.0
+        remaining = float(estimate[-1]) - predicted
+        actual = now - self._started
+        if actual >= self.calibrate_after and predicted > 0:
+            remaining *= actual / predicted
+        return max(0.0, remaining)
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            mark_time, mark_done = self._mark
+            if now - mark_time >= self.rate_window:
+                rate = (self._done - mark_done) / (now - mark_time)
+                if self._rate is None:
+                    self._rate = rate
+                else:
+                    self._rate += self.smoothing * (rate - self._rate)
+                self._mark = (now, self._done)
+            eta = None
+            if self._estimate is None and self._program is not None:
+                estimate = getattr(self._program, "estimate", None)
+                if estimate is not None and len(estimate):
+                    self._estimate = estimate
+            if self._estimate is not None:
+                eta = self._estimated_eta(now)
+            elif self._rate:
+                eta = max(0, self._total - self._done) / self._rate
+            return ProgressSnapshot(self._done, self._total, self._last,
+                                    self._rate or 0.0, eta, self._seq,
+                                    self._metrics() if self._metrics is not None else None)
+
+
 class PlotWorker(object):
     """
     PlotWorker lives in a separate thread/process/etc... and accepts commands.
@@ -54,8 +143,13 @@ class PlotWorker(object):
     LOAD[CMD_ID]: GCODE|HPGL as string ie: {"LOAD": "G28 X Y\nG92\nG0 X123 Y321\n"}
         Where we load a new program that we're going to plot. Will fail if
         the machine is currently plotting
+    STREAM[CMD_ID]
+        Like LOAD, but loads the job staged with send_stream, which is
+        generally a PostStream that posts its commands lazily as we plot.
     START[CMD_ID]
         Starts plotting, either at the beginning, or wherever we last PAUSEd.
+        Resuming, the START itself gets an OK straight away, the result of
+        the plot comes back to the START that began it.
     CANCEL[CMD_ID]
         Stops plotting and resets command pointer to the beginning.
         NOTE: In this case, the CMD_ID should match the job that is being
@@ -65,13 +159,16 @@ class PlotWorker(object):
         as a list of JSON array entries to escape newlines, ie:
         LOAD[123-456-etc..]: ["G28 X Y\n", "G92\n", "M281 S5\n"]
     PAUSE[CMD_ID]
-        Pause the plot and retain position
+        Pause the plot and retain position. Takes effect as soon as it's
+        sent, even while we're waiting on the plotter.
     MOVE[CMD_ID]:(!)X,(!)Y(,Z)
         Move to a specific position. If prefixed with an exclamation mark, the
         position will be interpreted as absolute, otherwise it is moved a
         relative amount. Always in mm. Z is optional, X,Y are mandatory
+        (our posts don't do Z, so giving one is an error). Mid plot, only
+        while PAUSEd.
     PENUP[CMD_ID]
-        Lift the pen completely off the paper
+        Lift the pen completely off the paper. Mid plot, only while PAUSEd.
     PENDOWN[CMD_ID](:depth)
         Put the pen down. If depth is passed, then a plotter specific depth
         value will be used. This might be either a Z depth, or an M280 PWM
@@ -97,8 +194,18 @@ class PlotWorker(object):
     PROGRESS[cmd_id]: {"done": cmd_count, "total": cmds_total, "last": last command}
     which will be triggered via callbacks internally, and reflects progress of the
     current plot job.
+
+    While a plot's running, commands still get handled (reentrant) as it
+    goes and while it's paused, so PAUSE, MOVE, PENUP, CMD, STATUS and the
+    like answer in a few ms whether we're plotting or not.
+
+    Regular progress is published to self.progress (a PlotProgress) rather
+    than queued, and progress_notify is poked every progress_every commands.
+    progress_q only carries one-off messages, like a cancelled job.
     """
 
+    progress_every = 500  # Commands between progress notifications
+
     cmd_match = re.compile(
         r"^(?P<cmd>[A-Z]*)\[(?P<id>[a-zA-Z0-9\-]*)\]((:)(?P<content>.*))?",
         re.MULTILINE | re.DOTALL)
@@ -113,11 +220,15 @@ class PlotWorker(object):
         self._die = die
         self.cmd_lock: threading.Lock = threading.Lock()
         self.state_lock: threading.Lock = threading.Lock()
+        self.stream_lock: threading.Lock = threading.Lock()
         self._thread = None
         self._program = None  # Will be the posted program later
+        self._staged_stream = None  # Waiting for its STREAM command
         self._state = PlotWorkerState.READY
-        self.progress_notify = threading.Condition()
+        self.progress_notify = threading.Condition()  # Progress or a result is waiting
+        self._started = threading.Event()
         self.progress_q = Queue()
+        self.progress = PlotProgress()
         self.cancel_job = False
 
     @classmethod
@@ -129,8 +240,7 @@ class PlotWorker(object):
         thread = threading.Thread(target=instance.run)
         thread.daemon = True
         thread.start()
-        while instance.dead is None:
-            time.sleep(0.01)
+        instance._started.wait()
         return instance
 
     @property
@@ -145,12 +255,18 @@ class PlotWorker(object):
                 raise ValueError("Invalid state '%s'" % new_state)
             self._state = new_state
 
-    def state_wrap(self):
+    def state_wrap(self, reentrant=False):
+        """Marks us BUSY for a command, which we have to be READY for.
+        Reentrant commands (handled mid plot) skip all that, the plot has
+        us BUSY already."""
         parent = self
         class StateContextWrapper(object):
             def __enter__(self):
                 # print("Entering context")
                 # locked = parent.state_lock.acquire()
+                self.old_state = None
+                if reentrant:
+                    return None
                 if parent.state != PlotWorkerState.READY:
                     raise InvalidCommandState(
                         "Plot state %s is invalid for command" %
@@ -162,7 +278,8 @@ class PlotWorker(object):
 
             def __exit__(self, type, value, traceback):
                 # print("Exiting context.")
-                parent._state = self.old_state
+                if self.old_state is not None:
+                    parent._state = self.old_state
                 #parent.state_lock.release()
 
         return StateContextWrapper()
@@ -171,8 +288,19 @@ class PlotWorker(object):
     def kill(self):
         logger.info(f"{self} Dying.")
         self._die.set()
+        self.inq.put(None)  # Wake up the event loop
+        self._wake_protocol()
         return self._die.is_set()
 
+    def _wake_protocol(self):
+        wake = getattr(self.machine.protocol, "wake", None)
+        if wake is not None:
+            wake()
+
+    def _notify(self):
+        with self.progress_notify:
+            self.progress_notify.notify_all()
+
     @property
     def dead(self):
         if not hasattr(self, "_thread"):
@@ -188,8 +316,22 @@ class PlotWorker(object):
         if not self.cmd_match.match(cmd):
             # print("Invalid command")
             raise ValueError(f"Invalid cmd '{cmd[:40]}'")
+        protocol = self.machine.protocol
+        if cmd.startswith("PAUSE[") and not protocol.ready:
+            # Mid plot, so pause right now, even if the worker's stuck
+            # waiting on the plotter. It answers once it gets to it.
+            protocol.paused = True
         with self.cmd_lock:
             self.inq.put(cmd)
+        # If we're paused mid-plot, the protocol needs a nudge to hear it.
+        self._wake_protocol()
+
+    def send_stream(self, cmd_id, stream):
+        """Stage a streaming job (anything with len() that iterates commands)
+        and send the STREAM command that loads it."""
+        with self.stream_lock:
+            self._staged_stream = stream
+        self.send(f"STREAM[{cmd_id}]")
 
     def recv(self, blocking=False):
         """Helper function to retrieve a response from the worker"""
@@ -218,15 +360,42 @@ class PlotWorker(object):
             content_out = ""
         return f"{kind}[{id}]{content_out}"
 
+    def _direct_result(self, cmd, cmds, reentrant):
+        """Sends cmds straight to the plotter, unless we're mid plot and
+        not paused"""
+        if reentrant and not self.machine.protocol.paused:
+            return self._result("ERR", cmd['id'], dict(error="Pause the plot first."))
+        with self.state_wrap(reentrant):
+            for line in cmds:
+                logger.info(f"Sending single command {line}")
+                self.machine.protocol.single(line, self.machine.transport)
+                logger.info("Sent.")
+        return self._result("OK", cmd['id'], dict(count=len(cmds)))
+
     def handle_cmd(self, cmd, reentrant=False):
-        cmds = json.loads(cmd['content'])
-        for line in cmds:
-            logger.info(f"Sending single command {line}")
-            # print(f"Sending single command {line}")
-            self.machine.protocol.single(line, self.machine.transport)
-            logger.info("Sent.")
-        return self._result("OK", cmd['id'],
-                            dict(count=len(cmds)))
+        return self._direct_result(cmd, json.loads(cmd['content']), reentrant)
+
+    def handle_move(self, cmd, reentrant=False):
+        words = (cmd['content'] or "").split(",")
+        if len(words) not in (2, 3):
+            return self._result("ERR", cmd['id'], dict(error="MOVE needs X,Y"))
+        if len(words) == 3:
+            return self._result("ERR", cmd['id'], dict(error="No Z axis to move"))
+        relative = not words[0].startswith("!")
+        x, y = (float(word.lstrip("!")) for word in words)
+        cmds = self.machine.post.util_move(x, y, relative)
+        if relative:
+            cmds.append("G90\n")  # Back to absolute, for the plot we might be in the middle of
+        return self._direct_result(cmd, cmds, reentrant)
+
+    def handle_penup(self, cmd, reentrant=False):
+        return self._direct_result(cmd, self.machine.post.util_pen(True), reentrant)
+
+    def handle_pause(self, cmd, reentrant=False):
+        if not reentrant:
+            return self._result("ERR", cmd['id'], dict(error="Not currently plotting"))
+        self.machine.protocol.paused = True
+        return self._result("OK", cmd['id'])
 
     def handle_load(self, cmd, reentrant=False):
         # print("Outside state wrap")
@@ -243,23 +412,48 @@ class PlotWorker(object):
             return self._result("OK", cmd['id'],
                                 dict(size=len(self._program)))
 
-    def handle_status(self, cmd, reentrant=False):
+    def handle_stream(self, cmd, reentrant=False):
         with self.state_wrap():
-            assert cmd['cmd'].lower() == "status"
+            if reentrant:
+                return self._result(
+                    "ERR",
+                    cmd['id'],
+                    dict(error="Existing program already running"))
+            with self.stream_lock:
+                stream, self._staged_stream = self._staged_stream, None
+            if stream is None:
+                return self._result("ERR", cmd['id'],
+                                    dict(error="No stream staged"))
+            self._program = stream
+            logger.info("Loading stream: %d commands" % len(stream))
             return self._result("OK", cmd['id'],
-                                dict(alive=not self.dead,
-                                     thread=self._thread
-                                     ))
+                                dict(size=len(stream)))
+
+    def handle_status(self, cmd, reentrant=False):
+        # Only looks, so it's fine mid plot, which is when flow matters
+        assert cmd['cmd'].lower() == "status"
+        return self._result("OK", cmd['id'],
+                            dict(alive=not self.dead,
+                                 thread=self._thread,
+                                 state=self.state.name,
+                                 flow=self.machine.protocol.metrics()._asdict()
+                                 ))
 
     def handle_start(self, cmd, reentrant=False):
-        with self.state_wrap():
-            if reentrant:
+        if reentrant:
+            if not self.machine.protocol.paused:
                 return self._result(
                     "ERR",
                     cmd['id'],
                     dict(error="Existing program already running"))
+            self.machine.protocol.paused = False
+            return self._result("OK", cmd['id'], dict(resumed=True))
+        with self.state_wrap():
+            # Posts and streams can carry a motion estimate, see util.motion
+            self.progress.reset(len(self._program), program=self._program,
+                                metrics=self.machine.protocol.metrics)
             try:
-                self.machine.plot(self._program, self._progress)
+                self.machine.plot(self._program, self._progress, idle=self._idle)
             except PlotJobCancelled:
                 return self._result("ERR", cmd['id'],
                                     dict(error="Job cancelled."))
@@ -269,7 +463,7 @@ class PlotWorker(object):
         # This one is weird. It _has_ to be reentrant
         logger.info("Cancelling job.")
         # print("Cancelling job")
-        with self.state_wrap():
+        with self.state_wrap(reentrant):
             # print("In cancel state wrap")
             logger.info("Cancelling job (IN STATE WRAP).")
             if not reentrant:
@@ -296,41 +490,61 @@ class PlotWorker(object):
             logger.info("Calling method %s with content %s",
                         method_name, cmd['content'])
             try:
-                return getattr(self, method_name)(cmd)
+                return getattr(self, method_name)(cmd, reentrant=reentrant)
             except Exception as exc:
                 return self._result("ERR", cmd['id'], dict(error=str(exc)))
 
     def _progress(self, line_no, total_lines, cmd):
         # Handle a progress callback from the machine/protocol
         self._tick(True)
+        self._check_cancel(line_no, total_lines)
+
+        # logger.info(f"Line {line_no+1}/{total_lines}: {cmd}")
+        self._last_progress = (line_no, total_lines)
+        self.progress.update(line_no, total_lines, cmd)
+        if line_no % self.progress_every == 0:
+            self._notify()
+
+    def _idle(self):
+        # Called by the protocol whenever it's woken up while paused
+        self._tick(True)
+        self._check_cancel(*getattr(self, "_last_progress", (0, 1)))
 
+    def _check_cancel(self, line_no, total_lines):
         if self.cancel_job:
             # print("Actually cancelling")
             self.cancel_job = False
             self.progress_q.put([line_no, total_lines, "JOB CANCELLED"])
+            self._notify()
             # print("Raising")
             raise PlotJobCancelled("Cancelling plot job")
 
-        # logger.info(f"Line {line_no+1}/{total_lines}: {cmd}")
-        self.progress_q.put([line_no, total_lines, cmd])
-        # logger.info("Done putting")
-        # logger.info("PROGRESS QUEUE: %s", self.progress_q)
-        # with self.progress_notify:
-        #     self.progress_notify.notifyAll()
-
-        # print(f"Line {line_no+1}/{total_lines}: {cmd}")
+    def _respond(self, cmd_line, reentrant=False):
+        self.outq.put(self._handle(cmd_line, reentrant=reentrant))
+        self._notify()
 
     def _tick(self, reentrant=False):
-        if not self.inq.empty():
-            self.outq.put(self._handle(self.inq.get(), reentrant=reentrant))
-            return True
+        """Handle a waiting command, if there is one, without blocking"""
+        try:
+            cmd_line = self.inq.get(False)
+        except Empty:
+            return False
+        if cmd_line is None:
+            return False  # Just a wakeup
+        self._respond(cmd_line, reentrant=reentrant)
+        return True
 
     def run(self):
         """Run the event loop"""
         self._thread = threading.get_ident()
+        self._started.set()
         while not self._die.is_set():
-            self._tick()
-            time.sleep(0.1)
+            try:
+                cmd_line = self.inq.get(True, 1.0)  # Timeout is just a backstop
+            except Empty:
+                continue
+            if cmd_line is not None:
+                self._respond(cmd_line)
         self._thread = None
 
 
@@ -348,13 +562,10 @@ class PlotSender(QObject):
     def plot(self, plottables=list(), callback=None):
         from .project_model import ProjectModel  # Runtime import because of circular dependency.
         """Create the stuff we'll actually send"""
-        ofp = StringIO()
         # plottable = LayerModel.current.plottables["all"][0]
         plottable = plottables[0]
         plottable = plottable.transform(*ProjectModel.current.get_transform(plottable))
-        ProjectModel.current.machine.post.write_lines_to_fp(
-            plottable, ofp)
-        self.gcode = ofp.getvalue()
+        self.gcode = PostStream(ProjectModel.current.machine.post, plottable)
         logger.debug("GCode is %s", len(self.gcode))
         logger.debug("Callback is %s", callback)
         # TODO: Switch to https://riptutorial.com/pyqt5/example/29500/basic-pyqt-progress-bar
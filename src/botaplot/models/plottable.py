@@ -15,75 +15,181 @@ from collections import namedtuple
 from weakref import WeakValueDictionary, WeakSet
 from botaplot.util.util import (valid_point, distance, NextLine, MAX_LENGTH,
                                 clamp_coords)
+from botaplot.util.simplify import simplify
+from botaplot.util.tour import improve_tour
+from botaplot.util.hilbert import hilbert_order
+from botaplot.util.tiles import tiled_order
+from botaplot.util.metrics import plot_metrics
 import sys
+import time
 
+MergeStats = namedtuple("MergeStats", ["lifts_before", "lifts_after", "seconds"])
 
 
 class XYHash(object):
-    """Geometric localized 2d coordinate cache"""
+    """Geometric localized 2d coordinate cache
+
+    Bins the start and end point of every line into a grid of squares,
+    so that we can find the closest endpoint of any remaining line without
+    scanning the whole drawing. Lines can be removed as they get drawn.
+    Anything that supports pline[0] and pline[-1] can be hashed.
+    """
     gridsize = 10.0  # 1cm squares
     _hash = None
 
-
-    def __init__(self, lines):
-        self._hash = dict()
+    def __init__(self, lines, gridsize=None):
+        lines = list(lines)
+        if gridsize is None:
+            gridsize = self.auto_gridsize(lines)
+        self.gridsize = gridsize
+        self._hash = dict()  # (col, row) -> {(key, is_end): (x, y)}
+        self._lines = dict()  # key -> (pline, cells)
+        self._extent = None  # Grid squares we've ever touched
         for pline in lines:
             self.add(pline)
 
+    @classmethod
+    def auto_gridsize(cls, lines):
+        """Pick a grid size that puts roughly one line in each square"""
+        points = [p for pline in lines for p in (pline[0], pline[-1])
+                  if valid_point(p)]
+        if len(points) < 2:
+            return cls.gridsize
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        area = (max(xs) - min(xs)) * (max(ys) - min(ys))
+        if area <= 0.0:
+            # Everything is on one line, so bin along it instead.
+            span = max(max(xs) - min(xs), max(ys) - min(ys))
+            return span / len(lines) if span > 0.0 else cls.gridsize
+        return sqrt(area / len(lines))
+
+    def __len__(self):
+        return len(self._lines)
+
+    def __contains__(self, pline):
+        return id(pline) in self._lines
+
+    def _cell(self, point):
+        return (int(floor(point[0] / self.gridsize)),
+                int(floor(point[1] / self.gridsize)))
+
     def add(self, pline):
-        start = pline[0]
-        end = pline[-1]
-        for point in start, end:
-            hash = "%dX%d" % (floor(pline[0] / 10), floor(point[1] / 10))
-            if pline in self._hash.get(hash, list()):
+        key = id(pline)
+        if key in self._lines:
+            return
+        cells = list()
+        for is_end, point in (False, pline[0]), (True, pline[-1]):
+            if not valid_point(point):
                 continue
-            if self._hash.get(hash) is None:
-                self._hash[hash] = WeakValueDictionary((0, pline))
+            cell = self._cell(point)
+            self._hash.setdefault(cell, dict())[(key, is_end)] = (
+                float(point[0]), float(point[1]))
+            cells.append((cell, is_end))
+            if self._extent is None:
+                self._extent = [cell[0], cell[1], cell[0], cell[1]]
             else:
-                self._hash[hash][len(self._hash[hash])].append(pline)
+                self._extent = [min(self._extent[0], cell[0]),
+                                min(self._extent[1], cell[1]),
+                                max(self._extent[2], cell[0]),
+                                max(self._extent[3], cell[1])]
+        self._lines[key] = (pline, cells)
 
     def remove(self, pline):
-        start = pline[0]
-        end = pline[-1]
-        if start == end:
-            end = None
-        for point in start, end:
-            while point in self._hash.get(hash):
-                self._hash.get(hash).remove(pline)
-
-    def closest(self, x, y, radius=3, remove=True):
+        """Drop a line from the cache. Returns False if it wasn't in there."""
+        key = id(pline)
+        entry = self._lines.pop(key, None)
+        if entry is None:
+            return False
+        for cell, is_end in entry[1]:
+            points = self._hash.get(cell)
+            points.pop((key, is_end), None)
+            if not points:
+                del self._hash[cell]
+        return True
+
+    def closest(self, x, y, radius=None, remove=True, max_distance=None, accept=None):
         """
-        Returns the closest line, with 1 or -1 for it's
-        direction (is it reversed)?
-        Radius sets the maximum distance from the center square to search.
+        Returns the closest line as (line, reversed, distance), where
+        reversed is True if it's the END of the line that is closest, or
+        None if there's nothing left within range.
+        Radius sets the maximum distance (in squares) from the center square
+        to search, max_distance is the same thing in real units. By default
+        we search the whole drawing.
         If remove is set, cleans it out of the cache (because you just drew
         it... duh...)
+        If accept is given, only lines it returns True for count.
 
-        Algo:
-        assume search center = 55,52, radius is 3
-        check each endpoint in box[5,5]
-        if match: return match
-        for d in 1..radius:
-            let start = 5 - d
-            let end = 5 + d
-            i in 0..d-1:
-                check each endpoint in box[start+i, start]
-                if match: return match
-                check each endpoint in box[end, start+i]
-                if match: return match
-                check each endpoint in box[end-i, end]
-                if match: return match
-                check each endpoint in box[end, end-i]
-                if match: return match
-
-
-
-
+        Algo: check the square we're in, then walk rings of squares around
+        it. Every point in ring d is at least (d-1)*gridsize away, so once
+        we have a match that is closer than that we can stop. If a ring has
+        more squares in it than there are occupied squares left, it's cheaper
+        to just check all of them, so we do that instead.
         """
+        if not self._hash:
+            return None
+        center = self._cell((x, y))
+        best = None
+        best_d2 = float(MAX_LENGTH) ** 2
+        if max_distance is not None:
+            best_d2 = max_distance * max_distance
+            max_ring = int(max_distance // self.gridsize) + 1
+            radius = max_ring if radius is None else min(radius, max_ring)
+        max_ring = max(abs(center[0] - self._extent[0]),
+                       abs(center[0] - self._extent[2]),
+                       abs(center[1] - self._extent[1]),
+                       abs(center[1] - self._extent[3]))
+        if radius is not None:
+            max_ring = min(max_ring, radius)
+
+        def _check(points, best, best_d2):
+            for key, (px, py) in points.items():
+                d2 = (px - x) * (px - x) + (py - y) * (py - y)
+                if d2 < best_d2 or (d2 == best_d2 and best is None):
+                    if accept is None or accept(self._lines[key[0]][0]):
+                        best, best_d2 = key, d2
+            return best, best_d2
+
+        ring = 0
+        while ring <= max_ring:
+            if best is not None \
+                    and best_d2 <= ((ring - 1) * self.gridsize) ** 2:
+                break
+            if ring > 0 and 8 * ring > len(self._hash):
+                # Sparse leftovers. Just check every occupied square further
+                # out than the rings we've already done.
+                for cell, points in self._hash.items():
+                    dist = max(abs(cell[0] - center[0]), abs(cell[1] - center[1]))
+                    if ring <= dist <= max_ring:
+                        best, best_d2 = _check(points, best, best_d2)
+                break
+            for cell in self._ring(center, ring):
+                points = self._hash.get(cell)
+                if points:
+                    best, best_d2 = _check(points, best, best_d2)
+            ring += 1
+
+        if best is None:
+            return None
+        key, is_end = best
+        pline = self._lines[key][0]
+        if remove:
+            self.remove(pline)
+        return pline, is_end, sqrt(best_d2)
 
-
-
-
+    @staticmethod
+    def _ring(center, ring):
+        """The squares that are exactly $ring squares from the center"""
+        cx, cy = center
+        if ring == 0:
+            yield center
+            return
+        for i in range(-ring, ring + 1):
+            yield cx + i, cy - ring
+            yield cx + i, cy + ring
+        for i in range(-ring + 1, ring):
+            yield cx - ring, cy + i
+            yield cx + ring, cy + i
 
 
 class Plottable(object):
@@ -96,18 +202,26 @@ class Plottable(object):
 
 
     class Line(PlotChunk):
-        """Line segment"""
+        """Line segment. Points are stored as an (N, 2) float64 ndarray,
+        which may be a view into a Plottable's packed buffer."""
         def __init__(self, points: list, weight: float=1.0, pen=1):
             self.points = points
             self.weight = weight
             self.pen = pen
 
+        @property
+        def points(self):
+            return self._points
+
+        @points.setter
+        def points(self, points):
+            self._points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
         def __len__(self):
-            return len(self.points)
+            return len(self._points)
 
         def __iter__(self):
-            for x in self.points:
-                yield x
+            yield from self._points.tolist()
 
         def __getitem__(self, idx):
             return self.points[idx]
@@ -117,16 +231,18 @@ class Plottable(object):
                 return "<PlotChunk:Line %s .. %s>" % (self.points[0], self.points[-1])
             return "<PlotChunk:Line empty>"
 
+        def reverse(self):
+            """Draw it the other way around"""
+            self._points = self._points[::-1]
+
         def transform(self, x, y, scalex, scaley):
-            return [(x+p[0]*scalex, y+p[1]*scaley) for p in self.points]
+            return self._points * (scalex, scaley) + (x, y)
 
         @property
         def bounds(self):
-            xmin = min([p[0] for p in self.points])
-            xmax = max([p[0] for p in self.points])
-            ymin = min([p[1] for p in self.points])
-            ymax = max([p[1] for p in self.points])
-            return xmin, ymin, xmax, ymax
+            xmin, ymin = self._points.min(axis=0)
+            xmax, ymax = self._points.max(axis=0)
+            return float(xmin), float(ymin), float(xmax), float(ymax)
 
 
     def __init__(self, chunks=None, callback=None):
@@ -135,29 +251,57 @@ class Plottable(object):
         #self.chunks = chunks
         self.chunks = chunks #self.optimize_lines(chunks, callback=callback)
 
+    @classmethod
+    def from_buffer(cls, points, offsets, callback=None):
+        """Build a Plottable whose Lines are views into a single (N, 2)
+        points buffer, where chunk i is points[offsets[i]:offsets[i+1]]"""
+        plottable = cls([Plottable.Line(()) for i in range(len(offsets) - 1)],
+                        callback=callback)
+        plottable._rebind(np.asarray(points, dtype=np.float64).reshape(-1, 2),
+                          offsets)
+        return plottable
+
+    def buffer(self):
+        """Returns (points, offsets), every point in one contiguous (N, 2)
+        float64 array, where chunk i is points[offsets[i]:offsets[i+1]]"""
+        offsets = np.zeros(len(self.chunks) + 1, dtype=np.int64)
+        if not self.chunks:
+            return np.empty((0, 2), dtype=np.float64), offsets
+        np.cumsum([len(chunk) for chunk in self.chunks], out=offsets[1:])
+        return np.concatenate([chunk.points for chunk in self.chunks]), offsets
+
+    def pack(self):
+        """Move every chunk into one contiguous buffer, so we're not
+        holding a separate allocation for each line."""
+        self._rebind(*self.buffer())
+
+    def simplify(self, epsilon=0.2, method="rdp", area=None):
+        """Simplify every line in place, in one pass over the buffer.
+        method is "rdp" or "visvalingam", returns SimplifyStats"""
+        return simplify(self, epsilon, method, area)
+
+    def _rebind(self, points, offsets):
+        for chunk, start, end in zip(self.chunks, offsets[:-1].tolist(), offsets[1:].tolist()):
+            chunk._points = points[start:end]
+
+    @property
+    def point_count(self):
+        return sum(len(chunk) for chunk in self.chunks)
+
     def clamp(self, graphsize=230.0, margins=10, invert=True):
-        xmin = MAX_LENGTH
-        xmax = -MAX_LENGTH
-        ymin = MAX_LENGTH
-        ymax = -MAX_LENGTH
-        for chunk in self.chunks:
-            # First we measure
-            xmin = min(xmin, min([p[0] for p in chunk.points]))
-            xmax = max(xmax, max([p[0] for p in chunk.points]))
-            ymin = min(ymin, min([p[1] for p in chunk.points]))
-            ymax = max(ymax, max([p[1] for p in chunk.points]))
+        points, offsets = self.buffer()
+        # First we measure
+        xmin, ymin = points.min(axis=0)
+        xmax, ymax = points.max(axis=0)
         scale = min((graphsize-(margins*2.0))/(ymax-ymin),
                     (graphsize-(margins*2.0))/(xmax-xmin))
-        for chunk in self.chunks:
-            # Now we scale
-            if invert:
-                chunk.points = [(margins + (scale*(p[0]-xmin)),
-                                 ((graphsize-margins) - scale*(p[1]-ymin)))
-                                for p in chunk.points]
-            else:
-                chunk.points = [(margins + (scale*(p[0]-xmin)),
-                                 (margins + scale*(p[1]-ymin)))
-                                for p in chunk.points]
+        # Now we scale
+        points[:, 0] = margins + (scale*(points[:, 0]-xmin))
+        if invert:
+            points[:, 1] = (graphsize-margins) - scale*(points[:, 1]-ymin)
+        else:
+            points[:, 1] = margins + scale*(points[:, 1]-ymin)
+        self._rebind(points, offsets)
 
     def scale(self, scale=1.0, margins=0.0):
         xmin = ymin = 0.0
@@ -166,21 +310,19 @@ class Plottable(object):
             ymargin = margins[1]
         else:
             xmargin = ymargin = margins
-        for chunk in self.chunks:
-            # Now we scale
-            chunk.points = [(xmargin + (scale*(p[0]-xmin)),
-                             (ymargin + scale*(p[1]-ymin)))
-                            for p in chunk.points]
+        points, offsets = self.buffer()
+        # Now we scale
+        points[:, 0] = xmargin + (scale*(points[:, 0]-xmin))
+        points[:, 1] = ymargin + scale*(points[:, 1]-ymin)
+        self._rebind(points, offsets)
 
 
     @property
     def bounds(self):
-        bounds = [chunk.bounds for chunk in self.chunks]
-        xmin = min(bound[0] for bound in bounds)
-        ymin = min(bound[1] for bound in bounds)
-        xmax = max(bound[2] for bound in bounds)
-        ymax = max(bound[3] for bound in bounds)
-        return xmin, ymin, xmax, ymax
+        points, _ = self.buffer()
+        xmin, ymin = points.min(axis=0)
+        xmax, ymax = points.max(axis=0)
+        return float(xmin), float(ymin), float(xmax), float(ymax)
 
 
     @staticmethod
@@ -205,27 +347,219 @@ class Plottable(object):
 
     def transform_self(self, x=0.0, y=0.0, scalex=1.0, scaley=1.0):
         """Transform all internal coords by scale, moved by x,y"""
-        self.chunks = self.transform(x, y, scalex, scaley)
+        points, offsets = self.buffer()
+        self._rebind(points * (scalex, scaley) + (x, y), offsets)
 
     def transform(self, x=0.0, y=0.0, scalex=1.0, scaley=1.0):
-        return [chunk.transform(x, y, scalex, scaley) for chunk in self.chunks]
-
-    def optimize_lines(self, chunks=None, limit=100, callback=None):
+        """Returns a transformed copy of every chunk's points as a list of
+        (N, 2) arrays, all sharing one buffer."""
+        if not self.chunks:
+            return list()
+        points, offsets = self.buffer()
+        return np.split(points * (scalex, scaley) + (x, y), offsets[1:-1])
+
+    def merge_endpoints(self, tolerance=0.1, pen_drag=0.0):
+        """
+        Join up chunks whose ends meet within tolerance, so that what the
+        SVG drew as lots of separate strokes gets drawn as one, without
+        lifting the pen. Chunks get reversed as needed to line up. Only
+        chunks with the same pen and weight get merged.
+        The MergeStats count pen lifts before and after the way GCodePost
+        draws the buffer: single points skipped, and hops of pen_drag
+        (our units) or less dragged rather than lifted.
+
+        Algo: hash all the endpoints into an XYHash, then take each chunk
+        in turn and keep pulling out whatever starts (or ends) closest to
+        its tail, then the same off its head. Every lookup is a few grid
+        squares, so this is about linear in the number of chunks.
+        """
+        started = time.perf_counter()
+        chunks = [chunk for chunk in self.chunks if len(chunk)]
+        lifts_before = self._lifts(pen_drag)
+        index = XYHash(chunks)
+        merged = list()
+
+        def _extend(x, y, chunk):
+            # Other pens and weights can't be drawn in the same go, look past them
+            return index.closest(x, y, max_distance=tolerance,
+                                 accept=lambda pline: pline.pen == chunk.pen and pline.weight == chunk.weight)
+
+        for chunk in chunks:
+            if not index.remove(chunk):
+                continue  # Already merged into an earlier one
+            parts = [chunk.points]
+            while True:
+                found = _extend(*parts[-1][-1], chunk)
+                if found is None:
+                    break
+                pline, reverse, _ = found
+                parts.append(pline.points[::-1] if reverse else pline.points)
+            head = list()
+            while True:
+                start = head[-1][0] if head else parts[0][0]
+                found = _extend(*start, chunk)
+                if found is None:
+                    break
+                pline, reverse, _ = found
+                # This one has to finish where we start, so it's backwards
+                # if it was its start that matched
+                head.append(pline.points if reverse else pline.points[::-1])
+            parts = head[::-1] + parts
+            if len(parts) == 1:
+                merged.append(chunk)
+                continue
+            # Drop the doubled up point where the ends meet exactly
+            points = [parts[0]] + [part[1:] if np.array_equal(prev[-1], part[0]) else part
+                                   for prev, part in zip(parts, parts[1:])]
+            merged.append(Plottable.Line(np.concatenate(points), chunk.weight, chunk.pen))
+        self.chunks = merged
+        self.pack()
+        return MergeStats(lifts_before, self._lifts(pen_drag), time.perf_counter() - started)
+
+    def _lifts(self, pen_drag=0.0):
+        # Feedrates don't matter for the lift count
+        return plot_metrics(*self.buffer(), 1.0, 1.0, pen_drag).lifts
+
+    def optimize_lines(self, chunks=None, limit=100, callback=None, method="hash",
+                       bounds=None, workers=None, cancel=None):
         """
         Find the closest line endpoint at the end of a given drawn line,
         and add _that_ to the output list, correctly ordered. Ensures we
         have the shortest hops between lines.
+        The default "hash" method searches the whole drawing via an XYHash.
+        The "window" method is the old brute-force scan, where limit ensures
+        we only scan the next $limit lines for close endpoints.
+        The "hilbert" method doesn't search at all, it sorts along a Hilbert
+        curve, which is worse but fast enough for millions of chunks.
+        The "tiled" method cuts bounds (xmin, ymin, xmax, ymax, in our own
+        units, defaults to our extents) into tiles and does the "hash"
+        search on each one on a pool of workers, see botaplot.util.tiles.
+        Setting cancel (a threading.Event) stops the "hash" search, and the
+        rest of the chunks go on the end as they are.
+        """
+        if callback is not None and not callable(callback):
+            raise TypeError("Callback is not a callable")
+        if method == "window":
+            return self._optimize_lines_windowed(chunks, limit, callback)
+        elif method == "hilbert":
+            return self._optimize_lines_hilbert(chunks, callback)
+        elif method == "tiled":
+            return self._optimize_lines_tiled(chunks, callback, bounds, workers)
+        elif method != "hash":
+            raise ValueError("Unknown optimization method '%s'" % method)
+
+        # The XYHash is a grid of squares. We bin the endpoints for the
+        # lines into it so that we can find the closest one without
+        # scanning, and pull them out as they get drawn.
+        if chunks is not None:
+            orig_chunks = list(chunks)
+        else:
+            orig_chunks = list(self.chunks)
+        total = len(orig_chunks)
+        if not orig_chunks:
+            return orig_chunks
+        line = orig_chunks[0]  # Start us out.
+        out_chunks = [line]
+        index = XYHash(orig_chunks[1:])
+        while len(index) > 0:
+            if len(index) % 10 == 0:
+                if callback is not None:
+                    callback("optimizing", len(index), total)
+                if cancel is not None and cancel.is_set():
+                    break
+            found = index.closest(*line[-1])
+            if found is None:
+                break  # Only unreachable (invalid) endpoints left
+            move_chunk, reverse, _ = found
+            if reverse:
+                move_chunk.reverse()
+            line = move_chunk
+            out_chunks.append(move_chunk)
+        if len(out_chunks) < total:
+            drawn = set(id(chunk) for chunk in out_chunks)
+            out_chunks.extend(chunk for chunk in orig_chunks if id(chunk) not in drawn)
+        if callback is not None:
+            callback("optimizing", 0, total)
+
+        self.chunks = out_chunks
+        return out_chunks
+
+    def improve_order(self, time_budget=5.0, neighbours=8, workers=None):
+        """
+        Polish the current order (run optimize_lines first) with 2-opt and
+        Or-opt moves for up to time_budget seconds, reversing chunks as it
+        goes. See botaplot.util.tour. Returns TourStats, with the pen-up
+        travel before and after.
+        """
+        chunks, empty, starts, ends = self._endpoints(self.chunks)
+        order, flip, stats = improve_tour(starts, ends, time_budget=time_budget,
+                                          neighbours=neighbours, workers=workers)
+        self.chunks = self._reorder(chunks, order, flip) + empty
+        return stats
+
+    def reordered(self, order, flip=None):
+        """A new Plottable with our chunks in order, the ones where flip is
+        set drawn backwards. The points are shared, not copied, and we're
+        left alone, so this is fine while another thread is drawing us."""
+        chunks = list()
+        for i in np.asarray(order).tolist():
+            chunk = self.chunks[i]
+            points = chunk.points[::-1] if flip is not None and flip[i] else chunk.points
+            chunks.append(Plottable.Line(points, chunk.weight, chunk.pen))
+        return Plottable(chunks)
+
+    @staticmethod
+    def _endpoints(chunks):
+        """Splits chunks into (drawable, empty) and returns those plus the
+        (N, 2) starts and ends of the drawable ones"""
+        arrays = [chunk.points for chunk in chunks]
+        lengths = np.fromiter(map(len, arrays), dtype=np.int64, count=len(arrays))
+        drawable = [chunk for chunk, length in zip(chunks, lengths.tolist()) if length]
+        empty = [chunk for chunk, length in zip(chunks, lengths.tolist()) if not length]
+        if not drawable:
+            return drawable, empty, np.empty((0, 2)), np.empty((0, 2))
+        points = np.concatenate(arrays)
+        lengths = lengths[lengths > 0]
+        ends = np.cumsum(lengths)
+        return drawable, empty, points[ends - lengths], points[ends - 1]
+
+    @staticmethod
+    def _reorder(chunks, order, flip):
+        """chunks in order, with the flipped ones reversed"""
+        for i in np.flatnonzero(flip).tolist():
+            chunks[i].reverse()
+        return [chunks[i] for i in order.tolist()]
+
+    def _optimize_lines_hilbert(self, chunks=None, callback=None, key="mid"):
+        """Order chunks along a Hilbert curve, see botaplot.util.hilbert"""
+        orig_chunks = list(self.chunks if chunks is None else chunks)
+        drawable, empty, starts, ends = self._endpoints(orig_chunks)
+        if drawable:
+            order, flip = hilbert_order(starts, ends, key=key)
+            drawable = self._reorder(drawable, order, flip)
+        if callback is not None:
+            callback("optimizing", 0, len(orig_chunks))
+        self.chunks = drawable + empty
+        return self.chunks
+
+    def _optimize_lines_tiled(self, chunks=None, callback=None, bounds=None, workers=None):
+        """Greedy ordering tile by tile in parallel, see botaplot.util.tiles"""
+        orig_chunks = list(self.chunks if chunks is None else chunks)
+        drawable, empty, starts, ends = self._endpoints(orig_chunks)
+        if drawable:
+            order, flip, _ = tiled_order(starts, ends, bounds=bounds, workers=workers)
+            drawable = self._reorder(drawable, order, flip)
+        if callback is not None:
+            callback("optimizing", 0, len(orig_chunks))
+        self.chunks = drawable + empty
+        return self.chunks
+
+    def _optimize_lines_windowed(self, chunks=None, limit=100, callback=None):
+        """
         Brute-force and totally naive. Limit ensures we only scan the next
         $limit lines for close endpoints, and take the closest, so that we
         don't burn a ton of CPU searching the entire line-space every scan.
         """
-
-        # The XYHash is a grid of squares. We bin the endpoints for various lines
-        # into it so that we can more easily find their endpoints. It's a weakref
-        # dict, so when we pull the lines _out_ of orig_chunks, they disappear
-        # from the hash too.
-        if callback is not None and not callable(callback):
-            raise TypeError("Callback is not a callable")
         out_chunks = list()
         if chunks is not None:
             orig_chunks = chunks.copy()
@@ -255,24 +589,20 @@ class Plottable(object):
                 # We found a closer line
                 move_chunk = orig_chunks.pop(next_chunk.index)
                 if next_chunk.reverse:
-                    move_chunk.points.reverse()
-                    #move_chunk.points = np.flip(move_chunk.points)
-                    # if isinstance(move_chunk.points, np.ndarray):
-                    #     move_chunk.points.flip()
-                    # else:
-                    # #     move_chunk.points.reverse()
+                    move_chunk.reverse()
             else:
                 move_chunk = orig_chunks.pop(0)
                 # Special case. Check if it is a better match forwards or backwards.
                 d_e2e = distance(move_chunk[-1], line[-1])
                 d_e2s = distance(line[-1], move_chunk[0])
                 if d_e2s > d_e2e:
-                    move_chunk.points.reverse()
+                    move_chunk.reverse()
 
             next_chunk = NextLine(None, False, MAX_LENGTH, False)  # Which index, how far away
             line = move_chunk
             out_chunks.append(move_chunk)
-        callback("optimizing", len(orig_chunks), chunks and len(chunks) or len(self.chunks))
+        if callback is not None:
+            callback("optimizing", len(orig_chunks), chunks and len(chunks) or len(self.chunks))
 
         self.chunks = out_chunks
         return out_chunks
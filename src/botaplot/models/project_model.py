@@ -2,10 +2,12 @@ import logging
 import os
 from collections import deque, OrderedDict
 
-from rdp import rdp
 from PyQt5.QtCore import pyqtSignal, QThread
 
 from botaplot.util.svg_util import svg2lines, calculate_mm_per_unit, read_svg_in_original_dimensions
+from botaplot.util.geometry_cache import GeometryCache, SVGHeader
+from botaplot.util.anytime import AnytimeOptimizer
+from botaplot.util.motion import MotionEstimate
 from .machine import Machine
 from .plottable import Plottable
 import threading
@@ -39,6 +41,20 @@ class ProjectModel(object):
     callbacks = list()
     default_path = "X/Users/derek/Downloads/Beep Logo Pack 2020-06-24/"
     plot_worker = None
+    # Flattening parameters, these are part of the geometry cache key
+    subdivide_distance = 0.3
+    # Max mm any flattened curve strays from the real one, None to sample every subdivide_distance
+    flatten_tolerance = 0.05
+    rdp_epsilon = 0.2
+    simplify_method = "rdp"  # or "visvalingam"
+    # Join strokes whose ends are this close (mm) into one, None to leave them be
+    merge_tolerance = 0.05
+    # Flatten the SVG across a process pool, worth it for big files
+    parallel_flatten = False
+    # Set to False to always parse the SVG, or to a GeometryCache to put it somewhere else
+    geometry_cache = None
+    # Seconds to keep looking for a better plot order in the background
+    optimize_budget = 60.0
 
     def __init__(self, svg=None, svg_path=None, enabled_groups=None, post=None, machine=None):
         self.svg = svg
@@ -49,6 +65,7 @@ class ProjectModel(object):
         self.plottables = dict()
         self.scale = 1.0
         self.plot_worker = PlotWorker.new(self.machine)
+        self.optimizer = None
 
     @classmethod
     def watch(cls, fun):
@@ -56,16 +73,57 @@ class ProjectModel(object):
         cls.callbacks.append(fun)
 
     @classmethod
-    def load_from_svg(cls, path, callback=None):
+    def get_geometry_cache(cls):
+        if cls.geometry_cache is None:
+            try:
+                cls.geometry_cache = GeometryCache()
+            except OSError as e:
+                logger.warning("Not caching geometry: %s", e)
+                cls.geometry_cache = False
+        return cls.geometry_cache or None
+
+    @classmethod
+    def load_from_svg(cls, path, callback=None, use_cache=True, parallel=None):
         if callback is None:
             callback = lambda x: x
-        svg = read_svg_in_original_dimensions(os.path.normpath(path))
-        cls.current = cls(svg, path, None, None, None)
-        lines = svg2lines(svg, 0.3)
-        logger.info("We have %d line points before optimization" % sum([len(line) for line in lines]))
-        # plottable = Plottable([Plottable.Line(line) for line in lines], callback=callback)
-        plottable = Plottable([Plottable.Line(rdp(line, epsilon=0.2)) for line in lines], callback=callback)
+        if parallel is None:
+            parallel = cls.parallel_flatten
+        path = os.path.normpath(path)
+        cache = cls.get_geometry_cache() if use_cache else None
+        key = None
+        hit = None
+        if cache is not None:
+            with open(path, "rb") as f:
+                key = cache.key(f.read(), distance=cls.subdivide_distance, tolerance=cls.flatten_tolerance,
+                                epsilon=cls.rdp_epsilon, simplify=cls.simplify_method,
+                                merge=cls.merge_tolerance)
+            hit = cache.get(key)
+        if hit is not None:
+            points, offsets, meta = hit
+            logger.info("Geometry cache hit for %s", path)
+            svg = SVGHeader(**meta)
+            plottable = Plottable.from_buffer(points, offsets, callback=callback)
+        else:
+            svg = read_svg_in_original_dimensions(path)
+            lines = svg2lines(svg, cls.subdivide_distance, parallel=parallel, tolerance=cls.flatten_tolerance)
+            plottable = Plottable([Plottable.Line(line) for line in lines], callback=callback)
+            if cls.merge_tolerance:
+                mm_per_unit = calculate_mm_per_unit(svg)
+                pen_drag = Machine.machine_catalog["botaplot_v1"].post.pen_drag_mm / mm_per_unit
+                merged = plottable.merge_endpoints(cls.merge_tolerance / mm_per_unit, pen_drag)
+                logger.info("Merged strokes from %d pen lifts to %d in %.3fs",
+                            merged.lifts_before, merged.lifts_after, merged.seconds)
+            # Leaves everything in one buffer instead of an array per line
+            stats = plottable.simplify(cls.rdp_epsilon, cls.simplify_method)
+            logger.info("Simplified %d points to %d in %.3fs",
+                        stats.points_before, stats.points_after, stats.seconds)
+            if cache is not None:
+                try:
+                    cache.put(key, *plottable.buffer(), meta=SVGHeader.from_svg(svg).as_dict())
+                except OSError as e:
+                    logger.warning("Couldn't cache geometry for %s: %s", path, e)
         logger.info("We have %d line points before optimization" % sum([len(line) for line in plottable]))
+        cls.current = cls(svg, path, None, None, None)
         cls.current.plottables = OrderedDict(all=(plottable, len(plottable)))
         scale = calculate_mm_per_unit(svg)  # 25.4/72.0 #plottable.calculate_dpi_via_svg(svg)
         cls.current.scale = scale
@@ -73,6 +131,64 @@ class ProjectModel(object):
         for callback in cls.callbacks:
             callback("load_from_svg", path)
 
+    def start_optimizing(self):
+        """Returns a new AnytimeOptimizer for the "all" plottable, for the
+        caller to run somewhere, stopping the old one if there was one"""
+        if self.optimizer is not None:
+            self.optimizer.cancel()
+        plottable = self.plottables["all"][0]
+        self.optimizer = AnytimeOptimizer(plottable, self.optimize_budget, bounds=self.tile_bounds(plottable))
+        return self.optimizer
+
+    def tile_bounds(self, plottable):
+        """The machine's limits in plottable's own units (get_transform,
+        backwards), cut down to the part of the bed the drawing's on, for
+        tiling it up to order it (see util.tiles). Just the drawing's bounds
+        if it's nowhere near the bed."""
+        x, y, scalex, scaley = self.get_transform(plottable)
+        (x0, y0), (x1, y1) = self.machine.limits
+        xmin, xmax = sorted(((x0 - x) / scalex, (x1 - x) / scalex))
+        ymin, ymax = sorted(((y0 - y) / scaley, (y1 - y) / scaley))
+        bounds = plottable.bounds
+        clipped = (max(xmin, bounds[0]), max(ymin, bounds[1]), min(xmax, bounds[2]), min(ymax, bounds[3]))
+        if clipped[0] >= clipped[2] or clipped[1] >= clipped[3]:
+            return bounds
+        return clipped
+
+    def use_order(self, order, flip):
+        """Switch the "all" plottable over to an order from the optimizer"""
+        if self.optimizer is None:
+            return
+        plottable = self.optimizer.plottable.reordered(order, flip)
+        self.plottables["all"] = (plottable, len(plottable))
+
+    def use_best_order(self):
+        """Stop optimizing and go with the best order found so far"""
+        if self.optimizer is None:
+            return
+        self.optimizer.cancel()
+        best = self.optimizer.best()
+        if best is not None:
+            self.use_order(best[0], best[1])
+
+    def metrics(self):
+        """PlotMetrics of the "all" plottable, in machine mm"""
+        plottable = self.plottables["all"][0]
+        return self.machine.post.metrics(plottable.transform(*self.get_transform(plottable)))
+
+    def estimate(self):
+        """MotionEstimate of the job for every layer, plus the lot under
+        "total", simulated on the machine with acceleration"""
+        estimates = OrderedDict()
+        post = self.machine.post
+        for name, (plottable, _) in self.plottables.items():
+            lines = plottable.transform(*self.get_transform(plottable))
+            estimates[name] = self.machine.estimate(post.lines2gcodes_gen(lines))
+        estimates["total"] = MotionEstimate(
+            *(sum(getattr(e, field) for e in estimates.values()) for field in MotionEstimate._fields[:-1]),
+            elapsed=None)
+        return estimates
+
     def get_transform(self, plottable):
         bot_dist = self.machine.limits[1][1] + (self.machine.scale[1] * plottable.convert_svg_units_to_mm(
             self.svg.values.get('height', "%fin" % (self.svg.viewbox.height / 72.0))))
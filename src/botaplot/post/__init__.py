@@ -1,7 +1,8 @@
 # This is all the available post processors
 
 from .gcode_base import GCodePost
+from .stream import PostStream
 
 posts = {"bot-a-plot/smoothie": GCodePost}
 
-__all__=["posts", "GCodePost"]
+__all__=["posts", "GCodePost", "PostStream"]
@@ -0,0 +1,143 @@
+"""
+Formatting numbers into G-code with numpy instead of a command at a time.
+
+A FixedTemplate is a format string with nothing but %W.Pf fields in it
+(like "G01 X%4.2f Y%4.2f\\n"). fill() renders a whole array of rows through
+a few of them straight into one preallocated byte buffer, working out
+every digit of every number with array arithmetic. It comes out byte for
+byte the same as Python's % would: the rare values that sit right on a
+rounding tie get formatted by Python itself, and anything it can't do
+(NaN, infinity, huge numbers) makes it give up so the caller can use %.
+"""
+import re
+
+import numpy as np
+
+_SPEC = re.compile(r"%%|%(\d*)\.(\d+)f")
+_POWERS = 10 ** np.arange(19, dtype=np.int64)
+_SPACE, _MINUS, _DOT, _ZERO = (ord(c) for c in " -.0")
+
+
+class FixedTemplate(object):
+    """A format string split into its literal bytes and (width, precision)
+    of each of its %W.Pf fields. Raises ValueError for any other % field."""
+
+    def __init__(self, fmt):
+        self.literals = list()
+        self.specs = list()
+        text, last = "", 0
+        for match in _SPEC.finditer(fmt):
+            text += fmt[last:match.start()]
+            last = match.end()
+            if match.group(0) == "%%":
+                text += "%"
+                continue
+            self.literals.append(text)
+            self.specs.append((int(match.group(1) or 0), int(match.group(2))))
+            text = ""
+        text += fmt[last:]
+        self.literals.append(text)
+        if "%" in _SPEC.sub("", fmt) or any(precision > 15 for _, precision in self.specs):
+            raise ValueError("Only %%W.Pf fields can be filled in bulk: %r" % fmt)
+        self.literals = [literal.encode("ascii") for literal in self.literals]
+
+    def bind(self, index, value):
+        """A copy with field index filled in for good, like a feedrate"""
+        width, precision = self.specs[index]
+        bound = FixedTemplate.__new__(FixedTemplate)
+        bound.specs = self.specs[:index] + self.specs[index + 1:]
+        bound.literals = (self.literals[:index]
+                          + [self.literals[index] + (b"%*.*f" % (width, precision, value))
+                             + self.literals[index + 1]]
+                          + self.literals[index + 2:])
+        return bound
+
+
+def _fields(values, width, precision):
+    """
+    Returns (chars, lengths) for "%W.Pf" % value of every value, chars
+    being (n, M) bytes with each one right aligned, or None if there's
+    any value we can't do.
+    """
+    count = len(values)
+    if count and not np.isfinite(values).all():
+        return None
+    scale = _POWERS[precision]
+    scaled = np.abs(values) * scale
+    if count and scaled.max() >= 2.0 ** 53:
+        return None
+    ints = np.rint(scaled).astype(np.int64)
+    # Multiplying by scale can land either side of a tie, Python knows the real answer
+    tolerance = 4.0 * np.finfo(np.float64).eps * np.maximum(scaled, 1.0)
+    for i in np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) <= tolerance):
+        ints[i] = int(("%.*f" % (precision, abs(values[i]))).replace(".", ""))
+    digits = np.maximum(np.searchsorted(_POWERS, ints // scale, side="right"), 1)
+    negative = np.signbit(values)
+    point = precision + 1 if precision else 0
+    lengths = np.maximum(negative + digits + point, width)
+    columns = int(lengths.max()) if count else 0
+
+    # A digit at a time from the right, smaller ints divide quicker
+    if not count or ints.max() < 2 ** 31:
+        ints = ints.astype(np.int32)
+    chars = np.empty((count, columns), dtype=np.uint8)
+    for right in range(columns):
+        column = columns - 1 - right
+        if precision and right == precision:
+            chars[:, column] = _DOT
+            continue
+        ints, digit = np.divmod(ints, 10)
+        digit = digit.astype(np.uint8) + _ZERO
+        if right < precision:
+            chars[:, column] = digit
+        else:
+            place = right - point
+            chars[:, column] = np.where(place < digits, digit,
+                                        np.where(negative & (place == digits), _MINUS, _SPACE))
+    return chars, lengths
+
+
+def fill(templates, kinds, values):
+    """
+    templates[kinds[i]] % tuple(values[i]) for every row i, all joined up,
+    as bytes. Every template needs as many fields as values has columns.
+    Returns None if there's a value that has to be left to Python.
+    """
+    kinds = np.asarray(kinds)
+    values = np.asarray(values, dtype=np.float64)
+    rows = len(kinds)
+    # Everything the output gets copied from: every template's literals,
+    # then every field's chars. Each row is a run of (start, length)
+    # segments of it, literal, field, literal, ...
+    sources = [np.frombuffer(b"".join(b"".join(t.literals) for t in templates), dtype=np.uint8)]
+    size = len(sources[0])
+    pieces = 2 * max(len(t.specs) for t in templates) + 1
+    starts = np.zeros((rows, pieces), dtype=np.int64)
+    lengths = np.zeros((rows, pieces), dtype=np.int64)
+    literal_start = 0
+    for kind, template in enumerate(templates):
+        which = np.flatnonzero(kinds == kind)
+        for piece, literal in enumerate(template.literals):
+            starts[which, 2 * piece] = literal_start
+            lengths[which, 2 * piece] = len(literal)
+            literal_start += len(literal)
+        for column, (width, precision) in enumerate(template.specs):
+            if not len(which):
+                continue
+            field = _fields(values[which, column], width, precision)
+            if field is None:
+                return None
+            chars, widths = field
+            columns = chars.shape[1]
+            # Right aligned, so skip the columns to the left of each one
+            starts[which, 2 * column + 1] = size + np.arange(len(which)) * columns + columns - widths
+            lengths[which, 2 * column + 1] = widths
+            sources.append(chars.ravel())
+            size += chars.size
+
+    lengths = lengths.ravel()
+    total = int(lengths.sum())
+    # Where every output byte comes from: its segment's start, plus how far into it we are
+    offsets = starts.ravel() - (np.cumsum(lengths) - lengths)
+    index = np.repeat(offsets, lengths) + np.arange(total)
+    return np.concatenate(sources)[index].tobytes()
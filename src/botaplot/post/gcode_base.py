@@ -1,5 +1,29 @@
-from botaplot.util.util import distance
+import copy
+import io
+from collections import namedtuple
+
+import numpy as np
+from botaplot.util.util import distance, MAX_LENGTH
+from botaplot.util.arcs import arc_offset, fit_arcs
+from botaplot.util.feeds import FeedStats, plan_feeds
+from botaplot.util.metrics import as_buffer, dwell_seconds, plot_metrics
+from botaplot.util.motion import simulate
 from .base import BasePost
+from .fixed import FixedTemplate, fill
+
+
+class CompactStats(namedtuple("CompactStats", ["bytes_before", "bytes_after", "commands_before", "commands_after"])):
+    """What compact mode saves on a job"""
+    __slots__ = ()
+
+    @property
+    def saved(self):
+        return self.bytes_before - self.bytes_after
+
+    def __str__(self):
+        return "%d bytes down to %d (%.0f%% saved), %d commands down to %d" % (
+            self.bytes_before, self.bytes_after, 100.0 * self.saved / max(self.bytes_before, 1),
+            self.commands_before, self.commands_after)
 
 
 class GCodePost(BasePost):
@@ -42,7 +66,31 @@ class GCodePost(BasePost):
     ]
 
     feedrate = 20*60.0  # MM/Min
+    travel_feedrate = 50*60.0  # MM/Min, what the machine does G0 at
     pen_drag_mm = 0.75  # How far we'll drag then pen between lines
+    block_size = 1 << 20  # Roughly how many bytes of G-code the bulk writer formats at once
+    # What every move comes out as, shared by lines2gcodes_gen and gcode_blocks
+    move_format = "G0 X%4.2f Y%4.2f"
+    drag_format = "G01 X%4.2f Y%4.2f ; Skipping PEN UPDOWN for very short drag."
+    draw_format = "G01 F%5.2f X%4.2f Y%4.2f"
+    # Compact mode: no spaces or comments, G and F only when they change,
+    # only the axes that move, and moves that go nowhere left out
+    compact = False
+    precision = 2  # Decimals in compact mode, match it to the machine's resolution
+    relative = False  # Compact mode in relative (G91) coordinates
+    # Fit arcs to curves and send them as G2/G3, staying within this many
+    # mm of the original points, or None for straight lines only
+    arc_tolerance = None
+    arc_min_chord = 0.1  # mm, shorter arcs risk looking like full circles once rounded
+    arc_format = "G0%d F%5.2f X%4.2f Y%4.2f I%.3f J%.3f"  # 2 (clockwise) or 3, feed, X, Y, I, J
+    # Plan a feed for every segment, from feedrate in the tightest corners
+    # up to this on the straights, or None for feedrate everywhere. See
+    # util.feeds, it plans with the acceleration and junction deviation of
+    # the machine we post for.
+    max_feedrate = None
+    machine = None  # The Machine we post for, it sets this
+    feed_step = 60.0  # mm/min, planned feeds get rounded down to these so F changes less often
+    planned_draw_format = "G01 X%4.2f Y%4.2f"  # Drawing when the planned feed hasn't changed
 
     def util_home(self):
         return ["%s\n" % line for line in self.preamble]
@@ -64,13 +112,297 @@ class GCodePost(BasePost):
             self.write_lines_to_fp(lines, gc)
 
     def write_lines_to_fp(self, lines, gc):
-        for stanza in self.lines2gcodes_gen(lines):
-            gc.write("%s\n" % stanza)
+        """Same as writing out every command lines2gcodes_gen makes, a line
+        at a time, only a lot quicker. gc can be a text or binary file."""
+        binary = isinstance(gc, (io.RawIOBase, io.BufferedIOBase)) or "b" in getattr(gc, "mode", "")
+        for block in self.gcode_blocks(lines):
+            gc.write(block if binary else block.decode("ascii"))
+
+    def _drawn(self, points, offsets):
+        """(points, offsets, lift) for just the lines that get drawn (single
+        points are skipped), lift being whether we lift the pen to get to
+        each one, the same test lines2gcodes_gen does"""
+        lengths = np.diff(offsets)
+        drawn = np.flatnonzero(lengths > 1)
+        points = points[np.repeat(lengths > 1, lengths)]
+        offsets = np.zeros(len(drawn) + 1, dtype=np.int64)
+        np.cumsum(lengths[drawn], out=offsets[1:])
+        # Lift unless it's a short hop, and NaN is never short
+        starts, ends = points[offsets[1:-1]], points[offsets[1:-1] - 1]
+        dx, dy = (starts - ends).T
+        valid = ~(np.isnan(starts).any(axis=1) | np.isnan(ends).any(axis=1))
+        lift = np.ones(len(drawn), dtype=bool)
+        lift[1:] = np.where(valid, np.sqrt(dx * dx + dy * dy) > self.pen_drag_mm,
+                            MAX_LENGTH > self.pen_drag_mm)
+        return points, offsets, lift
+
+    @staticmethod
+    def _joined(commands, block_size):
+        """Commands joined up into bytes blocks of about block_size"""
+        block, size = list(), 0
+        for command in commands:
+            block.append(command)
+            size += len(command) + 1
+            if size >= block_size:
+                yield ("\n".join(block) + "\n").encode("ascii")
+                block, size = list(), 0
+        if block:
+            yield ("\n".join(block) + "\n").encode("ascii")
+
+    def _bulk_templates(self):
+        """FixedTemplates for drawing, short drags and pen lifts, or None
+        if our formats aren't ones fill can do"""
+        stanza = lambda commands: "".join("%s\n" % command for command in commands).replace("%", "%%")
+        try:
+            templates = [FixedTemplate(self.draw_format + "\n").bind(0, self.feedrate),
+                         FixedTemplate(self.drag_format + "\n"),
+                         FixedTemplate(stanza(self.penup) + self.move_format + "\n" + stanza(self.pendown))]
+        except (ValueError, IndexError):
+            return None
+        if any(len(template.specs) != 2 for template in templates):
+            return None
+        return templates
+
+    def gcode_blocks(self, lines, block_size=None):
+        """
+        The whole program lines2gcodes_gen makes, newlines and all, as
+        bytes in blocks of about block_size. Instead of formatting a
+        command at a time, every block gets its coordinates formatted all
+        at once by post.fixed, or if it can't, by one big format string
+        (the same formats lines2gcodes_gen uses, either way the output is
+        byte for byte the same).
+        """
+        if self.compact or self.arc_tolerance or self.max_feedrate:
+            # Short commands, arcs or feeds that change, nothing much to gain formatting them in bulk
+            yield from self._joined(self.lines2gcodes_gen(lines), block_size or self.block_size)
+            return
+        points, offsets = as_buffer(lines)
+        block_points = max(1, (block_size or self.block_size) // 32)
+        stanza = lambda commands: "".join("%s\n" % command for command in commands)
+        yield (stanza(self.preamble) + stanza(self.penup)).encode("ascii")
+
+        points, offsets, lift = self._drawn(points, offsets)
+        if len(lift):
+            # What every point comes out as: 0 drawn, 1 dragged to, 2 pen lifted and moved to
+            kinds = np.zeros(len(points), dtype=np.int8)
+            kinds[offsets[:-1]] = 1 + lift
+            templates = self._bulk_templates()
+            formats = (stanza([self.draw_format]), stanza([self.drag_format]),
+                       stanza(self.penup).replace("%", "%%") + stanza([self.move_format])
+                       + stanza(self.pendown).replace("%", "%%"))
+            for lo in range(0, len(points), block_points):
+                hi = min(lo + block_points, len(points))
+                block = None
+                if templates is not None:
+                    block = fill(templates, kinds[lo:hi], points[lo:hi])
+                if block is None:
+                    # (feedrate, x, y) for drawing, just (x, y) otherwise
+                    values = np.empty((hi - lo, 3))
+                    values[:, 0] = self.feedrate
+                    values[:, 1:] = points[lo:hi]
+                    used = np.ones((hi - lo, 3), dtype=bool)
+                    used[:, 0] = kinds[lo:hi] == 0
+                    fmt = "".join([formats[kind] for kind in kinds[lo:hi].tolist()])
+                    block = (fmt % tuple(values[used].tolist())).encode("ascii")
+                yield block
+        yield stanza(self.epilog).encode("ascii")
+
+    def count_commands(self, lines):
+        """How many commands lines2gcodes_gen will yield for these lines,
+        without actually formatting any of them."""
+        if self.arc_tolerance:
+            # No way of knowing how many arcs there'll be without fitting them
+            return sum(1 for _ in self.lines2gcodes_gen(lines))
+        count = len(self.preamble) + len(self.penup) + len(self.epilog)
+        if self.compact:
+            points, offsets, lift = self._drawn(*as_buffer(lines))
+            if not len(lift):
+                return count
+            _, moved = self._quantize(points)
+            count += int(np.count_nonzero(lift)) * (len(self.penup) + len(self.pendown))
+            return count + int(np.count_nonzero(moved.any(axis=1))) + (2 if self.relative else 0)
+        lines = [line for line in lines if len(line) > 1]
+        if not lines:
+            return count
+        count += sum(len(line) - 1 for line in lines)
+        starts = np.array([line[0] for line in lines[1:]], dtype=np.float64).reshape(-1, 2)
+        ends = np.array([line[-1] for line in lines[:-1]], dtype=np.float64).reshape(-1, 2)
+        # NaN never compares as a short drag, just like distance() says.
+        short = np.hypot(*(starts - ends).T) <= self.pen_drag_mm
+        lifts = 1 + len(short) - np.count_nonzero(short)
+        count += lifts * (len(self.penup) + 1 + len(self.pendown))
+        count += np.count_nonzero(short)
+        return int(count)
+
+    def metrics(self, lines):
+        """PlotMetrics (pen down/up mm, lifts, points, estimated seconds)
+        for posting these lines, without posting them"""
+        points, offsets = as_buffer(lines)
+        return plot_metrics(
+            points, offsets, self.feedrate, self.travel_feedrate, self.pen_drag_mm,
+            lift_seconds=dwell_seconds(self.penup) + dwell_seconds(self.pendown),
+            fixed_seconds=dwell_seconds(self.preamble + self.penup + self.epilog))
+
+    def feed_savings(self, lines):
+        """FeedStats, how much quicker planning feeds makes these lines
+        than drawing them all at feedrate, simulated on our machine"""
+        planned, flat = copy.copy(self), copy.copy(self)
+        flat.max_feedrate = None
+        acceleration, junction_deviation = self._limits()
+        seconds = [simulate(list(post.lines2gcodes_gen(lines)), acceleration, junction_deviation,
+                            self.travel_feedrate, self.feedrate).seconds for post in (flat, planned)]
+        points, offsets, _ = self._drawn(*as_buffer(lines))
+        feeds = planned._feeds(points, offsets)
+        return FeedStats(seconds[0], seconds[1], len(np.unique(feeds)) if feeds is not None else 1)
+
+    def compaction(self, lines):
+        """CompactStats, how much smaller compact mode makes the G-code for
+        these lines than the full fat version"""
+        verbose, compact = copy.copy(self), copy.copy(self)
+        verbose.compact, compact.compact = False, True
+        return CompactStats(sum(len(block) for block in verbose.gcode_blocks(lines)),
+                            sum(len(block) for block in compact.gcode_blocks(lines)),
+                            verbose.count_commands(lines), compact.count_commands(lines))
+
+    def _quantize(self, points):
+        """Points rounded to precision decimals, in units of the last one,
+        and which axes moved (to the machine) since the point before"""
+        quantized = np.rint(points * 10.0 ** self.precision)
+        moved = np.ones(quantized.shape, dtype=bool)
+        # NaN compares unequal, so it always counts as moving
+        moved[1:] = quantized[1:] != quantized[:-1]
+        return quantized, moved
+
+    def _number(self, quantized, precision=None):
+        """A quantized coordinate (in units of the last of precision
+        decimals) in as few characters as it takes"""
+        if quantized != quantized:
+            return "nan"
+        precision = self.precision if precision is None else precision
+        digits = "%d" % abs(quantized)
+        if precision:
+            digits = digits.rjust(precision + 1, "0")
+            whole, fraction = digits[:-precision], digits[-precision:].rstrip("0")
+            digits = whole + "." + fraction if fraction else whole
+        return "-" + digits if quantized < 0 else digits
+
+    def _limits(self):
+        """(acceleration, junction deviation) of the machine we post for,
+        or a default Machine's if we haven't got one"""
+        # Circular import, machines have posts
+        from botaplot.models.machine import Machine
+        machine = self.machine or Machine
+        return machine.acceleration, machine.junction_deviation
+
+    def _feeds(self, points, offsets):
+        """Planned feed for the segment finishing at every point, see
+        util.feeds.plan_feeds, or None if we aren't planning feeds"""
+        if not self.max_feedrate:
+            return None
+        return plan_feeds(points, offsets, self.feedrate, max(self.max_feedrate, self.feedrate),
+                          *self._limits(), self.feed_step)
+
+    def _moves(self, points):
+        """(end, center, clockwise) for every move drawing points, see
+        util.arcs.fit_arcs, all straight unless we're fitting arcs"""
+        if not self.arc_tolerance:
+            return ((end, None, False) for end in range(1, len(points)))
+        # Compact mode rounds to precision, arc_format to 2 decimals
+        return fit_arcs(points, self.arc_tolerance, min_chord=self.arc_min_chord,
+                        decimals=self.precision if self.compact else 2)
+
+    def _compact_gen(self, lines):
+        yield from self.preamble
+        yield from self.penup
+        points, offsets, lift = self._drawn(*as_buffer(lines))
+        if len(lift):
+            quantized, moved = self._quantize(points)
+            quantized, moved = quantized.tolist(), moved.tolist()
+            feeds = self._feeds(points, offsets)
+            feed = None
+            mode = None
+            absolute = True  # Until the first move puts us somewhere we know
+
+            def words(i, previous):
+                """X and Y for moving from points[previous] to points[i],
+                just the axes that change"""
+                here, there = quantized[i], quantized[previous]
+                if previous == i - 1:
+                    x, y = moved[i]
+                else:
+                    x, y = here[0] != there[0], here[1] != there[1]
+                if not absolute:
+                    here = (here[0] - there[0], here[1] - there[1])
+                return (("X" + self._number(here[0])) if x else "") + (("Y" + self._number(here[1])) if y else "")
+
+            def feed_word(previous, i):
+                """F for drawing from points[previous] to points[i], if it's changed"""
+                wanted = self.feedrate if feeds is None else float(feeds[previous + 1:i + 1].min())
+                return "" if wanted == feed else "F" + ("%.2f" % wanted).rstrip("0").rstrip("."), wanted
+
+            for chunk, (lo, hi) in enumerate(zip(offsets[:-1].tolist(), offsets[1:].tolist())):
+                if lift[chunk]:
+                    yield from self.penup
+                    if any(moved[lo]):
+                        yield "G0" + words(lo, lo - 1)
+                        mode = "G0"
+                        if self.relative and absolute:
+                            yield "G91"
+                            absolute = False
+                    yield from self.pendown
+                elif any(moved[lo]):
+                    yield ("" if mode == "G1" else "G1") + words(lo, lo - 1)
+                    mode = "G1"
+                previous = lo
+                for end, center, clockwise in self._moves(points[lo:hi]):
+                    i = lo + end
+                    if center is None:
+                        if any(moved[i]):
+                            word, wanted = feed_word(previous, i)
+                            yield ("" if mode == "G1" else "G1") + word + words(i, previous)
+                            mode, feed = "G1", wanted
+                    else:
+                        offset = arc_offset(points[previous], points[i], center, self.precision)
+                        code = "G2" if clockwise else "G3"
+                        word, wanted = feed_word(previous, i)
+                        yield ("" if mode == code else code) + word + words(i, previous) + "".join(
+                            "%s%s" % (letter, self._number(round(value * 10.0 ** (self.precision + 1)),
+                                                           self.precision + 1))
+                            for letter, value in zip("IJ", offset) if abs(value) >= 0.5 * 10.0 ** -(self.precision + 1))
+                        mode, feed = code, wanted
+                    previous = i
+            if not absolute:
+                yield "G90"
+        yield from self.epilog
+
+    def _arc_gen(self, points, feed=None):
+        """Commands drawing points from the first one on, in arcs where they
+        fit and at planned feeds if we're planning them. feed is the one the
+        machine's already at, and the one it's left at gets returned."""
+        feeds = self._feeds(points, [0, len(points)])
+        start = 0
+        for end, center, clockwise in self._moves(points):
+            x, y = points[end]
+            wanted = self.feedrate if feeds is None else float(feeds[start + 1:end + 1].min())
+            if center is None:
+                if feeds is None or wanted != feed:
+                    yield self.draw_format % (wanted, x, y)
+                else:
+                    yield self.planned_draw_format % (x, y)
+            else:
+                i, j = arc_offset(points[start], points[end], center, 2)
+                yield self.arc_format % (2 if clockwise else 3, wanted, x, y, i, j)
+            start, feed = end, wanted
+        return feed
 
     def lines2gcodes_gen(self, lines):
+        if self.compact:
+            yield from self._compact_gen(lines)
+            return
         yield from self.preamble
         yield from self.penup
         lastpos = None
+        feed = None
         for line in lines:
             if len(line) <= 1:
                 # Skip lines that are just a dot
@@ -84,16 +416,17 @@ class GCodePost(BasePost):
                or distance(lastpos, line[0]) > self.pen_drag_mm:
                 # Long drag, so write entire penup/pendown stanza
                 yield from self.penup
-                yield "G0 X%4.2f Y%4.2f" % (line[0][0], line[0][1])
+                yield self.move_format % (line[0][0], line[0][1])
                 yield from self.pendown
             else:
                 # Short drag, keep the pen down and save some time.
-                yield ("G01 X%4.2f Y%4.2f "
-                       "; Skipping PEN UPDOWN for very short drag." %
-                       (line[0][0], line[0][1]))
+                yield self.drag_format % (line[0][0], line[0][1])
 
             # Then draw the rest of the line at regular feed rates.
-            for (x, y) in line[1:]:
-                yield "G01 F%5.2f X%4.2f Y%4.2f" % (self.feedrate, x, y)
+            if self.arc_tolerance or self.max_feedrate:
+                feed = yield from self._arc_gen(np.asarray(getattr(line, "points", line), dtype=np.float64), feed)
+            else:
+                for (x, y) in line[1:]:
+                    yield self.draw_format % (self.feedrate, x, y)
             lastpos = line[-1]
         yield from self.epilog
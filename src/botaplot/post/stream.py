@@ -0,0 +1,82 @@
+import logging
+import threading
+from queue import Queue, Full
+
+logger = logging.getLogger(__name__)
+
+
+class _PostFailed(object):
+    def __init__(self, exc):
+        self.exc = exc
+
+
+_DONE = object()
+
+
+class PostStream(object):
+    """
+    A plot job that posts its commands lazily, instead of building the whole
+    program up front. A producer thread runs the post's lines2gcodes_gen
+    into a bounded queue, in small batches, so the first command is ready
+    to go straight away and memory use doesn't grow with the job size.
+    len() is the precomputed command count, for progress reporting.
+    Each iteration starts a fresh producer, so a stream can be replayed.
+    """
+
+    batch_size = 256  # Commands per queue entry
+    maxsize = 64  # Batches we'll buffer ahead of the consumer
+    estimate = None  # Simulated seconds at the end of each command, if anyone worked them out
+
+    def __init__(self, post, lines, batch_size=None, maxsize=None):
+        self.post = post
+        self.lines = lines
+        self.batch_size = batch_size or self.batch_size
+        self.maxsize = maxsize or self.maxsize
+        self._total = post.count_commands(lines)
+
+    def __len__(self):
+        return self._total
+
+    def __repr__(self):
+        return "<PostStream: %d commands>" % self._total
+
+    def __iter__(self):
+        queue = Queue(self.maxsize)
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(queue, stop), daemon=True)
+        producer.start()
+        try:
+            while True:
+                batch = queue.get()
+                if batch is _DONE:
+                    return
+                if isinstance(batch, _PostFailed):
+                    raise batch.exc
+                yield from batch
+        finally:
+            stop.set()  # Consumer went away, so tell the producer to quit.
+
+    def _put(self, queue, stop, item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _produce(self, queue, stop):
+        try:
+            batch = list()
+            for cmd in self.post.lines2gcodes_gen(self.lines):
+                batch.append(cmd)
+                if len(batch) >= self.batch_size:
+                    if not self._put(queue, stop, batch):
+                        return
+                    batch = list()
+            if batch and not self._put(queue, stop, batch):
+                return
+            self._put(queue, stop, _DONE)
+        except Exception as exc:
+            logger.exception("Post processing failed mid-stream.")
+            self._put(queue, stop, _PostFailed(exc))
@@ -1,21 +1,114 @@
 import logging
+import threading
 import time
+from collections import deque, namedtuple
 logger=logging.getLogger(__name__)
 
 
+class FlowMetrics(namedtuple("FlowMetrics", ["lookahead", "in_flight", "in_flight_bytes", "occupancy", "queued",
+                                             "rtt_p50", "rtt_p90", "rtt_p99", "acks"])):
+    """How a plot's flow control is doing: the window (commands), what's
+    in flight, in flight bytes as a fraction of the RX buffer, how many
+    commands look to be queued up in the controller (adaptive only) and
+    ACK round trip percentiles (seconds) over the last rtt_history"""
+    __slots__ = ()
+
+    def __str__(self):
+        return "window %d, %d in flight (%d bytes, %.0f%% of RX), ~%.1f queued, RTT %.1f/%.1f/%.1fms, %d acks" % (
+            self.lookahead, self.in_flight, self.in_flight_bytes, 100.0 * self.occupancy, self.queued,
+            1000.0 * self.rtt_p50, 1000.0 * self.rtt_p90, 1000.0 * self.rtt_p99, self.acks)
+
+
 class PlotJobCancelled(RuntimeError):
     """Special exception for murdering a plotter job"""
     pass
 
 
 class SimpleAsciiProtocol(object):
-    """Protocol that sends pen commands with newlines between"""
+    """Protocol that sends pen commands with newlines between
+
+    flow_control picks how much we keep in flight while plotting:
+     * "lines" keeps up to transport.lookahead commands waiting for an OK.
+     * "chars" keeps up to rx_buffer_size BYTES waiting for an OK, like
+       GRBL's character counting, so the controller's receive buffer stays
+       as full as possible without overflowing it.
+     * "adaptive" counts lines, but works out the window as it goes,
+       between min_lookahead and max_lookahead, from how long OKs take to
+       come back. The quickest round trip is the link on its own, anything
+       over that is commands queueing up in the controller, and we try to
+       keep between queue_low and queue_high of those (like TCP Vegas), so
+       the planner doesn't run dry but the RX buffer mostly doesn't fill
+       up either. It can still overrun a little while the planner's first
+       filling up, where "chars" never does.
+    metrics() says how it's going, live.
+    """
 
-    def __init__(self, wait_for_ok=True):
+    flow_controls = ("lines", "chars", "adaptive")
+    pause_timeout = 1.0  # Backstop, we normally get woken up straight away
+    reader_thread = True  # Have the transport read OKs on a thread of its own while plotting
+    coalesce_writes = True  # Write as many commands at once as the window has room for
+    min_lookahead = 1
+    max_lookahead = 64
+    queue_low = 1.0  # Commands queued in the controller we aim for, adaptive flow control
+    queue_high = 2.0
+    rtt_history = 1024  # Round trips kept for metrics()
+
+    def __init__(self, wait_for_ok=True, flow_control="lines", rx_buffer_size=128):
+        if flow_control not in self.flow_controls:
+            raise ValueError("Unknown flow control '%s'" % flow_control)
         self.wait_for_ok = wait_for_ok
-        self.paused = True
+        self.flow_control = flow_control
+        self.rx_buffer_size = rx_buffer_size
+        self._cv = threading.Condition()
+        self._paused = True
+        self._die = False
         self.ready = True
-        self.die = False
+        self.lookahead = None  # The window while plotting, see transport.lookahead
+        self._in_flight = deque()  # Byte counts of the commands waiting for an OK
+        self._in_flight_bytes = 0
+        self._sent = deque()  # When they were written
+        self._rtts = deque(maxlen=self.rtt_history)
+        self._queued = 0.0
+
+    @property
+    def paused(self):
+        return self._paused
+
+    @paused.setter
+    def paused(self, paused):
+        with self._cv:
+            self._paused = paused
+            self._cv.notify_all()
+
+    @property
+    def die(self):
+        return self._die
+
+    @die.setter
+    def die(self, die):
+        with self._cv:
+            self._die = die
+            self._cv.notify_all()
+
+    def wake(self):
+        """Wake up a paused plot, so that it runs its idle callback"""
+        with self._cv:
+            self._cv.notify_all()
+
+    def _wait_while_paused(self, idle=None):
+        """Block until we're unpaused or killed, running idle() every time
+        something wakes us up. Returns False if idle() cancelled the job."""
+        while self._paused and not self._die:
+            with self._cv:
+                if self._paused and not self._die:
+                    self._cv.wait(self.pause_timeout)
+            if idle is not None:
+                try:
+                    idle()
+                except PlotJobCancelled:
+                    logger.error("Job cancelled via PlotJobCancelled while paused")
+                    return False
+        return True
 
     def single(self, cmd, transport):
         logger.info("Send cmd:'%s'" % cmd)
@@ -26,39 +119,131 @@ class SimpleAsciiProtocol(object):
                 logger.error("Response: '%s'", response)
                 raise IOError("Invalid response from upstream plotter.")
 
-    def plot(self, cmds_source, transport, callback=None):
+    def _read_ok(self, transport):
+        response = transport.readline().decode('ascii').strip()
+        if response is None or not response or "OK" not in response.upper():
+            logger.error("Response: '%s'", response)
+            raise IOError("Invalid response from upstream plotter.")
+
+    def _ack(self, transport):
+        """Wait for the next OK and take its command off the in flight list"""
+        self._read_ok(transport)
+        self._in_flight_bytes -= self._in_flight.popleft()
+        if self._sent:
+            self._rtts.append(transport.response_time - self._sent.popleft())
+            if self.flow_control == "adaptive":
+                self._adapt()
+
+    def _adapt(self):
+        """Once a window's worth of OKs are back, move the window a command
+        towards keeping queue_low to queue_high queued in the controller"""
+        self._round_acks += 1
+        self._round_rtt = min(self._round_rtt, self._rtts[-1])
+        # The whole job's quickest, recent ones are all queued up once the planner's busy
+        self._base_rtt = min(self._base_rtt, self._rtts[-1])
+        if self._round_acks < self.lookahead:
+            return
+        self._queued = self.lookahead * (1.0 - self._base_rtt / max(self._round_rtt, 1e-9))
+        if self._queued < self.queue_low:
+            self.lookahead = min(self.lookahead + 1, self.max_lookahead)
+        elif self._queued > self.queue_high:
+            self.lookahead = max(self.lookahead - 1, self.min_lookahead)
+        self._round_acks, self._round_rtt = 0, float("inf")
+
+    def metrics(self):
+        """FlowMetrics for the plot going on now, or the last one"""
+        rtts = sorted(self._rtts)
+        percentile = lambda p: rtts[min(int(p * len(rtts)), len(rtts) - 1)] if rtts else 0.0
+        return FlowMetrics(self.lookahead or 0, len(self._in_flight), self._in_flight_bytes,
+                           self._in_flight_bytes / float(self.rx_buffer_size), self._queued,
+                           percentile(0.5), percentile(0.9), percentile(0.99), len(rtts))
+
+    def _write(self, transport, pending):
+        """Write out every command in pending in one go, noting when for
+        timing the OKs, if there'll be any"""
+        if pending:
+            transport.write(b"".join(pending))
+            if self.wait_for_ok:
+                self._sent.extend([time.monotonic()] * len(pending))
+            pending.clear()
+
+    def plot(self, cmds_source, transport, callback=None, idle=None):
+        """Send every command in cmds_source, which can be a list or a lazy
+        source such as a PostStream, as long as it has a len().
+        While paused, idle() is called whenever we're woken up, and can
+        raise PlotJobCancelled to give up on the job.
+        With coalesce_writes, commands pile up until the window is full
+        and then go out in one write, and with reader_thread the OKs get
+        read on the transport's own thread, so after waiting for one we can
+        pick up all the others that have come in and fill the window back
+        up in one go. Not waiting for OKs, they go out lookahead at a time."""
         self.ready = False
         self.paused = False
-        pending_oks = 0
-        for i, cmd in enumerate(cmds_source):
-            while self.paused and not self.die:
-                time.sleep(1)
-            if self.die:
-                break
-            # print("Sending %s" % cmd)
-            # print("Callback:", callback, callable(callback))
-
-            if callback is not None and callable(callback):
-                try:
-                    callback(i, len(cmds_source), cmd)
-                except PlotJobCancelled:
-                    logger.error("Job cancelled via PlotJobCancelled")
+        in_flight = self._in_flight = deque()
+        self._in_flight_bytes = 0
+        self._sent = deque()
+        self._rtts = deque(maxlen=self.rtt_history)
+        self._queued = 0.0
+        self._base_rtt = self._round_rtt = float("inf")
+        self._round_acks = 0
+        self.lookahead = transport.lookahead
+        if self.flow_control == "adaptive":
+            # Start small and open up, rather than overrun straight away
+            self.lookahead = self.min_lookahead
+        pending = list()  # Commands we haven't written yet
+        by_chars = self.flow_control == "chars"
+        total = len(cmds_source)
+        duplex = self.wait_for_ok and self.reader_thread
+        if duplex:
+            transport.start_reader()
+        try:
+            for i, cmd in enumerate(cmds_source):
+                if self._paused:
+                    self._write(transport, pending)
+                    # Commands sent while we're paused need the OKs to themselves
+                    while in_flight and not self.die:
+                        self._ack(transport)
+                    if not self._wait_while_paused(idle):
+                        break
+                if self._die:
                     break
+                # print("Sending %s" % cmd)
+                # print("Callback:", callback, callable(callback))
 
-            pending_oks += 1
-            transport.write(("%s\n" % cmd).encode('ascii'))
-            if self.wait_for_ok:
-                while pending_oks > transport.lookahead:
-                    print("Pending OKs:", pending_oks)
-                    if self.die:
+                if callback is not None and callable(callback):
+                    try:
+                        callback(i, total, cmd)
+                    except PlotJobCancelled:
+                        logger.error("Job cancelled via PlotJobCancelled")
                         break
-                    response = transport.readline().decode('ascii').strip()
-                    print("Got response", response)
-                    if response is None or not response or "OK" not in response.upper():
-                        print("Response: '%s'" % response)
-                        raise IOError("Invalid response from upstream plotter.")
-                    else:
-                        pending_oks -= 1
+
+                data = ("%s\n" % cmd).encode('ascii')
+                if self.wait_for_ok:
+                    # Wait until the controller has room for the whole command,
+                    # or another line, writing out what we've got first.
+                    while in_flight and (self._in_flight_bytes + len(data) > self.rx_buffer_size if by_chars
+                                         else len(in_flight) > self.lookahead):
+                        self._write(transport, pending)
+                        if self.die:
+                            break
+                        self._ack(transport)
+                        while in_flight and transport.responses_ready():
+                            self._ack(transport)
+                    in_flight.append(len(data))
+                    self._in_flight_bytes += len(data)
+                pending.append(data)
+                if not self.coalesce_writes or (not self.wait_for_ok and len(pending) >= self.lookahead):
+                    self._write(transport, pending)
+            self._write(transport, pending)
+            if self.wait_for_ok:
+                # Collect the stragglers, so we're only done when the plotter is.
+                while in_flight and not self.die:
+                    self._ack(transport)
+        finally:
+            if duplex:
+                transport.stop_reader()
+        if self._rtts:
+            logger.info("Flow control: %s", self.metrics())
         self.ready = True  # We're done.
 
     def rewind(self):
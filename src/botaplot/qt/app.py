@@ -6,7 +6,7 @@ coloredlogs.install(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 import sys
 import os
-from PyQt5.QtCore import Qt, QVariant
+from PyQt5.QtCore import Qt, QVariant, QThreadPool
 from PyQt5.QtGui import QIcon, QCloseEvent, QKeySequence, QStandardItemModel, QStandardItem, QPixmap
 from PyQt5.QtWidgets import (QMainWindow, QAction, qApp, QWidget,
                              QFileDialog, QHBoxLayout, QDockWidget,
@@ -15,6 +15,7 @@ from botaplot.resources import resource_path
 from botaplot.models.project_model import ProjectModel
 from botaplot.qt.plot_widget import QPlotRunWidget
 from botaplot.qt.plot_preview import QPlotPreviewWidget
+from botaplot.qt.plot_monitor import QOptimizeRunnable
 
 
 class BAPMainWindow(QMainWindow):
@@ -73,7 +74,7 @@ class BAPMainWindow(QMainWindow):
         logger.info("Loaded new svg: %s", value)
         if evname == "load_from_svg":
             self.drawing.drawables = None
-            self.statusBar().showMessage(f"Loaded {os.path.basename(value)}")
+            self.statusBar().showMessage(f"Loaded {os.path.basename(value)}: {ProjectModel.current.metrics()}")
             # for group in ProjectModel.current.svg.elements(conditional=lambda x: isinstance(x, Group)):
             #     print("Found group: ", group.values)
             self.layer_model.clear()
@@ -84,6 +85,26 @@ class BAPMainWindow(QMainWindow):
                 item.setFlags(Qt.ItemIsUserCheckable | Qt.ItemIsEnabled)
                 item.setData(QVariant(Qt.Checked), Qt.CheckStateRole)
                 self.layer_model.appendRow(item)
+            self.start_optimizer()
+
+    def start_optimizer(self):
+        """Look for better plot orders in the background, the preview (and
+        whatever gets plotted) switches over to each one as it turns up"""
+        optimizer = ProjectModel.current.start_optimizing()
+        self.optimize_runnable = QOptimizeRunnable(optimizer)
+
+        def improved(order, flip, travel, stage):
+            # Late arrivals from a cancelled run don't count, Plot already
+            # took the best one
+            if optimizer is not ProjectModel.current.optimizer or optimizer.cancelled.is_set():
+                return
+            ProjectModel.current.use_order(order, flip)
+            self.drawing.drawables = None
+            self.drawing.update()
+            self.statusBar().showMessage(f"{ProjectModel.current.metrics()} ({stage})")
+
+        self.optimize_runnable.signals.improved.connect(improved)
+        QThreadPool.globalInstance().start(self.optimize_runnable)
 
 
 
@@ -179,6 +200,8 @@ class BAPMainWindow(QMainWindow):
         #     event.accept()
         # else:
         #     event.ignore()
+        if ProjectModel.current is not None and ProjectModel.current.optimizer is not None:
+            ProjectModel.current.optimizer.cancel()
         event.accept()
 
 def run_app():
@@ -1,17 +1,27 @@
 from PyQt5.QtCore import (Qt, pyqtSlot, QVariant, QPoint,
                           QObject, pyqtSignal, QThread, QRunnable,)
 import logging
+import threading
 import time
 from io import StringIO
 logger = logging.getLogger(__name__)
 from botaplot.models.plot_sender import PlotWorker, PlotWorkerState
 from botaplot.models.project_model import ProjectModel
+from botaplot.post.stream import PostStream
 
 
 class QPlotMonitor(QObject):
-    """Just watches progress and machine state, and updates the UI."""
+    """Just watches progress and machine state, and updates the UI.
+    Progress is emitted at most emit_hz times a second, or every
+    emit_every commands if that comes sooner, however fast we're plotting.
+    stats_signal carries the throughput (commands/s), the ETA in seconds,
+    which is negative until we have one, and the protocol's FlowMetrics
+    (or None)."""
     progress_signal = pyqtSignal(int, int, str)
+    stats_signal = pyqtSignal(float, float, object)
     done_signal = pyqtSignal(bool)
+    emit_hz = 20.0
+    emit_every = 5000
 
     def __init__(self, event_id:str, plot_worker:PlotWorker):
         super().__init__()
@@ -25,16 +35,31 @@ class QPlotMonitor(QObject):
         logger.info("Plot monitor started.")
         self.plot_worker.progress_q.put([1,1,"Ready"])
         logger.info("PROGRESS QUEUE: %s", self.plot_worker.progress_q)
+        worker = self.plot_worker
+        interval = 1.0 / self.emit_hz
+        last_seq = worker.progress.seq
+        last_done = 0
+        last_emit = time.monotonic()
         while not self.die:
-            while not self.plot_worker.progress_q.empty():
-                logger.info("Got an update...")
-                progress = self.plot_worker.progress_q.get()
-                logger.info("WAS: %s", progress)
-                # DO SOME NOTIFY MAGIC...
-                logger.info("Emitting: %s" % progress)
+            while not worker.progress_q.empty():
+                progress = worker.progress_q.get()
                 self.progress_signal.emit(*progress)
-                logger.info("Emitted")
-            time.sleep(0.1)  # TODO: Fix this with a better method
+            now = time.monotonic()
+            if worker.progress.seq != last_seq:
+                snapshot = worker.progress.snapshot()
+                if now - last_emit >= interval or snapshot.done - last_done >= self.emit_every:
+                    self.progress_signal.emit(snapshot.done, snapshot.total, snapshot.last)
+                    self.stats_signal.emit(
+                        snapshot.rate, -1.0 if snapshot.eta is None else snapshot.eta, snapshot.flow)
+                    last_seq, last_done, last_emit = snapshot.seq, snapshot.done, now
+            # The worker notifies us when it has a result, or every so often
+            # while plotting, otherwise we wake up at emit_hz to report.
+            with worker.progress_notify:
+                worker.progress_notify.wait_for(
+                    lambda: (self.die or worker.dead
+                             or not worker.progress_q.empty()
+                             or not worker.outq.empty()),
+                    timeout=interval)
             if self.plot_worker.dead:
                 break
             if (not self.plot_worker.outq.empty()
@@ -65,18 +90,62 @@ class QPostProcessComplete(QObject):
     finished = pyqtSignal(bool)
 
 class QPostProcessRunnable(QRunnable):
-    """Slices up a single thing for plotting"""
-    def __init__(self, plottables=None):
+    """Slices up a single thing for plotting.
+    When streaming, we only set up a PostStream (self.stream) which posts
+    as we plot, otherwise the whole program ends up in self.gcode."""
+    def __init__(self, plottables=None, streaming=True):
         super(QPostProcessRunnable, self).__init__()
         self.finished = QPostProcessComplete()
         self.plottables = plottables or list()
+        self.streaming = streaming
+        self.gcode = None
+        self.stream = None
 
     def run(self):
-        ofp = StringIO()
         # plottable = LayerModel.current.plottables["all"][0]
         plottable = self.plottables[0]  # TODO: This should plot EVERYTHING
         plottable = plottable.transform(*ProjectModel.current.get_transform(plottable))
-        ProjectModel.current.machine.post.write_lines_to_fp(
-            plottable, ofp)
-        self.gcode = ofp.getvalue()
+        machine = ProjectModel.current.machine
+        if self.streaming:
+            self.stream = PostStream(machine.post, plottable)
+        else:
+            ofp = StringIO()
+            machine.post.write_lines_to_fp(plottable, ofp)
+            self.gcode = ofp.getvalue()
+        # Each of these posts the whole job again, so they happen while we plot
+        threading.Thread(target=self.report, args=(machine, plottable, self.stream),
+                         name="Post report", daemon=True).start()
         self.finished.finished.emit(True)
+
+    @staticmethod
+    def report(machine, plottable, stream=None):
+        """Gives the stream an estimate, which the progress bar picks up
+        for its ETA, then logs what compaction and feed planning save"""
+        post = machine.post
+        if stream is not None:
+            # First, the rest post the whole job again
+            stream.estimate = machine.estimate(post.lines2gcodes_gen(plottable)).elapsed
+        if post.compact:
+            logger.info("Compact G-code: %s", post.compaction(plottable))
+        if post.max_feedrate:
+            logger.info("Planned feeds: %s", post.feed_savings(plottable))
+
+
+class QOptimizeSignals(QObject):
+    improved = pyqtSignal(object, object, float, str)  # order, flip, pen-up mm, stage
+    finished = pyqtSignal(bool)
+
+class QOptimizeRunnable(QRunnable):
+    """Runs an AnytimeOptimizer on the thread pool. signals.improved fires
+    with every better order it finds, signals.finished with whether it got
+    cancelled."""
+    def __init__(self, optimizer):
+        super(QOptimizeRunnable, self).__init__()
+        self.optimizer = optimizer
+        self.signals = QOptimizeSignals()
+
+    def run(self):
+        stats = self.optimizer.run(callback=self.signals.improved.emit)
+        logger.info("Optimized pen-up travel from %.0fmm to %.0fmm in %.1fs",
+                    stats.travel_before, stats.travel_after, stats.seconds)
+        self.signals.finished.emit(stats.cancelled)
@@ -103,6 +103,9 @@ class QPlotRunWidget(QWidget):
         self.plot_msg.setText("Messages...")
         self.plot_msg.setEnabled(False)
         pvlayout.addWidget(self.plot_msg)
+        # Throughput and ETA
+        self.plot_stats = QLabel("")
+        pvlayout.addWidget(self.plot_stats)
 
         #Rewind, start/pause, Cancel
         ctl_but_group = QGroupBox()
@@ -169,9 +172,9 @@ class QPlotRunWidget(QWidget):
 
         self.setLayout(v_layout)
 
-    def _send_cmd(self, cmd):
+    def _send_cmd(self, cmd, name="CMD"):
         id = str(uuid.uuid1())
-        cmd_out = f"CMD[{id}]:{cmd}"
+        cmd_out = f"{name}[{id}]:{cmd}" if cmd is not None else f"{name}[{id}]"
         ProjectModel.current.plot_worker.send(cmd_out)
         result = ProjectModel.current.plot_worker.parse_result(
             ProjectModel.current.plot_worker.recv(True))
@@ -196,8 +199,7 @@ class QPlotRunWidget(QWidget):
         self._send_cmd(cmd)
 
     def _penup(self):
-        cmd = json.dumps(ProjectModel.current.machine.post.util_pen(True))
-        self._send_cmd(cmd)
+        self._send_cmd(None, "PENUP")
 
     def _pendown(self):
         cmd = json.dumps(ProjectModel.current.machine.post.util_pen(False))
@@ -205,16 +207,17 @@ class QPlotRunWidget(QWidget):
 
     def _move(self, x, y):
         distance = int(self.move_size_box.currentText()[:-2])  # remove mm suffix
-        cmd = json.dumps(ProjectModel.current.machine.post.util_move(
-            x * distance, y * distance))
+        cmd = "%d,%d" % (x * distance, y * distance)
         logger.info("Move command is %s", cmd)
-        self._send_cmd(cmd)
+        self._send_cmd(cmd, "MOVE")
 
     def _plot(self):
         logger.info("Starting plot")
         self.target_box.setDisabled(True)
         self.mv_but_group.setDisabled(True)
         self.plot_msg.setText("Post Processor dispatching.")
+        # Whatever the optimizer has by now is what we plot
+        ProjectModel.current.use_best_order()
         # First we slice it up/post it
         post = QPostProcessRunnable([ProjectModel.current.plottables["all"][0], ])
         pool = QThreadPool.globalInstance()
@@ -222,8 +225,11 @@ class QPlotRunWidget(QWidget):
         def run_plot(finished):
             load_id = str(uuid.uuid1())
             logger.info("Finished: %s", finished)
-            ProjectModel.current.plot_worker.send(
-                f"LOAD[{load_id}]:{post.gcode}")
+            if post.stream is not None:
+                ProjectModel.current.plot_worker.send_stream(load_id, post.stream)
+            else:
+                ProjectModel.current.plot_worker.send(
+                    f"LOAD[{load_id}]:{post.gcode}")
             result = PlotWorker.parse_result(ProjectModel.current.plot_worker.recv(True))
             logger.info("Result is: %s", result)
             if result['id'] != load_id:
@@ -239,6 +245,7 @@ class QPlotRunWidget(QWidget):
             self.monitor_thread.started.connect(self.monitor.run)
             self.monitor_thread.finished.connect(self.plot_complete)
             self.monitor.progress_signal.connect(self.progress_callback)
+            self.monitor.stats_signal.connect(self.stats_callback)
             self.monitor.done_signal.connect(lambda x: self.monitor_thread.quit())
             logger.info("Starting monitor thread.")
             self.monitor_thread.start()
@@ -308,6 +315,16 @@ class QPlotRunWidget(QWidget):
         self.plot_progress.setValue(round(100*(position/size)))
         self.plot_msg.setText(cmd)
 
+    def stats_callback(self, rate, eta, flow=None):
+        text = "%d cmds/s" % rate
+        if eta >= 0:
+            text += ", ETA %s" % time.strftime("%H:%M:%S", time.gmtime(eta))
+        if flow is not None and flow.acks:
+            text += "\nWindow %d, %d in flight (%.0f%% of RX), RTT %.1f/%.1f/%.1fms" % (
+                flow.lookahead, flow.in_flight, 100.0 * flow.occupancy,
+                1000.0 * flow.rtt_p50, 1000.0 * flow.rtt_p90, 1000.0 * flow.rtt_p99)
+        self.plot_stats.setText(text)
+
     def transport_combo_changed(self):
         # if ProjectModel.current is not None and ProjectModel.current.machine.transport is not None:
         if self.transport_select.currentData() == SerialTransport:
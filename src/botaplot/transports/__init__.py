@@ -1,15 +1,142 @@
 import socket
+import threading
+import time
+from collections import deque
+from queue import Queue
+
 import serial
 
+# What a controller says back to a command, as opposed to status reports,
+# banners and echoes it sends whenever it feels like it
+_RESPONSES = (b"ok", b"error", b"!!", b"alarm")
+
+
 class BaseTransport(object):
+    """
+    Subclasses do the actual talking in _readline() and _write().
+
+    start_reader() starts a thread that reads everything the controller
+    sends while commands are waiting on an answer, so answers get parsed
+    off the sending thread. readline() then hands back just the answers
+    (ok, error...), and anything else goes in status (the last
+    status_history lines) and to on_status, if it's set. The thread only
+    reads while something's waiting on an answer, so a paused job doesn't
+    time out.
+
+    response_time is when (time.monotonic()) the last answer readline()
+    handed back came in, for timing round trips.
+    """
 
     lookahead = 8
+    status_history = 100
+    on_status = None  # Called with every status line (bytes) the reader sees
+
+    _reader = None
+    response_time = None
+    # Whatever's been read past the last whole line, kept across readers
+    _partial = b""
+
+    def _readline(self):
+        return self.file.readline()
+
+    def _write(self, bytestring):
+        return self.file.write(bytestring)
+
+    def _read_lines(self):
+        """For the reader, every line that's come in, at least one. Reading
+        them all at once means a burst of OKs gets handed over in one go."""
+        return [self._readline()]
+
+    def _lines_from(self, read):
+        """Every whole line that's come in, calling read() for more until
+        there's one. read() coming back empty (a timeout) is one empty line."""
+        partial = self._partial
+        while b"\n" not in partial:
+            chunk = read()
+            if not chunk:
+                self._partial = partial
+                return [b""]
+            partial += chunk
+        *lines, self._partial = partial.split(b"\n")
+        return [line + b"\n" for line in lines]
 
-    def readline(self, *args, **kw):
-        return self.file.readline(*args, **kw)
+    def readline(self):
+        if self._reader is None:
+            if self._partial:
+                # The last reader read ahead, what it left goes first
+                response, *rest = self._read_lines()
+                self._partial = b"".join(rest) + self._partial
+            else:
+                response = self._readline()
+            self.response_time = time.monotonic()
+            return response
+        response = self._responses.get()
+        if isinstance(response, Exception):
+            self._responses.put(response)  # Anyone else reading gets it too
+            raise response
+        self.response_time, response = response
+        return response
+
+    def write(self, bytestring):
+        written = self._write(bytestring)
+        if self._reader is not None:
+            with self._reader_cv:
+                # A command each, and single() doesn't always end them with a newline
+                self._expected += bytestring.count(b"\n") + (bool(bytestring) and not bytestring.endswith(b"\n"))
+                self._reader_cv.notify()
+        return written
+
+    def responses_ready(self):
+        """How many answers readline() can hand back without waiting"""
+        return self._responses.qsize() if self._reader is not None else 0
+
+    def start_reader(self):
+        if self._reader is not None:
+            return
+        self.status = deque(maxlen=self.status_history)
+        self._responses = Queue()
+        self._expected = 0
+        self._reading = True
+        self._reader_cv = threading.Condition()
+        self._reader = threading.Thread(target=self._read_loop, name="%s reader" % self, daemon=True)
+        self._reader.start()
+
+    def stop_reader(self, timeout=1.0):
+        """Stop the reader once it's got every answer it was waiting on (or
+        after timeout seconds, it's a daemon thread)"""
+        if self._reader is None:
+            return
+        with self._reader_cv:
+            self._reading = False
+            self._reader_cv.notify()
+        self._reader.join(timeout)
+        self._reader = None
+
+    def _read_loop(self):
+        while True:
+            with self._reader_cv:
+                while self._reading and self._expected <= 0:
+                    self._reader_cv.wait()
+                if self._expected <= 0:
+                    return
+            try:
+                lines = self._read_lines()
+            except Exception as e:
+                self._responses.put(e)
+                return
+            now = time.monotonic()
+            for line in lines:
+                stripped = line.strip()
+                # Nothing at all means a timeout, which the reader of it should hear about
+                if not line or stripped.lower().startswith(_RESPONSES):
+                    with self._reader_cv:
+                        self._expected -= 1
+                    self._responses.put((now, line))
+                elif stripped:
+                    self.status.append(stripped)
+                    if self.on_status is not None:
+                        self.on_status(stripped)
 
-    def write(self, *args, **kw):
-        return self.file.write(*args, **kw)
 
 class TelnetTransport(BaseTransport):
     """Simple Gcode over telnet. Mostly just for smoothie."""
@@ -39,7 +166,7 @@ class TelnetTransport(BaseTransport):
                 raise IOError("Unrecognized protocol header: %s" % header)
         return self._file
 
-    def readline(self):
+    def _readline(self):
         try:
             line = self.file.readline()
         except socket.timeout:
@@ -51,7 +178,17 @@ class TelnetTransport(BaseTransport):
             line = line[1:]
         return line
 
-    def write(self, bytestring):
+    def _read_lines(self):
+        try:
+            lines = self._lines_from(lambda: self.file.read1(65536))
+        except socket.timeout:
+            self._file = None
+            self.sock.close()
+            self.sock = None
+            raise
+        return [line[1:] if line.startswith(b">") else line for line in lines]
+
+    def _write(self, bytestring):
         try:
             written = self.file.write(bytestring)
             self.file.flush()
@@ -74,25 +211,36 @@ class SerialTransport(BaseTransport):
         self.speed = speed
         self._file = None
 
+    def __str__(self):
+        return "<SerialTransport on %s>" % self.portname
+
     @property
     def file(self):
         if self._file is None:
             self._file = serial.Serial(self.portname, self.speed, timeout=30)
         return self._file
 
-    def write(self, bytestring: bytes):
+    def _write(self, bytestring: bytes):
         try:
-            return super().write(bytestring)
+            return super()._write(bytestring)
         except:
             self._file.close()
             self._file = None
             raise
 
 
-    def readline(self):
+    def _readline(self):
         try:
-            return super().readline()
+            return super()._readline()
         except:
             self._file.close()
             self._file = None
-            raise
\ No newline at end of file
+            raise
+
+    def _read_lines(self):
+        try:
+            return self._lines_from(lambda: self.file.read(max(1, self.file.in_waiting)))
+        except:
+            self._file.close()
+            self._file = None
+            raise
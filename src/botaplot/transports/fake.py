@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import deque
+from queue import Queue, Empty
+
+from . import BaseTransport
+
+
+class FakeControllerTransport(BaseTransport):
+    """
+    A stand-in for a GRBL/Smoothie style controller on the end of a serial
+    line, for tests and benchmarks. Nothing leaves the process.
+
+    Written bytes take baudrate time to "arrive" (8N1, so 10 bits a byte),
+    then sit in an rx_buffer_size byte receive buffer until the planner has
+    room for them. Each command the planner accepts is acked with an "ok",
+    latency seconds later, and takes move_time seconds to execute.
+    We count overflows (more bytes in the RX buffer than fit) and how long
+    the planner sat starved of moves while there was still work coming.
+    """
+
+    lookahead = 8
+
+    def __init__(self, rx_buffer_size=128, planner_size=16, baudrate=115200,
+                 move_time=0.0, latency=0.0):
+        self.rx_buffer_size = rx_buffer_size
+        self.planner_size = planner_size
+        self.baudrate = baudrate
+        self.move_time = move_time
+        self.latency = latency
+        self.overflows = 0
+        self.max_rx_bytes = 0
+        self.starved = 0.0  # Seconds the planner sat empty mid-job
+        self.commands = 0
+        self._rx = deque()  # (arrival time, data)
+        self._planner = deque()  # Completion times of the planned moves
+        self._acks = Queue()
+        self._wire_free = 0.0
+        self._idle_since = None
+        self._cv = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __str__(self):
+        return "<FakeControllerTransport rx:%d planner:%d>" % (
+            self.rx_buffer_size, self.planner_size)
+
+    def close(self):
+        with self._cv:
+            self._running = False
+            self._cv.notify()
+        self._thread.join()
+
+    def _write(self, bytestring: bytes):
+        with self._cv:
+            now = time.monotonic()
+            start = max(now, self._wire_free)
+            for line in bytestring.splitlines(keepends=True):
+                if self.baudrate:
+                    start += len(line) * 10.0 / self.baudrate
+                self._rx.append((start, line))
+            self._wire_free = start
+            self._cv.notify()
+        return len(bytestring)
+
+    def _readline(self):
+        try:
+            ready_at, response = self._acks.get(timeout=30)
+        except Empty:
+            raise IOError("Fake controller never answered.")
+        delay = ready_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return response
+
+    def _run(self):
+        arrived = 0  # How many of the _rx lines have arrived so far
+        rx_bytes = 0
+        with self._cv:
+            while self._running:
+                now = time.monotonic()
+                while self._planner and self._planner[0] <= now:
+                    self._planner.popleft()
+                if not self._planner and self._idle_since is None:
+                    self._idle_since = now
+                while arrived < len(self._rx) and self._rx[arrived][0] <= now:
+                    rx_bytes += len(self._rx[arrived][1])
+                    arrived += 1
+                    self.max_rx_bytes = max(self.max_rx_bytes, rx_bytes)
+                    if rx_bytes > self.rx_buffer_size:
+                        self.overflows += 1
+                while arrived and len(self._planner) < self.planner_size:
+                    _, line = self._rx.popleft()
+                    arrived -= 1
+                    rx_bytes -= len(line)
+                    if self._idle_since is not None:
+                        if self.commands:
+                            self.starved += now - self._idle_since
+                        self._idle_since = None
+                    start = self._planner[-1] if self._planner else now
+                    self._planner.append(start + self.move_time)
+                    self.commands += 1
+                    self._acks.put((now + self.latency, b"ok\n"))
+                # Sleep until something else can happen
+                wakeups = list()
+                if arrived < len(self._rx):
+                    wakeups.append(self._rx[arrived][0])
+                if self._planner:
+                    wakeups.append(self._planner[0])
+                if wakeups:
+                    self._cv.wait(max(0.0, min(wakeups) - time.monotonic()))
+                else:
+                    self._cv.wait()
@@ -0,0 +1,130 @@
+"""
+Anytime ordering: keep finding better orders for a plottable in the
+background, so whenever someone hits Plot there's something good to use.
+
+Runs the orderings from cheapest to best, Hilbert curve, greedy (tile by
+tile on every core, for big drawings, see util.tiles), then slices of
+2-opt/Or-opt, and hands every order that beats the best so far to
+a callback. Everything works off a copy of the chunk endpoints, the
+plottable itself is never touched, so it's safe to keep drawing it from
+another thread. Use Plottable.reordered to get the order applied.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from botaplot.util.hilbert import hilbert_order
+from botaplot.util.tiles import greedy_order, tiled_order
+from botaplot.util.tour import improve_tour, pen_up_travel
+from botaplot.util.util import process_pool
+
+logger = logging.getLogger(__name__)
+
+AnytimeStats = namedtuple("AnytimeStats", ["travel_before", "travel_after", "improvements", "seconds", "cancelled"])
+
+
+class AnytimeOptimizer(object):
+    """
+    Improves the order of plottable for up to time_budget seconds, or until
+    cancel() is called. Call run() from whatever thread you want it on,
+    best() from any other.
+    The callback gets (order, flip, travel, stage) for every improvement:
+    order being indices into plottable.chunks, flip whether to draw each
+    chunk backwards, travel the pen-up mm.
+    bounds is what to tile (xmin, ymin, xmax, ymax, in the plottable's
+    units), for drawings big enough to do the greedy search tile by tile,
+    see ProjectModel.tile_bounds. Defaults to the drawing's own.
+    """
+
+    # Seconds of 2-opt between reporting back
+    slice_seconds = 5.0
+    # Above this many chunks the greedy search goes tile by tile over a pool of workers
+    tiled_above = 50000
+    # Above this many chunks 2-opt works in blocks over a pool of workers, see improve_tour
+    block_size = 4000
+
+    def __init__(self, plottable, time_budget=60.0, workers=None, bounds=None):
+        self.plottable = plottable
+        self.time_budget = time_budget
+        self.workers = workers
+        self.bounds = bounds
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._best = None
+        points, offsets = plottable.buffer()
+        lengths = np.diff(offsets)
+        # Empty chunks don't go anywhere, they just get drawn last
+        self._drawable = np.flatnonzero(lengths)
+        self._empty = np.flatnonzero(lengths == 0)
+        self.starts = points[offsets[self._drawable]]
+        self.ends = points[offsets[self._drawable + 1] - 1]
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def best(self):
+        """(order, flip, travel, stage) of the best order so far"""
+        with self._lock:
+            return self._best
+
+    def _offer(self, order, flip, stage, callback):
+        travel = pen_up_travel(self.starts, self.ends, order, flip)
+        with self._lock:
+            if self._best is not None and travel >= self._best[2] - 1e-9:
+                return False
+            full_order = np.concatenate((self._drawable[order], self._empty))
+            full_flip = np.zeros(len(self.plottable.chunks), dtype=bool)
+            full_flip[self._drawable] = flip
+            self._best = (full_order, full_flip, travel, stage)
+        if callback is not None:
+            callback(full_order, full_flip, travel, stage)
+        return True
+
+    def run(self, callback=None):
+        """Returns AnytimeStats"""
+        # One pool for the whole run, rather than one per tiled pass and 2-opt slice
+        executor = process_pool(self.workers) if len(self.starts) > self.block_size else None
+        try:
+            return self._run(callback, executor)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=not self.cancelled.is_set(), cancel_futures=True)
+
+    def _run(self, callback, executor):
+        started = time.monotonic()
+        deadline = started + self.time_budget
+        n = len(self.starts)
+        order, flip = np.arange(n), np.zeros(n, dtype=bool)
+        self._offer(order, flip, "original", callback)
+        before = self._best[2]
+        improvements = 0
+        if n > 2 and not self.cancelled.is_set():
+            improvements += self._offer(*hilbert_order(self.starts, self.ends), "hilbert", callback)
+        if 2 < n <= self.tiled_above and not self.cancelled.is_set():
+            greedy, greedy_flip = greedy_order(self.starts, self.ends, cancel=self.cancelled)
+            improvements += self._offer(np.array(greedy), np.array(greedy_flip), "greedy", callback)
+        elif n > self.tiled_above and not self.cancelled.is_set():
+            tiled, tiled_flip, stats = tiled_order(self.starts, self.ends, self.bounds, workers=self.workers,
+                                                   cancel=self.cancelled, executor=executor)
+            logger.info("Tiled greedy ordering: %d tiles, %.0f pen up in %.1fs",
+                        stats.tiles, stats.travel, stats.seconds)
+            improvements += self._offer(tiled, tiled_flip, "tiled", callback)
+        while n > 2 and not self.cancelled.is_set() and time.monotonic() < deadline:
+            best_order, best_flip, _, _ = self.best()
+            best_order = best_order[:n]  # Just the drawable ones, and they're first
+            # Back to indices into self.starts
+            local = np.empty(len(self.plottable.chunks), dtype=np.int64)
+            local[self._drawable] = np.arange(n)
+            order, flip, stats = improve_tour(
+                self.starts, self.ends, local[best_order], best_flip[self._drawable],
+                time_budget=min(self.slice_seconds, deadline - time.monotonic()),
+                workers=self.workers, block_size=self.block_size, cancel=self.cancelled,
+                executor=executor)
+            improvements += self._offer(order, flip, "2-opt", callback)
+            if not stats.moves:
+                break  # As good as it's getting
+        return AnytimeStats(before, self._best[2], improvements, time.monotonic() - started,
+                            self.cancelled.is_set())
@@ -0,0 +1,169 @@
+"""
+Fitting circular arcs to flattened curves, so they can go out as G2/G3.
+
+Once subdivide_path has turned a circle into a few hundred tiny G01s the
+controller has to plan (and ACK) every one of them, slowing down for each
+junction. fit_arcs finds the runs of points that sit on a circle, within a
+tolerance, so each run can be sent as one arc instead.
+
+Everything that can be is done for the whole chunk at once: which
+vertices turn which way (runs that don't keep turning the same way can't
+be arcs, so most of a polyline never gets looked at twice), and checking a
+candidate arc against every point and segment it replaces.
+"""
+import math
+
+import numpy as np
+
+
+def circle_through(a, b, c):
+    """Centres of the circles through three (K, 2) arrays of points, NaN
+    where they're in a line"""
+    bx, by = (b - a).T
+    cx, cy = (c - a).T
+    d = 2.0 * (bx * cy - by * cx)
+    d = np.where(np.abs(d) < 1e-12, np.nan, d)
+    b2, c2 = bx * bx + by * by, cx * cx + cy * cy
+    return np.column_stack((a[:, 0] + (cy * b2 - by * c2) / d, a[:, 1] + (bx * c2 - cx * b2) / d))
+
+
+def _arc_fits(windows, tolerance, max_radius, centers=None):
+    """
+    For a (K, L, 2) stack of runs of points, whether each lies on one arc
+    (through its first, middle and last points, or about centers if given)
+    turning the same way all along, less than a full turn and bulging no
+    more than tolerance past the segments between. Returns (fits, centers,
+    clockwise).
+    """
+    count = windows.shape[1]
+    if centers is None:
+        centers = circle_through(windows[:, 0], windows[:, (count - 1) // 2], windows[:, -1])
+    spokes = windows - centers[:, None, :]
+    radii = np.hypot(*spokes[:, 0].T)
+    with np.errstate(invalid="ignore"):
+        fits = (radii <= max_radius) & (np.abs(np.hypot(spokes[..., 0], spokes[..., 1])
+                                               - radii[:, None]).max(axis=1) <= tolerance)
+        cross = spokes[:, :-1, 0] * spokes[:, 1:, 1] - spokes[:, :-1, 1] * spokes[:, 1:, 0]
+        dot = (spokes[:, :-1] * spokes[:, 1:]).sum(axis=2)
+        clockwise = cross[:, 0] < 0
+        # Every step goes round the same way, and by less than a quarter turn
+        fits &= ((cross < 0) == clockwise[:, None]).all(axis=1) & (cross != 0).all(axis=1) & (dot > 0).all(axis=1)
+        fits &= np.abs(np.arctan2(cross, dot)).sum(axis=1) < 2.0 * math.pi - 1e-3
+        # And the arc doesn't bulge out past the segments it replaces
+        half = np.hypot(*np.diff(windows, axis=1).transpose(2, 0, 1)) / 2.0
+        sagitta = radii[:, None] - np.sqrt(np.maximum(radii[:, None] ** 2 - half * half, 0.0))
+        fits &= sagitta.max(axis=1) <= tolerance
+    return fits, centers, clockwise
+
+
+def _try_arc(points, start, end, tolerance, max_radius, decimals=None):
+    """(center, clockwise) if points[start:end + 1] fit an arc, or None.
+    With decimals, it has to fit the arc that actually gets drawn too."""
+    window = points[None, start:end + 1]
+    fits, centers, clockwise = _arc_fits(window, tolerance, max_radius)
+    if fits[0] and decimals is not None:
+        # The ends get rounded, arc_offset moves the centre to suit, then I
+        # and J get rounded, and the shorter the chord the further that can
+        # throw the centre off
+        posted = window.copy()
+        posted[0, [0, -1]] = np.round(posted[0, [0, -1]], decimals)
+        offset = np.round(arc_offset(points[start], points[end], centers[0], decimals), decimals + 1)
+        again = _arc_fits(posted, tolerance, max_radius, (posted[0, 0] + offset)[None])
+        fits = again[0] & (again[2] == clockwise)
+    return (centers[0], bool(clockwise[0])) if fits[0] else None
+
+
+def fit_arcs(points, tolerance, min_points=4, max_radius=1000.0, min_chord=0.0, decimals=None):
+    """
+    Splits a polyline into straight segments and arcs. Returns a list of
+    (end, center, clockwise), one per move: draw from wherever the last
+    one finished to points[end], straight if center is None, otherwise
+    round the arc about center. Arcs cover at least min_points points,
+    stay within tolerance (mm) of every one of them and of every segment
+    between, have a radius of no more than max_radius, and start and
+    finish at least min_chord apart. Every point inside an arc has to turn
+    the same way it does, so noisy points (rather than ones sampled off a
+    curve) won't make arcs whatever the tolerance. Given decimals, they
+    stay within tolerance once they're posted too, with the ends rounded
+    to that many places and I and J to one more (see arc_offset).
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    count = len(points)
+    moves = list()
+    if count < 2:
+        return moves
+    # Which way each inside vertex turns, -1, 0 (straight on) or 1
+    steps = np.diff(points, axis=0)
+    turns = np.sign(steps[:-1, 0] * steps[1:, 1] - steps[:-1, 1] * steps[1:, 0])
+    same = _run_lengths(turns)
+    # Everywhere the shortest arc could start, checked all at once
+    candidates = np.zeros(count, dtype=bool)
+    starts = np.flatnonzero(same[:max(count - min_points + 1, 0)] >= min_points - 2)
+    if len(starts):
+        windows = points[starts[:, None] + np.arange(min_points)]
+        candidates[starts] = _arc_fits(windows, tolerance, max_radius)[0]
+
+    start = 0
+    while start < count - 1:
+        found = None
+        if candidates[start]:
+            end = start + min_points - 1
+            found = _try_arc(points, start, end, tolerance, max_radius, decimals)
+            if found is not None:
+                # Grow it while it still fits, doubling, then back off by halves
+                good, bad = end, None
+                limit = min(count - 1, start + 1 + int(same[start]))
+                while bad is None and good < limit:
+                    trial = min(start + 2 * (good - start), limit)
+                    fit = _try_arc(points, start, trial, tolerance, max_radius, decimals)
+                    if fit is None:
+                        bad = trial
+                    else:
+                        good, found = trial, fit
+                while bad is not None and bad - good > 1:
+                    trial = (good + bad) // 2
+                    fit = _try_arc(points, start, trial, tolerance, max_radius, decimals)
+                    if fit is None:
+                        bad = trial
+                    else:
+                        good, found = trial, fit
+                end = good
+                if math.hypot(*(points[end] - points[start])) < min_chord:
+                    found = None
+        if found is None:
+            moves.append((start + 1, None, False))
+            start += 1
+        else:
+            moves.append((end, found[0], found[1]))
+            start = end
+    return moves
+
+
+def _run_lengths(turns):
+    """For every inside vertex, how many in a row from it turn the same
+    (nonzero) way"""
+    count = len(turns)
+    if not count:
+        return np.zeros(0, dtype=np.int64)
+    breaks = np.flatnonzero(np.diff(turns) != 0) + 1
+    run_starts = np.concatenate(([0], breaks))
+    run_ends = np.concatenate((breaks, [count]))
+    which = np.repeat(np.arange(len(run_starts)), run_ends - run_starts)
+    lengths = run_ends[which] - np.arange(count)
+    return np.where(turns != 0, lengths, 0)
+
+
+def arc_offset(start, end, center, decimals):
+    """(I, J) for an arc from start to end about center, once start and end
+    are rounded to decimals. The centre gets moved onto the perpendicular
+    bisector of the rounded ends, so the radius comes out the same at both
+    ends, which controllers are picky about."""
+    start = np.round(np.asarray(start, dtype=np.float64), decimals)
+    end = np.round(np.asarray(end, dtype=np.float64), decimals)
+    middle = (start + end) / 2.0
+    chord = end - start
+    length = math.hypot(*chord)
+    if length > 0:
+        normal = np.array((-chord[1], chord[0])) / length
+        center = middle + normal * float(np.dot(np.asarray(center) - middle, normal))
+    return center - start
@@ -0,0 +1,75 @@
+"""
+Feed planning: a feedrate for every segment of a drawing instead of one
+for the lot.
+
+One feedrate has to be slow enough for the sharpest corner, so long
+straight strokes crawl. plan_feeds looks at how sharply the pen turns at
+each end of every segment, and how long the segment is, and works out how
+fast the machine could actually be going along it: the junction speed at
+each end (the same junction deviation sum GRBL uses), plus however much it
+can pick up in between. Feeds go up on the straights and stay down in the
+corners. It's all done over the whole (points, offsets) buffer at once.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+
+class FeedStats(namedtuple("FeedStats", ["seconds_before", "seconds_after", "feeds"])):
+    """Simulated job seconds at the one feedrate and with planned feeds,
+    and how many different feeds got used"""
+    __slots__ = ()
+
+    @property
+    def saved(self):
+        return self.seconds_before - self.seconds_after
+
+    def __str__(self):
+        return "%.0fs down to %.0fs (%.0f%% quicker) using %d feeds" % (
+            self.seconds_before, self.seconds_after, 100.0 * self.saved / max(self.seconds_before, 1e-9),
+            self.feeds)
+
+
+def plan_feeds(points, offsets, min_feed, max_feed, acceleration, junction_deviation, step=None):
+    """
+    Feeds (mm/min) for drawing every chunk of the buffer, feeds[i] being
+    for the segment that finishes at points[i] (the first point of each
+    chunk gets min_feed, nothing finishes there). Each is somewhere
+    between min_feed and max_feed, rounded down to a multiple of step so
+    the F word doesn't change on every line. acceleration is mm/s^2 and
+    junction_deviation mm, like the controller's settings, and the pen is
+    taken to stop at both ends of every chunk.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    feeds = np.full(len(points), float(min_feed))
+    if len(points) < 2:
+        return feeds
+    steps = np.diff(points, axis=0)
+    lengths = np.hypot(*steps.T)
+    directions = steps / np.maximum(lengths, 1e-12)[:, None]
+    # Segments bridging two chunks aren't drawn
+    bridge = np.zeros(len(steps), dtype=bool)
+    inner = offsets[1:-1]
+    bridge[inner[(inner > 0) & (inner < len(points))] - 1] = True
+
+    # Junction speed (mm/s, squared) at every point, nothing where the pen stops
+    cos_theta = -np.einsum("ij,ij->i", directions[:-1], directions[1:])
+    sin_half = np.sqrt(np.clip(0.5 * (1.0 - cos_theta), 0.0, 1.0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corner = np.where(sin_half < 1.0 - 1e-9,
+                          acceleration * junction_deviation * sin_half / np.maximum(1.0 - sin_half, 1e-12), np.inf)
+    junction = np.zeros(len(points))
+    junction[1:-1] = np.where(bridge[:-1] | bridge[1:] | (lengths[:-1] == 0) | (lengths[1:] == 0), 0.0, corner)
+    # Fastest we could be going along each segment, speeding up from one
+    # end and slowing for the other, unless it's too short to get from the
+    # slower end up to the faster one
+    entry, leaving = junction[:-1], junction[1:]
+    peak = np.minimum(0.5 * (entry + leaving) + acceleration * lengths,
+                      np.minimum(entry, leaving) + 2.0 * acceleration * lengths)
+    peak = np.sqrt(np.minimum(peak, 1e18)) * 60.0
+    planned = np.clip(np.nan_to_num(peak, nan=min_feed), min_feed, max_feed)
+    if step:
+        planned = np.maximum(np.floor(planned / step) * step, min_feed)
+    feeds[1:] = np.where(bridge, min_feed, planned)
+    return feeds
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from types import SimpleNamespace
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class SVGHeader(object):
+    """
+    Just the bits of a parsed SVG that we need to place it on the page, so
+    a cache hit doesn't have to parse the file at all. Quacks like an
+    svgelements SVG as far as ProjectModel cares (.values and .viewbox).
+    """
+
+    def __init__(self, values=None, viewbox=None):
+        self.values = dict(values or {})
+        viewbox = dict(viewbox or {})
+        self.viewbox = SimpleNamespace(x=viewbox.get("x", 0.0),
+                                       y=viewbox.get("y", 0.0),
+                                       width=viewbox.get("width", 0.0),
+                                       height=viewbox.get("height", 0.0))
+
+    @classmethod
+    def from_svg(cls, svg):
+        values = {k: svg.values[k] for k in ("width", "height")
+                  if isinstance(svg.values.get(k), (str, int, float))}
+        viewbox = {k: float(getattr(svg.viewbox, k) or 0.0)
+                   for k in ("x", "y", "width", "height")}
+        return cls(values, viewbox)
+
+    def as_dict(self):
+        return dict(values=self.values, viewbox=vars(self.viewbox))
+
+
+class GeometryCache(object):
+    """
+    Content addressed on-disk cache of flattened SVG geometry.
+
+    The key is a hash of the SVG bytes plus whatever parameters went into
+    flattening it, the value is a .npz with the points and offsets of a
+    packed Plottable and a bit of JSON metadata. Files are touched on every
+    hit and the least recently used ones get removed when the directory
+    grows past max_bytes.
+    """
+
+    # Bump this whenever the flattening changes what ends up in the cache
+    version = 3
+    max_bytes = 256 * 1024 * 1024
+
+    def __init__(self, path=None, max_bytes=None):
+        self.path = path or self.default_path()
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def default_path():
+        if os.environ.get("BOTAPLOT_CACHE_DIR"):
+            return os.environ["BOTAPLOT_CACHE_DIR"]
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        return os.path.join(base, "botaplot", "geometry")
+
+    @classmethod
+    def key(cls, data: bytes, **params):
+        """Hash of the file contents and the flattening parameters"""
+        digest = hashlib.sha256(data)
+        digest.update(json.dumps(dict(params, version=cls.version), sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, "%s.npz" % key)
+
+    def get(self, key):
+        """Returns (points, offsets, meta) or None on a miss"""
+        fname = self._file(key)
+        try:
+            with np.load(fname, allow_pickle=False) as data:
+                points = data["points"]
+                offsets = data["offsets"]
+                meta = json.loads(str(data["meta"]))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Dropping unreadable cache entry %s: %s", fname, e)
+            self.discard(key)
+            return None
+        try:
+            os.utime(fname)  # Most recently used
+        except OSError:
+            pass
+        return points, offsets, meta
+
+    def put(self, key, points, offsets, meta=None):
+        # Write somewhere else first so a reader never sees half a file
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f,
+                         points=np.asarray(points, dtype=np.float64),
+                         offsets=np.asarray(offsets, dtype=np.int64),
+                         meta=np.array(json.dumps(meta or {})))
+            os.replace(tmp, self._file(key))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.evict()
+
+    def discard(self, key):
+        try:
+            os.remove(self._file(key))
+        except OSError:
+            pass
+
+    def entries(self):
+        """(mtime, size, path) of everything in the cache, oldest first"""
+        entries = list()
+        for name in os.listdir(self.path):
+            if not name.endswith(".npz"):
+                continue
+            fname = os.path.join(self.path, name)
+            try:
+                stat = os.stat(fname)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, fname))
+        return sorted(entries)
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Drop least recently used entries until we're under max_bytes"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        # Never throw out the newest entry, even if it's huge on its own
+        for _, size, fname in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(fname)
+                total -= size
+            except OSError:
+                pass
+        return total
@@ -0,0 +1,100 @@
+"""
+Hilbert curve ordering, the quick and dirty alternative to optimize_lines
+for when there are far too many chunks to search (stippling, hatching).
+
+Points close together on a Hilbert curve are close together on the page,
+so sorting chunks by where they sit along it gives a decent tour in
+O(n log n), all in numpy.
+"""
+import numpy as np
+
+
+def _build_tables(levels=4):
+    """
+    Lookup tables to walk the curve levels bits at a time. At each level
+    the quadrant gets flipped (both coords complemented) and/or swapped,
+    and since those two commute the state is just a (swap, flip) pair.
+    Indexed by state << 2*levels | x bits << levels | y bits, they give
+    the next 2*levels bits of the index and the state after.
+    """
+    size = 1 << levels
+    digits = np.zeros(4 << (2 * levels), dtype=np.int64)
+    states = np.zeros(4 << (2 * levels), dtype=np.int64)
+    for state in range(4):
+        for xbits in range(size):
+            for ybits in range(size):
+                swap, flip = state >> 1, state & 1
+                d = 0
+                for level in range(levels - 1, -1, -1):
+                    bx, by = (xbits >> level) & 1, (ybits >> level) & 1
+                    rx, ry = (by, bx) if swap else (bx, by)
+                    rx, ry = rx ^ flip, ry ^ flip
+                    d = (d << 2) | ((3 * rx) ^ ry)
+                    if not ry:
+                        flip ^= rx
+                        swap ^= 1
+                key = (state << (2 * levels)) | (xbits << levels) | ybits
+                digits[key] = d
+                states[key] = (swap << 1) | flip
+    return digits, states
+
+
+_LEVELS = 4
+_DIGITS, _STATES = _build_tables(_LEVELS)
+
+
+def hilbert_index(x, y, bits=16):
+    """Distance along a 2**bits square Hilbert curve of integer cells x, y"""
+    x = np.asarray(x, dtype=np.int64)
+    y = np.asarray(y, dtype=np.int64)
+    # Round up to whole table steps, the extra top bits are all zero
+    steps = -(-bits // _LEVELS)
+    mask = (1 << _LEVELS) - 1
+    d = np.zeros(np.broadcast(x, y).shape, dtype=np.int64)
+    state = np.zeros_like(d)
+    for step in range(steps - 1, -1, -1):
+        shift = step * _LEVELS
+        key = (state << (2 * _LEVELS)) | (((x >> shift) & mask) << _LEVELS) | ((y >> shift) & mask)
+        d = (d << (2 * _LEVELS)) | _DIGITS[key]
+        state = _STATES[key]
+    return d
+
+
+def hilbert_order(starts, ends, key="mid", bounds=None, bits=16):
+    """
+    Returns (order, flip) for chunks with the given (N, 2) start and end
+    points: sorted by the Hilbert index of their midpoint (key="mid") or
+    start point (key="start"), each one drawn whichever way round starts
+    closer to the middle of the chunk before it.
+    bounds is (xmin, ymin, xmax, ymax) to fit the curve to, defaults to
+    the chunks' own.
+    """
+    starts = np.asarray(starts, dtype=np.float64).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=np.float64).reshape(-1, 2)
+    if not len(starts):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=bool)
+    mids = (starts + ends) * 0.5
+    if key == "mid":
+        points = mids
+    elif key == "start":
+        points = starts
+    else:
+        raise ValueError("Unknown hilbert key '%s'" % key)
+    if bounds is None:
+        lo = np.minimum(starts.min(axis=0), ends.min(axis=0))
+        hi = np.maximum(starts.max(axis=0), ends.max(axis=0))
+    else:
+        lo, hi = np.array(bounds[:2], dtype=np.float64), np.array(bounds[2:], dtype=np.float64)
+    # Square cells, so the curve doesn't get stretched on long thin drawings
+    span = max(float((hi - lo).max()), 1e-12)
+    cells = (1 << bits) - 1
+    grid = np.clip(((points - lo) * (cells / span)).astype(np.int64), 0, cells)
+    order = np.argsort(hilbert_index(grid[:, 0], grid[:, 1], bits), kind="stable")
+    # Point each chunk away from the one before, judged by the midpoint of
+    # the one before so it doesn't depend on which way that one went
+    prev = mids[np.concatenate((order[:1], order[:-1]))]
+    s, e = starts[order] - prev, ends[order] - prev
+    flip_sorted = e[:, 0] * e[:, 0] + e[:, 1] * e[:, 1] < s[:, 0] * s[:, 0] + s[:, 1] * s[:, 1]
+    flip = np.zeros(len(starts), dtype=bool)
+    flip[order] = flip_sorted
+    return order, flip
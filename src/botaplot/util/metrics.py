@@ -0,0 +1,84 @@
+"""
+How much work a plot is: how far the pen goes down and up, how often it
+lifts, and roughly how long it all takes. Everything is worked out over a
+whole (points, offsets) buffer at once, so it's cheap enough to run after
+every change, and it's what the optimizers get measured by.
+"""
+import re
+import time
+from collections import namedtuple
+
+import numpy as np
+
+_DWELL = re.compile(r"^\s*G0*4\b([^;]*)", re.IGNORECASE)
+_WORD = re.compile(r"([PS])\s*([-+]?[0-9]*\.?[0-9]+)", re.IGNORECASE)
+
+
+class PlotMetrics(namedtuple("PlotMetrics", ["pen_down_mm", "pen_up_mm", "lifts", "points", "seconds"])):
+    """Distances in mm, seconds is the estimated plot time (at full speed,
+    no acceleration)"""
+    __slots__ = ()
+
+    def __str__(self):
+        return "%d lifts, %.0fmm pen down, %.0fmm pen up, %d points, ~%s" % (
+            self.lifts, self.pen_down_mm, self.pen_up_mm, self.points,
+            time.strftime("%H:%M:%S", time.gmtime(self.seconds)))
+
+
+def dwell_seconds(commands):
+    """Total G4 dwell time in a list of G-code commands, P is milliseconds
+    and S is seconds"""
+    total = 0.0
+    for command in commands:
+        match = _DWELL.match(command)
+        if match is None:
+            continue
+        for word, value in _WORD.findall(match.group(1)):
+            total += float(value) / (1000.0 if word.upper() == "P" else 1.0)
+    return total
+
+
+def as_buffer(lines):
+    """(points, offsets) of a Plottable, or of any list of point lists"""
+    if hasattr(lines, "buffer"):
+        return lines.buffer()
+    arrays = [np.asarray(line, dtype=np.float64).reshape(-1, 2) for line in lines]
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    if not arrays:
+        return np.empty((0, 2), dtype=np.float64), offsets
+    np.cumsum([len(a) for a in arrays], out=offsets[1:])
+    return np.concatenate(arrays), offsets
+
+
+def plot_metrics(points, offsets, feedrate, travel_feedrate, pen_drag_mm=0.0,
+                 lift_seconds=0.0, fixed_seconds=0.0):
+    """
+    PlotMetrics for drawing every chunk of the buffer in order, the way
+    GCodePost does it: single points get skipped, and hops between chunks
+    of pen_drag_mm or less are drawn pen down instead of lifting.
+    Feedrates are mm/min, lift_seconds is the time one pen up and down
+    takes on top of the travel, and fixed_seconds whatever the job takes
+    regardless (preamble, epilog).
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    drawn = lengths > 1
+    # Every segment, less the ones bridging two chunks
+    segments = np.hypot(*np.diff(points, axis=0).T)
+    bridges = offsets[1:-1]
+    segments[bridges[(bridges > 0) & (bridges < len(points))] - 1] = 0.0
+    pen_down = float(np.nansum(segments))
+
+    starts = points[offsets[:-1][drawn]]
+    ends = points[offsets[1:][drawn] - 1]
+    hops = np.hypot(*(starts[1:] - ends[:-1]).T)
+    # NaN is never a short drag, same as util.distance
+    short = hops <= pen_drag_mm
+    pen_down += float(hops[short].sum())
+    pen_up = float(np.nansum(hops[~short]))
+    lifts = int(len(hops) - np.count_nonzero(short) + 1) if len(starts) else 0
+
+    seconds = (60.0 * pen_down / feedrate + 60.0 * pen_up / travel_feedrate
+               + lifts * lift_seconds + fixed_seconds)
+    return PlotMetrics(pen_down, pen_up, lifts, int(lengths[drawn].sum()), seconds)
@@ -0,0 +1,256 @@
+"""
+How long a G-code job will really take, acceleration and all.
+
+Plotter jobs are mostly tiny G01 moves and G4 dwells, and at those sizes the
+machine never gets up to feedrate, so feedrate times distance is way off.
+simulate() models what a GRBL/Smoothie/Marlin style planner does instead:
+trapezoidal acceleration on every move, junction deviation to cap the speed
+through each corner, a full stop wherever the controller has to wait (G4,
+M400, homing), and the dwells themselves.
+
+It's numpy all the way through, so it can keep up with millions of
+commands. The G-code gets parsed a byte at a time as one big array rather
+than a line at a time, and the planner's forward and backward passes are
+running minimums instead of loops.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+MotionEstimate = namedtuple("MotionEstimate", ["seconds", "move_seconds", "dwell_seconds", "moves", "elapsed"])
+# Everything about a program that timing it needs, per move: its line, length
+# (mm), direction, feed (mm/min, NaN if not set yet), whether it's a G0 and
+# whether the machine comes to a stop before it. dwells is seconds per line.
+# Arcs start off in directions and finish in exits, and have a radius (it's
+# infinite for straight moves).
+MotionProgram = namedtuple("MotionProgram", ["lines", "move_lines", "lengths", "directions", "feeds",
+                                             "rapid", "stops", "dwells", "exits", "radii"])
+
+_LETTER = np.zeros(256, dtype=bool)
+_LETTER[np.r_[65:91, 97:123]] = True
+_NUMERIC = np.zeros(256, dtype=bool)
+_NUMERIC[np.frombuffer(b"0123456789.+-", dtype=np.uint8)] = True
+
+
+def _as_text(commands):
+    if isinstance(commands, (bytes, bytearray)):
+        return bytes(commands)
+    if isinstance(commands, str):
+        return commands.encode("ascii", "replace")
+    return "\n".join(commands).encode("ascii", "replace")
+
+
+def parse_gcode(commands):
+    """
+    Words of every line of a G-code program, which is a string or a list
+    (or any iterable) of commands. Returns (lines, line, letter, value):
+    the number of lines, and for every word which line it's on, its
+    letter (uppercase, as a byte) and its value.
+    Comments (; to the end of the line) are skipped, and so is any number
+    that doesn't come straight after a letter, "G0X1" is fine but the 1 in
+    "G0 X 1" doesn't count.
+    """
+    # Newlines both ends, so every number has something before and after it
+    text = np.frombuffer(b"\n" + _as_text(commands) + b"\n", dtype=np.uint8).copy()
+    newlines = np.flatnonzero(text == ord("\n"))
+    lines = len(newlines) - 1
+    numeric = _NUMERIC[text]
+    runs = np.flatnonzero(numeric[1:] & ~numeric[:-1]) + 1
+    line = np.searchsorted(newlines, runs) - 1
+    semis = np.flatnonzero(text == ord(";"))
+    comment = np.full(lines, len(text))
+    np.minimum.at(comment, np.searchsorted(newlines, semis) - 1, semis)
+    words = _LETTER[text[runs - 1]] & (runs < comment[line])
+    # Blank out every other number, then numpy can parse what's left in one go
+    stray = runs[~words]
+    while len(stray):
+        text[stray] = ord(" ")
+        stray = stray[numeric[stray + 1]] + 1
+    runs, line = runs[words], line[words]
+    letter = text[runs - 1] & 0xDF
+    if not len(runs):
+        # Nothing to parse, and fromstring would take no numbers for a bad one
+        return lines, line, letter, np.empty(0)
+    text[~numeric] = ord(" ")
+    try:
+        value = np.fromstring(text.tobytes(), dtype=np.float64, sep=" ")
+    except ValueError:
+        value = None
+    if value is None or len(value) != len(runs):
+        raise ValueError("Couldn't make sense of the numbers in this G-code")
+    return lines, line, letter, value
+
+
+def _column(lines, line, letter, value, which):
+    """Per line value of one letter, NaN where it isn't given"""
+    out = np.full(lines, np.nan)
+    mask = letter == ord(which)
+    out[line[mask]] = value[mask]
+    return out
+
+
+def _flag(lines, line, letter, codes, which, code):
+    """Per line, whether that line has code (like G, 4), codes being the
+    word values rounded to one decimal"""
+    out = np.zeros(lines, dtype=bool)
+    mask = (letter == ord(which)) & (codes == code)
+    out[line[mask]] = True
+    return out
+
+
+def _ffill(values, default):
+    """Carry the last non-NaN value forward, like a modal word"""
+    given = ~np.isnan(values)
+    index = np.maximum.accumulate(np.where(given, np.arange(len(values)), -1))
+    return np.where(index >= 0, values[np.maximum(index, 0)], default)
+
+
+def _positions(axis, moving, setting, relative):
+    """Absolute machine position of one axis after every line"""
+    given = ~np.isnan(axis)
+    delta = np.where(given & moving & relative, axis, 0.0)
+    total = np.cumsum(delta)
+    # Lines that put the axis somewhere outright, everything after is relative to them
+    anchor = given & ((moving & ~relative) | setting)
+    index = np.maximum.accumulate(np.where(anchor, np.arange(len(axis)), -1))
+    base = np.where(index >= 0, axis[np.maximum(index, 0)] - total[np.maximum(index, 0)], 0.0)
+    return base + total
+
+
+def plan_seconds(lengths, speeds, directions, stops, acceleration, junction_deviation, exits=None):
+    """
+    Time for a run of moves, each with a length (mm), a target speed
+    (mm/s) and a unit direction, starting and finishing at a stand still,
+    and also stopping before every move where stops is set. Moves that
+    don't finish going the way they started (arcs) have that in exits.
+    Returns the seconds for each move.
+    """
+    count = len(lengths)
+    if not count:
+        return np.zeros(0)
+    a = float(acceleration)
+    # Speed limit (squared) at every junction, the start and end included
+    limit = np.zeros(count + 1)
+    limit[1:-1] = np.minimum(speeds[:-1], speeds[1:]) ** 2
+    # Junction deviation, same as GRBL: the speed at which the corner is
+    # taken as a circle that strays junction_deviation from it
+    exits = directions if exits is None else exits
+    cos_theta = -np.einsum("ij,ij->i", exits[:-1], directions[1:])
+    sin_half = np.sqrt(np.clip(0.5 * (1.0 - cos_theta), 0.0, 1.0))
+    with np.errstate(divide="ignore"):
+        corner = np.where(sin_half < 1.0 - 1e-9,
+                          a * junction_deviation * sin_half / np.maximum(1.0 - sin_half, 1e-12), np.inf)
+    limit[1:-1] = np.minimum(limit[1:-1], corner)
+    limit[1:-1][stops[1:]] = 0.0
+    # Forward (how fast can we be going after accelerating from the last
+    # limit) and backward (how fast before we can't stop in time for the
+    # next) passes. Speed squared goes up by 2*a*distance, so each pass is
+    # a running minimum over limit -+ 2*a*distance along the moves.
+    along = 2.0 * a * np.concatenate(([0.0], np.cumsum(lengths)))
+    forward = np.minimum.accumulate(limit - along) + along
+    backward = np.minimum.accumulate((limit + along)[::-1])[::-1] - along
+    v2 = np.maximum(np.minimum(np.minimum(forward, backward), limit), 0.0)
+    v0_2, v1_2 = v2[:-1], v2[1:]
+    v0, v1 = np.sqrt(v0_2), np.sqrt(v1_2)
+    # Triangle if we never get to speed, otherwise a trapezoid
+    peak2 = 0.5 * (v0_2 + v1_2) + a * lengths
+    cruise2 = speeds * speeds
+    triangle = (2.0 * np.sqrt(peak2) - v0 - v1) / a
+    with np.errstate(divide="ignore", invalid="ignore"):
+        trapezoid = ((2.0 * speeds - v0 - v1) / a
+                     + (lengths - (2.0 * cruise2 - v0_2 - v1_2) / (2.0 * a)) / speeds)
+    return np.where(peak2 <= cruise2, triangle, trapezoid)
+
+
+def motion_program(commands):
+    """
+    Parse a G-code program (a string, or a list or any iterable of
+    commands, like lines2gcodes_gen makes) down to the MotionProgram that
+    simulate needs, so it can be timed on lots of machines without parsing
+    it again.
+    Knows about G0/G1, G2/G3 (with I and J, not R), G4 P (ms) and
+    S (s) dwells, G90/G91, G28 and G92 (which just move us to 0 or set
+    the position, homing doesn't get timed) and M400. Anything else takes
+    no time.
+    """
+    lines, line, letter, value = parse_gcode(commands)
+    column = lambda which: _column(lines, line, letter, value, which)
+    codes = np.round(value, 1)
+    flag = lambda which, code: _flag(lines, line, letter, codes, which, code)
+    x, y, f, p, s = column("X"), column("Y"), column("F"), column("P"), column("S")
+    i, j = np.nan_to_num(column("I")), np.nan_to_num(column("J"))
+
+    # Modal motion (G0-G3) and distance (G90/G91) modes
+    motion = np.full(lines, np.nan)
+    is_motion = (letter == ord("G")) & (value >= 0) & (value < 4) & (codes == np.round(value))
+    motion[line[is_motion]] = value[is_motion]
+    motion = _ffill(motion, 0.0)
+    mode = np.full(lines, np.nan)
+    mode[flag("G", 90)] = 0.0
+    mode[flag("G", 91)] = 1.0
+    relative = _ffill(mode, 0.0) == 1.0
+
+    home, set_position, dwell = flag("G", 28), flag("G", 92), flag("G", 4)
+    setting = home | set_position
+    # G28 with no axes homes them all
+    bare_home = home & np.isnan(x) & np.isnan(y)
+    x = np.where(home & (bare_home | ~np.isnan(x)), 0.0, x)
+    y = np.where(home & (bare_home | ~np.isnan(y)), 0.0, y)
+    moving = ~setting & ~dwell & ~(np.isnan(x) & np.isnan(y))
+    xs = _positions(x, moving, setting, relative)
+    ys = _positions(y, moving, setting, relative)
+    dwells = np.where(dwell, np.nan_to_num(p) / 1000.0 + np.nan_to_num(s), 0.0)
+
+    dx = np.diff(xs, prepend=0.0)
+    dy = np.diff(ys, prepend=0.0)
+    length = np.hypot(dx, dy)
+    directions = np.column_stack((dx, dy)) / np.maximum(length, 1e-12)[:, None]
+    exits = directions.copy()
+    radii = np.full(lines, np.inf)
+    # Arcs go round their centre (I, J from the start), the long way if that's what it takes
+    arc = moving & ((motion == 2) | (motion == 3))
+    if arc.any():
+        radius = np.hypot(i[arc], j[arc])
+        start = np.arctan2(-j[arc], -i[arc])
+        end = np.arctan2(dy[arc] - j[arc], dx[arc] - i[arc])
+        clockwise = motion[arc] == 2
+        sweep = np.where(clockwise, start - end, end - start) % (2.0 * np.pi)
+        sweep[sweep < 1e-9] = 2.0 * np.pi  # Same start and finish is a full circle
+        turn = np.where(clockwise, -1.0, 1.0)
+        length[arc] = radius * sweep
+        radii[arc] = radius
+        directions[arc] = np.column_stack((-np.sin(start), np.cos(start))) * turn[:, None]
+        exits[arc] = np.column_stack((-np.sin(end), np.cos(end))) * turn[:, None]
+    moves = np.flatnonzero(moving & (length > 1e-9))
+    # The controller waits for everything before a sync to finish first
+    syncs = np.cumsum(dwell | setting | flag("M", 400))
+    stops = np.ones(len(moves), dtype=bool)
+    stops[1:] = syncs[moves[1:] - 1] > syncs[moves[:-1]]
+    return MotionProgram(lines, moves, length[moves], directions[moves], _ffill(f, np.nan)[moves],
+                         motion[moves] == 0.0, stops, dwells, exits[moves], radii[moves])
+
+
+def simulate(program, acceleration=1000.0, junction_deviation=0.05, rapid_feedrate=3000.0,
+             feedrate=1000.0):
+    """
+    Estimate how long a G-code program takes to run. program is a
+    MotionProgram, or anything motion_program takes.
+    acceleration is mm/s^2, junction_deviation mm, feedrates mm/min, with
+    feedrate being what G1 runs at before anyone sets F.
+    Returns a MotionEstimate, where elapsed is the (simulated) seconds
+    since the start at the end of each command.
+    """
+    if not isinstance(program, MotionProgram):
+        program = motion_program(program)
+    seconds = program.dwells.copy()
+    if len(program.move_lines):
+        speeds = np.where(program.rapid, rapid_feedrate, np.nan_to_num(program.feeds, nan=feedrate)) / 60.0
+        # Going round an arc any faster would take more than acceleration
+        speeds = np.minimum(speeds, np.sqrt(acceleration * program.radii))
+        seconds[program.move_lines] += plan_seconds(program.lengths, speeds, program.directions,
+                                                     program.stops, acceleration, junction_deviation,
+                                                     program.exits)
+    elapsed = np.cumsum(seconds)
+    total = float(elapsed[-1]) if program.lines else 0.0
+    dwell_total = float(program.dwells.sum())
+    return MotionEstimate(total, total - dwell_total, dwell_total, len(program.move_lines), elapsed)
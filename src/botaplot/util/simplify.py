@@ -0,0 +1,124 @@
+# Line simplification over a whole (points, offsets) buffer at once
+import time
+from collections import namedtuple
+
+import numpy as np
+
+SimplifyStats = namedtuple("SimplifyStats", ["method", "points_before", "points_after", "seconds"])
+
+
+def _spans(starts, ends):
+    """For intervals (start, end) returns (which interval, point index) for
+    every point strictly inside each of them, and where each interval's
+    points start in those"""
+    counts = np.maximum(ends - starts - 1, 0)
+    which = np.repeat(np.arange(len(starts)), counts)
+    first = np.cumsum(counts) - counts
+    index = starts[which] + 1 + np.arange(counts.sum()) - first[which]
+    return which, index, first
+
+
+def _chunk_ends(offsets):
+    """First and last point index of every chunk with 3 or more points"""
+    offsets = np.asarray(offsets, dtype=np.int64)
+    starts, ends = offsets[:-1], offsets[1:] - 1
+    busy = ends - starts >= 2
+    return starts[busy], ends[busy]
+
+
+def rdp_mask(points, offsets, epsilon=0.0):
+    """
+    Ramer-Douglas-Peucker over every chunk of the buffer at once. Returns
+    a boolean mask of the points to keep, the same ones rdp.rdp(chunk,
+    epsilon) would. Instead of recursing we keep a stack of (start, end)
+    intervals for all the chunks together and work a whole level of it in
+    one go.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    keep = np.ones(len(points), dtype=bool)
+    starts, ends = _chunk_ends(offsets)
+    while len(starts):
+        which, index, first = _spans(starts, ends)
+        a = points[starts[which]]
+        b = points[ends[which]]
+        p = points[index]
+        dx = b[:, 0] - a[:, 0]
+        dy = b[:, 1] - a[:, 1]
+        # Distance to the infinite line through a and b, same as rdp.pldist
+        norm = np.sqrt(dx * dx + dy * dy)
+        same = norm == 0.0
+        cross = np.abs(dx * (a[:, 1] - p[:, 1]) - dy * (a[:, 0] - p[:, 0]))
+        dist = np.where(same, np.hypot(p[:, 0] - a[:, 0], p[:, 1] - a[:, 1]),
+                        cross / np.where(same, 1.0, norm))
+        # Biggest distance in each interval, and where it first happens
+        dmax = np.maximum.reduceat(dist, first)
+        hits = np.flatnonzero(dist == dmax[which])
+        _, firsts = np.unique(which[hits], return_index=True)
+        split_at = index[hits[firsts]]
+        split = dmax > epsilon
+        # Everything inside an interval we don't split goes
+        keep[index[~split[which]]] = False
+        starts, ends, split_at = starts[split], ends[split], split_at[split]
+        starts, ends = np.concatenate((starts, split_at)), np.concatenate((split_at, ends))
+        busy = ends - starts >= 2
+        starts, ends = starts[busy], ends[busy]
+    return keep
+
+
+def visvalingam_mask(points, offsets, area=0.0):
+    """
+    Visvalingam-Whyatt over every chunk of the buffer at once: drop points
+    whose triangle with their neighbours is smaller than area. The textbook
+    version takes away one point at a time off a heap. We take away every
+    point that's under area and smaller than both of its neighbours each
+    pass, then work out the new triangles and go again, which lands very
+    close to the same answer.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    keep = np.ones(len(points), dtype=bool)
+    starts, ends = _chunk_ends(offsets)
+    # Prev/next kept neighbour of every point, as a linked list in arrays
+    prev = np.arange(len(points)) - 1
+    nxt = np.arange(len(points)) + 1
+    _, index, _ = _spans(starts, ends)
+    while len(index):
+        a, p, b = points[prev[index]], points[index], points[nxt[index]]
+        tri = 0.5 * np.abs((a[:, 0] - b[:, 0]) * (p[:, 1] - a[:, 1]) - (a[:, 0] - p[:, 0]) * (b[:, 1] - a[:, 1]))
+        areas = np.full(len(points), np.inf)
+        areas[index] = tri
+        # Ties go to the earlier point so two neighbours never both go
+        drop = (tri < area) & (tri < areas[nxt[index]]) & (tri <= areas[prev[index]])
+        if not drop.any():
+            break
+        gone = index[drop]
+        keep[gone] = False
+        # Unlink, runs of dropped points never touch so this is safe
+        nxt[prev[gone]] = nxt[gone]
+        prev[nxt[gone]] = prev[gone]
+        index = index[~drop]
+    return keep
+
+
+def simplify_buffer(points, offsets, epsilon=0.2, method="rdp", area=None):
+    """Returns (points, offsets, mask) of the simplified buffer. method is
+    "rdp", with epsilon as the max distance, or "visvalingam", with area as
+    the smallest triangle to keep (epsilon squared if not given)."""
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if method == "rdp":
+        keep = rdp_mask(points, offsets, epsilon)
+    elif method == "visvalingam":
+        keep = visvalingam_mask(points, offsets, epsilon * epsilon if area is None else area)
+    else:
+        raise ValueError("Unknown simplification method %s" % method)
+    # Where every chunk starts in the kept points
+    kept = np.concatenate(([0], np.cumsum(keep)))
+    return np.asarray(points)[keep], kept[offsets], keep
+
+
+def simplify(plottable, epsilon=0.2, method="rdp", area=None):
+    """Simplifies every line of a plottable in place, returns SimplifyStats"""
+    started = time.perf_counter()
+    points, offsets = plottable.buffer()
+    new_points, new_offsets, _ = simplify_buffer(points, offsets, epsilon, method, area)
+    plottable._rebind(new_points, new_offsets)
+    return SimplifyStats(method, len(points), len(new_points), time.perf_counter() - started)
@@ -1,11 +1,13 @@
 import math
 import logging
 import cmath
-from math import sqrt
+from math import sqrt, tau
 import sys
+import numpy as np
 from svgelements import (CubicBezier, Arc, SimpleLine, Line, QuadraticBezier,
-                         Close, Polygon, Circle, Polyline, Move, Shape, Path,
+                         Close, Polygon, Circle, Ellipse, Polyline, Move, Shape, Path,
                          Rect, SVG)
+from botaplot.util.util import process_pool
 import os
 try:
     from dataclasses import dataclass
@@ -73,7 +75,7 @@ class PChunk:
 def path_clean_subdivide_by_len(path: Path, err=0.001, min_len=0.05, diverge=0.1):
     """Subdivides a curved path into successively smaller chunks until the sum
     of the lengths of the chunks is within $error of the length of the path
-    overall.
+    overall. See flatten_path for the one that bounds chord error instead.
     """
     pathlen = path.length(error=0.1, min_depth=10)
     def _recur_split_pchunk(pchunk: PChunk, err=0.1) -> PChunk:
@@ -81,15 +83,12 @@ def path_clean_subdivide_by_len(path: Path, err=0.001, min_len=0.05, diverge=0.1
 
         # ie: if it's from 0.0 to 0.5, it's 0.5 * total path length
         _want_len = pathlen * (pchunk.endval - pchunk.startval)
-        print("Want len is", _want_len)
         _got_len = sqrt(
             ((pchunk.endxy[0] - pchunk.startxy[0]) ** 2.0) +
             ((pchunk.endxy[1] - pchunk.startxy[1]) ** 2.0)
         )
-        print("Len is", _got_len)
         # Calculate difference from 1.0
         _err = 1.0 - (_got_len / _want_len)
-        print("Error is", _err)
         if _err < 0.0 or _err < err or _got_len > _want_len or _want_len < min_len:
             return pchunk
         else:
@@ -130,65 +129,260 @@ def path_clean_subdivide_by_len(path: Path, err=0.001, min_len=0.05, diverge=0.1
 
 
 
-def subdivide_path(path, distance=0.5):
+def _positions(path, distance):
+    """Evenly spaced 0..1 positions, about distance apart along the path"""
     chunk_count = int(math.ceil(path.length() / distance))
-    # print("Using %d chunks" % chunk_count)
-    # These support Numpy acceleration
-    if isinstance(path, (CubicBezier, Arc, QuadraticBezier)):
-        npoints = [(i / chunk_count) for i in range(chunk_count + 1)]
-        points = path.npoint(npoints)
-    # So do these, but it's broken
-    elif isinstance(path, (Line, SimpleLine, Close)):
-        points = [path.point(0.0), path.point(1.0)]
-    # elif isinstance(path, Polyline):
-    #   TODO: Just duplicate the polyline points. No subdivision required.
-    #         Also, we might be able to do the same with a polygon
-    #     print("POLYLINE:")
-    #     points = [path.point(0.0), path.point(1.0)]
-    elif isinstance(path, (Polygon, Circle)):
-        points = [path.point(i / chunk_count) for i in range(chunk_count + 1)]
-    elif isinstance(path, (Polyline, Rect)):
-        # points = subdivide_path(path.segments())
-        # TODO: Break this down cleaner
-        points = [path.point(i / chunk_count) for i in range(chunk_count + 1)]
+    if chunk_count == 0:
+        return np.empty(0)
+    return np.arange(chunk_count + 1) / chunk_count
+
+
+def _vertices(shape):
+    """The corners of a shape made of nothing but straight lines"""
+    return np.array([list(segment.end) for segment in shape.segments()
+                     if segment.end is not None], dtype=np.float64).reshape(-1, 2)
+
+
+def _round_shape_points(shape, positions):
+    """Vectorized _RoundShape.point for circles and ellipses"""
+    t = tau * positions
+    center = shape.implicit_center
+    a, b = shape.implicit_rx, shape.implicit_ry
+    cos_rot, sin_rot = math.cos(shape.rotation), math.sin(shape.rotation)
+    cos_t, sin_t = np.cos(t), np.sin(t)
+    return np.column_stack((center.x + a * cos_t * cos_rot - b * sin_t * sin_rot,
+                            center.y + a * cos_t * sin_rot + b * sin_t * cos_rot))
+
+
+def subdivide_path(path, distance=0.5):
+    """Flattens a path segment or shape into an (N, 2) array of points,
+    about distance apart. Straight edged things just give their vertices."""
+    if isinstance(path, (Line, SimpleLine, Close)):
+        points = [list(path.point(0.0)), list(path.point(1.0))]
+    elif isinstance(path, (Polyline, Polygon)):
+        # No subdivision required, the vertices are the line
+        return _vertices(path)
+    elif isinstance(path, Rect) and not (path.rx or path.ry):
+        return _vertices(path)
+    elif isinstance(path, (CubicBezier, Arc, QuadraticBezier)):
+        points = path.npoint(_positions(path, distance))
+    elif isinstance(path, (Circle, Ellipse)):
+        points = _round_shape_points(path, _positions(path, distance))
+    elif isinstance(path, Shape):
+        # Rounded rects and the like, Shape.npoint does the segment lookup in bulk
+        positions = _positions(path, distance)
+        points = path.npoint(positions) if len(positions) else None
+    else:
+        logging.warning("Unusual component: %s" % path)
+        points = None
+    if points is None:
+        return np.empty((0, 2), dtype=np.float64)
+    return np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+
+def _bezier_count(points, tolerance):
+    """Wang's formula, how many equal steps in t keep a Bezier with these
+    control points within tolerance of its chords"""
+    points = np.asarray(points, dtype=np.float64)
+    degree = len(points) - 1
+    second = points[2:] - 2.0 * points[1:-1] + points[:-2]
+    worst = np.sqrt((second ** 2).sum(axis=1)).max()
+    return max(1, int(math.ceil(math.sqrt(degree * (degree - 1) * worst / (8.0 * tolerance)))))
+
+
+def _arc_count(sweep, radius, tolerance):
+    """Steps so no chord of an arc of this radius is more than tolerance
+    off the curve. The step angle is 2*acos(1 - tolerance/radius)."""
+    if radius <= tolerance:
+        step = math.pi
+    else:
+        step = 2.0 * math.acos(1.0 - tolerance / radius)
+    return max(1, int(math.ceil(abs(sweep) / step)))
+
+
+def _continues(line, part, atol=1e-9):
+    """Does part start where line ends?"""
+    return abs(line[-1][0] - part[0][0]) <= atol and abs(line[-1][1] - part[0][1]) <= atol
+
+
+def _join(parts):
+    """Glue flattened pieces end to end, dropping the repeated vertex
+    where one piece starts on the end of the last"""
+    parts = [part for part in parts if len(part)]
+    if not parts:
+        return np.empty((0, 2), dtype=np.float64)
+    joined = [parts[0]]
+    for part in parts[1:]:
+        if _continues(joined[-1], part):
+            part = part[1:]
+        joined.append(part)
+    return np.concatenate(joined)
+
+
+def flatten_path(path, tolerance=0.05):
+    """Flattens a path segment or shape into an (N, 2) array of points where
+    no chord is more than tolerance (in the path's units) away from the
+    curve, with about as few points as that allows. Straight edged things
+    just give their vertices."""
+    if isinstance(path, (Line, SimpleLine, Close)):
+        points = [list(path.point(0.0)), list(path.point(1.0))]
+    elif isinstance(path, (Polyline, Polygon)):
+        return _vertices(path)
+    elif isinstance(path, Rect) and not (path.rx or path.ry):
+        return _vertices(path)
+    elif isinstance(path, QuadraticBezier):
+        count = _bezier_count([path.start, path.control, path.end], tolerance)
+        points = path.npoint(np.arange(count + 1) / count)
+    elif isinstance(path, CubicBezier):
+        count = _bezier_count([path.start, path.control1, path.control2, path.end], tolerance)
+        points = path.npoint(np.arange(count + 1) / count)
+    elif isinstance(path, Arc):
+        # An ellipse is a squashed circle, so its larger radius is the safe one
+        count = _arc_count(path.sweep or 0.0, max(abs(path.rx), abs(path.ry)), tolerance)
+        points = path.npoint(np.arange(count + 1) / count)
+    elif isinstance(path, (Circle, Ellipse)):
+        count = _arc_count(tau, max(abs(path.implicit_rx), abs(path.implicit_ry)), tolerance)
+        points = _round_shape_points(path, np.arange(count + 1) / count)
+    elif isinstance(path, Shape):
+        # Rounded rects and the like, flatten each piece and join them up
+        return _join([flatten_path(segment, tolerance) for segment in path.segments()
+                      if not isinstance(segment, Move)])
     else:
         logging.warning("Unusual component: %s" % path)
-        # And this is a catch all.
-        # points = [path.npoint(i/chunk_count) for i in range(chunk_count + 1)]
-        points = list()
+        points = None
+    if points is None:
+        return np.empty((0, 2), dtype=np.float64)
+    return np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+
+def segment_params(segment):
+    """Boils a path segment or simple shape down to plain tuples that are
+    cheap to pickle and send to another process. Returns None for things
+    we can't describe that way, which get flattened where they are."""
+    if isinstance(segment, (Line, Close)):
+        return ("line", tuple(segment.start), tuple(segment.end))
+    elif isinstance(segment, QuadraticBezier):
+        return ("quad", tuple(segment.start), tuple(segment.control), tuple(segment.end))
+    elif isinstance(segment, CubicBezier):
+        return ("cubic", tuple(segment.start), tuple(segment.control1),
+                tuple(segment.control2), tuple(segment.end))
+    elif isinstance(segment, Arc):
+        # The native start, end, center, prx, pry, sweep parameterization
+        return ("arc", tuple(segment.start), tuple(segment.end), tuple(segment.center),
+                tuple(segment.prx), tuple(segment.pry), segment.sweep)
+    elif isinstance(segment, (Polyline, Polygon)) and segment.transform.is_identity():
+        return ("polygon" if isinstance(segment, Polygon) else "polyline",
+                tuple(tuple(point) for point in segment.points))
+    return None
+
+
+def segment_from_params(params):
+    """Inverse of segment_params"""
+    kind, args = params[0], params[1:]
+    if kind == "line":
+        return Line(*args)
+    elif kind == "quad":
+        return QuadraticBezier(*args)
+    elif kind == "cubic":
+        return CubicBezier(*args)
+    elif kind == "arc":
+        return Arc(*args)
+    elif kind == "polyline":
+        return Polyline(list(args[0]))
+    elif kind == "polygon":
+        return Polygon(list(args[0]))
+    raise ValueError("Unknown segment type %s" % kind)
+
+
+def _subdivide_checked(segment, distance, tolerance=None):
+    """subdivide_path (or flatten_path, given a tolerance), but bad or empty
+    segments come back as None instead"""
+    try:
+        if tolerance is None:
+            points = subdivide_path(segment, distance)
+        else:
+            points = flatten_path(segment, tolerance)
+    except ValueError as exc:
+        sys.stderr.write("Invalid/Empty segment: %s\n" % exc)
+        return None
+    if not len(points):
+        sys.stderr.write("Skipping zero len line\n")
+        return None
     return points
 
 
-def svg2lines(svg, distance=0.5):
-    """Converts an SVG into line segments.
+def _subdivide_batch(batch, distance, tolerance=None):
+    """Runs in a worker process, flattens a list of segment_params"""
+    return [_subdivide_checked(segment_from_params(params), distance, tolerance) for params in batch]
+
+
+def svg2lines(svg, distance=0.5, parallel=False, workers=None, batch_size=512, tolerance=None,
+              join=True):
+    """Converts an SVG into line segments, a list of (N, 2) arrays.
+
+    With join set each subpath (Move to Move or Close) comes back as one
+    polyline, otherwise every segment is its own line.
+
+    Curves get sampled every distance units, or, given a tolerance in mm,
+    flattened adaptively so they never stray more than that from the curve.
+
+    With parallel set the segments get flattened across a pool of
+    workers processes, batch_size at a time. The lines come back in the
+    same order either way.
     TODO: Layer/Color to pen stuff."""
-    lines = list()
+    # Each item is either a segment_params tuple to send to a worker, or
+    # something we had to flatten here, already done. groups has the
+    # subpath each one belongs to.
+    items = list()
+    groups = list()
+    group = 0
+    if tolerance is not None:
+        tolerance = tolerance / calculate_mm_per_unit(svg)
     # for item in svg.objects:
     #     sys.stderr.write(f"Item:{item}")
     for element in svg.elements():
         # print(f"E: {type(element)}.{element.id} -> {element}")
+        group += 1
         if isinstance(element, Path):
             for sub in element:
                 if isinstance(sub, Move):
+                    group += 1
                     continue  # Skip all the moves
-                else:
-                    try:
-                        if sub:  # Skip empty subsections
-                            lines.append(
-                                [[x, y] for [x, y] in subdivide_path(sub, distance)]
-                            )
-                    except ZeroDivisionError as exc:
-                        sys.stderr.write("Skipping zero len line\n")
-                    except ValueError as exc:
-                        sys.stderr.write("Invalid/Empty segment: %s\n" % exc)
+                elif sub:  # Skip empty subsections
+                    params = segment_params(sub) if parallel else None
+                    items.append(params if params is not None else _subdivide_checked(sub, distance, tolerance))
+                    groups.append(group)
+                if isinstance(sub, Close):
+                    group += 1  # Anything after a close is a new subpath
         elif isinstance(element, Shape):
-            try:
-
-                logger.info("Splitting element: %s", element)
-                tmpsub = [[x, y] for [x, y] in subdivide_path(element, distance)]
-                if tmpsub:
-                    lines.append(tmpsub)
-            except ZeroDivisionError as exc:
-                sys.stderr.write("Skipping zero len line")
-    return lines
+            logger.info("Splitting element: %s", element)
+            params = segment_params(element) if parallel else None
+            items.append(params if params is not None else _subdivide_checked(element, distance, tolerance))
+            groups.append(group)
 
+    todo = [i for i, item in enumerate(items) if isinstance(item, tuple)]
+    if len(todo) > batch_size:
+        batches = [[items[i] for i in todo[start:start + batch_size]]
+                   for start in range(0, len(todo), batch_size)]
+        with process_pool(workers) as executor:
+            results = [line for batch in executor.map(_subdivide_batch, batches, [distance] * len(batches),
+                                                              [tolerance] * len(batches))
+                       for line in batch]
+    else:
+        results = [_subdivide_checked(segment_from_params(items[i]), distance, tolerance) for i in todo]
+    for i, line in zip(todo, results):
+        items[i] = line
+    if not join:
+        return [line for line in items if line is not None]
+    # Runs of pieces that carry on from each other within a subpath
+    runs = list()
+    last = None
+    for group, line in zip(groups, items):
+        if line is None:
+            continue
+        if runs and group == last and _continues(runs[-1][-1], line):
+            runs[-1].append(line)
+        else:
+            runs.append([line])
+        last = group
+    return [_join(run) for run in runs]
@@ -0,0 +1,209 @@
+"""
+Tiled greedy ordering, to spread optimize_lines over every core.
+
+The bed gets cut into a grid of tiles and each chunk goes in the tile its
+midpoint falls in. Every tile is ordered on its own by the same greedy
+nearest-endpoint search as optimize_lines (an XYHash), in a pool of worker
+processes. Then the tiles are visited in serpentine order (left to right,
+up a row, right to left, ...), and each one is stitched on to the last by
+picking the chunk to enter it at: any chunk on its path, drawn either way
+round, whichever makes the hop from where the last tile finished (plus
+the hop that breaks open in the path) shortest.
+
+The endpoints go to the workers in a shared memory block sorted by tile,
+so a job is just a name and a range, nothing big gets pickled.
+"""
+import math
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import wait
+from contextlib import nullcontext
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from botaplot.util.tour import pen_up_travel
+from botaplot.util.util import process_pool
+
+TileStats = namedtuple("TileStats", ["tiles", "travel", "seconds"])
+
+
+def greedy_order(starts, ends, entry=None, cancel=None):
+    """
+    Greedy nearest endpoint tour of the chunks with the given endpoints,
+    the same search as optimize_lines, starting from whichever endpoint is
+    closest to entry (or the first chunk). Returns (order, flip) as lists.
+    cancel is a threading.Event, if it gets set we stop searching and tack
+    the rest on the end as they come.
+    """
+    # Circular import, the XYHash lives with the Plottable
+    from botaplot.models.plottable import XYHash
+    plines = [(s, e) for s, e in zip(map(tuple, starts.tolist()), map(tuple, ends.tolist()))]
+    index_of = {id(pline): i for i, pline in enumerate(plines)}
+    hashed = XYHash(plines)
+    order, flip = list(), [False] * len(plines)
+    if entry is None:
+        entry = plines[0][0] if plines else (0.0, 0.0)
+    x, y = entry
+    while len(hashed):
+        if cancel is not None and len(order) % 64 == 0 and cancel.is_set():
+            break
+        found = hashed.closest(x, y)
+        if found is None:
+            break  # Only unreachable (invalid) endpoints left
+        pline, reverse, _ = found
+        i = index_of[id(pline)]
+        order.append(i)
+        flip[i] = reverse
+        x, y = pline[0] if reverse else pline[-1]
+    if len(order) < len(plines):
+        drawn = set(order)
+        order.extend(i for i in range(len(plines)) if i not in drawn)
+    return order, flip
+
+
+def _order_tile(name, count, lo, hi, entry):
+    """Runs in a worker: greedy order of rows lo..hi of the shared (count,
+    4) endpoint block. Returns (order, flip) local to the tile."""
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        block = np.ndarray((count, 4), dtype=np.float64, buffer=shm.buf)[lo:hi].copy()
+    finally:
+        shm.close()
+    order, flip = greedy_order(block[:, :2], block[:, 2:], entry)
+    return np.array(order, dtype=np.int64), np.array(flip, dtype=bool)
+
+
+def tile_grid(bounds, count, per_tile=20000, workers=None):
+    """(columns, rows) for count chunks: enough tiles to keep every worker
+    busy a few times over, no more than about per_tile chunks in any of
+    them, and roughly square tiles on the bed"""
+    workers = workers or os.cpu_count() or 1
+    tiles = max(4 * workers, int(math.ceil(count / float(per_tile))))
+    width = max(bounds[2] - bounds[0], 1e-9)
+    height = max(bounds[3] - bounds[1], 1e-9)
+    columns = max(1, int(round(math.sqrt(tiles * width / height))))
+    rows = max(1, int(math.ceil(tiles / float(columns))))
+    return columns, rows
+
+
+def _stitch(starts, ends, chunks, chunk_flip, pen):
+    """
+    Where to enter a tile's path from pen: the path gets rotated to start
+    at any of its chunks, forwards or backwards, whichever costs least.
+    Entering at chunk j costs the hop from pen to it, plus the hop from
+    the end of the path back round to its start, less the hop into j we
+    no longer make. Returns (chunks, flip, where the pen ends up).
+    """
+    best = None
+    for chunks, chunk_flip in ((chunks, chunk_flip), (chunks[::-1], ~chunk_flip[::-1])):
+        enter = np.where(chunk_flip[:, None], ends[chunks], starts[chunks])
+        leave = np.where(chunk_flip[:, None], starts[chunks], ends[chunks])
+        cost = np.hypot(*(enter - pen).T)
+        cost[1:] += np.hypot(*(leave[-1] - enter[0])) - np.hypot(*(leave[:-1] - enter[1:]).T)
+        j = int(np.argmin(cost))
+        if best is None or cost[j] < best[0]:
+            best = (cost[j], np.roll(chunks, -j), np.roll(chunk_flip, -j), leave[j - 1])
+    return best[1:]
+
+
+def tiled_order(starts, ends, bounds=None, grid=None, workers=None, per_tile=20000, cancel=None,
+                executor=None):
+    """
+    Returns (order, flip, TileStats) for chunks with the given (N, 2)
+    start and end points, order being the chunk indices to draw in, flip
+    whether to draw each one (indexed by chunk) backwards.
+    bounds is (xmin, ymin, xmax, ymax) to tile, in the same units as the
+    points, defaulting to the chunks' own. Chunks outside it go in the nearest edge tile. grid
+    is (columns, rows), see tile_grid for the default. Anything that fits
+    in one tile just gets done right here. cancel is a threading.Event,
+    like greedy_order's, once it's set tiles that haven't been ordered yet
+    go in as they come. executor is a pool to use instead of starting one,
+    see util.process_pool.
+    """
+    started = time.perf_counter()
+    starts = np.asarray(starts, dtype=np.float64).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=np.float64).reshape(-1, 2)
+    n = len(starts)
+    if not n:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=bool), TileStats(0, 0.0, 0.0)
+    if bounds is None:
+        lo = np.minimum(starts.min(axis=0), ends.min(axis=0))
+        hi = np.maximum(starts.max(axis=0), ends.max(axis=0))
+        bounds = (lo[0], lo[1], hi[0], hi[1])
+    bounds = [float(b) for b in bounds]
+    if n <= per_tile and grid is None:
+        grid = (1, 1)
+    columns, rows = grid or tile_grid(bounds, n, per_tile, workers)
+    width = max(bounds[2] - bounds[0], 1e-9) / columns
+    height = max(bounds[3] - bounds[1], 1e-9) / rows
+
+    # Which tile each chunk is in, numbered in serpentine order
+    mids = (starts + ends) * 0.5
+    col = np.clip(((mids[:, 0] - bounds[0]) / width).astype(np.int64), 0, columns - 1)
+    row = np.clip(((mids[:, 1] - bounds[1]) / height).astype(np.int64), 0, rows - 1)
+    tile = row * columns + np.where(row % 2 == 0, col, columns - 1 - col)
+    by_tile = np.argsort(tile, kind="stable")
+    edges = np.searchsorted(tile[by_tile], np.arange(columns * rows + 1))
+
+    # Each tile's greedy starts at the spot on its edge nearest the middle
+    # of the tile before it (the bed corner for the first one)
+    entries = list()
+    previous = (bounds[0], bounds[1])
+    for t in range(columns * rows):
+        r = t // columns
+        c = t % columns if r % 2 == 0 else columns - 1 - t % columns
+        x0, y0 = bounds[0] + c * width, bounds[1] + r * height
+        entries.append((min(max(previous[0], x0), x0 + width), min(max(previous[1], y0), y0 + height)))
+        previous = (x0 + width / 2, y0 + height / 2)
+    busy = [t for t in range(columns * rows) if edges[t + 1] > edges[t]]
+
+    paths = dict()
+    if len(busy) == 1:
+        t = busy[0]
+        order, flip = greedy_order(starts[by_tile], ends[by_tile], entries[t], cancel)
+        paths[t] = (np.array(order, dtype=np.int64), np.array(flip, dtype=bool))
+    else:
+        block = np.column_stack((starts, ends))[by_tile]
+        shm = shared_memory.SharedMemory(create=True, size=block.nbytes)
+        try:
+            np.ndarray(block.shape, dtype=np.float64, buffer=shm.buf)[:] = block
+            with nullcontext(executor) if executor is not None else process_pool(workers) as pool:
+                # Biggest tiles first so nobody is left waiting on one at the end
+                jobs = {t: pool.submit(_order_tile, shm.name, n, int(edges[t]), int(edges[t + 1]), entries[t])
+                        for t in sorted(busy, key=lambda t: edges[t] - edges[t + 1])}
+                for t, job in jobs.items():
+                    while cancel is not None and not cancel.is_set():
+                        if wait([job], timeout=0.1).done:
+                            break
+                    if cancel is not None and cancel.is_set():
+                        if executor is None:
+                            pool.shutdown(wait=False, cancel_futures=True)
+                        else:
+                            # Not ours to shut down, just drop what hasn't started
+                            for pending in jobs.values():
+                                pending.cancel()
+                        break
+                    paths[t] = job.result()
+                for t in busy:
+                    if t not in paths:
+                        count = int(edges[t + 1] - edges[t])
+                        paths[t] = (np.arange(count), np.zeros(count, dtype=bool))
+        finally:
+            shm.close()
+            shm.unlink()
+
+    # Stitch the tiles together, in serpentine order
+    order = list()
+    flip = np.zeros(n, dtype=bool)
+    pen = np.array(entries[busy[0]])
+    for t in busy:
+        local_order, local_flip = paths[t]
+        chunks = by_tile[edges[t]:edges[t + 1]][local_order]
+        chunks, chunk_flip, pen = _stitch(starts, ends, chunks, local_flip[local_order], pen)
+        flip[chunks] = chunk_flip
+        order.append(chunks)
+    order = np.concatenate(order)
+    stats = TileStats(len(busy), pen_up_travel(starts, ends, order, flip), time.perf_counter() - started)
+    return order, flip, stats
@@ -0,0 +1,289 @@
+"""
+Tour improvement for the pen-up moves between chunks.
+
+A tour is an order to draw the chunks in, and which way round to draw each
+one. Only the hops from the end of one chunk to the start of the next cost
+anything (that's pen-up travel), so we work on the chunk endpoints alone:
+starts and ends are (N, 2) arrays of each chunk's first and last point.
+
+improve_tour() takes a tour (say, from the greedy optimize_lines) and
+applies 2-opt moves (reverse a run of chunks, flipping each one) and
+Or-opt moves (pick up 1-3 chunks and put them down somewhere else, either
+way round), only ever looking at the nearest few endpoints from a KD tree.
+Big tours get cut into contiguous blocks that are improved in parallel, with
+the block boundaries shifted every round so nothing is stuck at an edge.
+"""
+import math
+import time
+from collections import namedtuple
+from contextlib import nullcontext
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from botaplot.util.util import process_pool
+
+TourStats = namedtuple("TourStats", ["travel_before", "travel_after", "moves", "rounds", "seconds"])
+
+
+def pen_up_travel(starts, ends, order=None, flip=None):
+    """Total pen-up travel of drawing the chunks in order, flipped where
+    flip is set. Defaults to as-is."""
+    starts, ends = oriented(starts, ends, order, flip)
+    if len(starts) < 2:
+        return 0.0
+    return float(np.hypot(*(starts[1:] - ends[:-1]).T).sum())
+
+
+def oriented(starts, ends, order=None, flip=None):
+    """The (starts, ends) of the chunks as drawn by a tour"""
+    starts = np.asarray(starts, dtype=np.float64).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=np.float64).reshape(-1, 2)
+    if order is not None:
+        starts, ends = starts[order], ends[order]
+    if flip is not None:
+        flip = np.asarray(flip, dtype=bool)
+        if order is not None:
+            flip = flip[order]
+        starts, ends = np.where(flip[:, None], ends, starts), np.where(flip[:, None], starts, ends)
+    return starts, ends
+
+
+class _Tour(object):
+    """
+    Local search over one tour. Chunk i's endpoints are endpoint ids 2i
+    (start) and 2i+1 (end), flip[i] swaps them. before/after are fixed
+    points the tour has to connect to (or None for an open end).
+    """
+
+    def __init__(self, starts, ends, before=None, after=None, neighbours=8):
+        self.n = n = len(starts)
+        points = np.empty((2 * n, 2), dtype=np.float64)
+        points[0::2] = starts
+        points[1::2] = ends
+        self.points = [tuple(p) for p in points.tolist()]
+        self.before = None if before is None else tuple(before)
+        self.after = None if after is None else tuple(after)
+        self.order = list(range(n))
+        self.flip = [False] * n
+        self.pos = list(range(n))
+        k = min(neighbours + 2, 2 * n)
+        _, nearest = cKDTree(points).query(points, k=k)
+        nearest = np.asarray(nearest).reshape(2 * n, -1)
+        # Leave out the chunk's own endpoints
+        own = (nearest // 2) == (np.arange(2 * n) // 2)[:, None]
+        self.nearest = [[q for q, mine in zip(row, skip) if not mine][:neighbours]
+                        for row, skip in zip(nearest.tolist(), own.tolist())]
+        self.moves = 0
+
+    # Current endpoint id at the start/end of position k
+    def _start_id(self, k):
+        chunk = self.order[k]
+        return 2 * chunk + self.flip[chunk]
+
+    def _end_id(self, k):
+        chunk = self.order[k]
+        return 2 * chunk + 1 - self.flip[chunk]
+
+    def _s(self, k):
+        """Start point of position k, or the fixed after point past the end"""
+        if k >= self.n:
+            return self.after
+        return self.points[self._start_id(k)]
+
+    def _e(self, k):
+        """End point of position k, or the fixed before point ahead of it"""
+        if k < 0:
+            return self.before
+        return self.points[self._end_id(k)]
+
+    @staticmethod
+    def _d(p, q):
+        if p is None or q is None:
+            return 0.0
+        return math.hypot(p[0] - q[0], p[1] - q[1])
+
+    def travel(self):
+        return sum(self._d(self._e(k), self._s(k + 1)) for k in range(-1, self.n))
+
+    def _reverse(self, lo, hi):
+        """Reverse (and flip) positions lo..hi"""
+        order, flip, pos = self.order, self.flip, self.pos
+        order[lo:hi + 1] = order[lo:hi + 1][::-1]
+        for k in range(lo, hi + 1):
+            chunk = order[k]
+            flip[chunk] = not flip[chunk]
+            pos[chunk] = k
+
+    def _move(self, a, b, p, reverse):
+        """Take positions a..b out and put them back between p and p+1"""
+        order, flip, pos = self.order, self.flip, self.pos
+        segment = order[a:b + 1]
+        if reverse:
+            segment = segment[::-1]
+            for chunk in segment:
+                flip[chunk] = not flip[chunk]
+        if p > b:
+            order[a:p + 1] = order[b + 1:p + 1] + segment
+            lo, hi = a, p
+        else:
+            order[p + 1:b + 1] = segment + order[p + 1:a]
+            lo, hi = p + 1, b
+        for k in range(lo, hi + 1):
+            pos[order[k]] = k
+
+    def _try_2opt(self, i, j):
+        """Reverse positions i+1..j (or j+1..i), joining the end of i to the
+        end of j and the start of i+1 to the start of j+1"""
+        lo, hi = (i, j) if i < j else (j, i)
+        if lo == hi or lo < -1 or hi >= self.n:
+            return False
+        d, e, s = self._d, self._e, self._s
+        delta = d(e(lo), e(hi)) + d(s(lo + 1), s(hi + 1)) - d(e(lo), s(lo + 1)) - d(e(hi), s(hi + 1))
+        if delta < -1e-9:
+            self._reverse(lo + 1, hi)
+            self.moves += 1
+            return True
+        return False
+
+    def _try_or(self, a, b, p, reverse):
+        """Move positions a..b to between p and p+1, maybe backwards"""
+        if a < 0 or b >= self.n or a > b or a - 1 <= p <= b:
+            return False
+        d, e, s = self._d, self._e, self._s
+        delta = d(e(a - 1), s(b + 1)) - d(e(a - 1), s(a)) - d(e(b), s(b + 1)) - d(e(p), s(p + 1))
+        if reverse:
+            delta += d(e(p), e(b)) + d(s(a), s(p + 1))
+        else:
+            delta += d(e(p), s(a)) + d(e(b), s(p + 1))
+        if delta < -1e-9:
+            self._move(a, b, p, reverse)
+            self.moves += 1
+            return True
+        return False
+
+    def _improve_gap(self, i, segment=3):
+        """Try everything that would put a near neighbour across the hop
+        from position i to i+1. Returns True if anything got better."""
+        for side in (0, 1):
+            k = i if side == 0 else i + 1
+            if k < 0 or k >= self.n:
+                continue
+            mine = self._end_id(k) if side == 0 else self._start_id(k)
+            for q in self.nearest[mine]:
+                j = self.pos[q // 2]
+                q_is_end = q == self._end_id(j)
+                if side == 0:
+                    # From the end of i
+                    if q_is_end:
+                        if self._try_2opt(i, j):
+                            return True
+                        for length in range(1, segment + 1):
+                            if self._try_or(j - length + 1, j, i, True):
+                                return True
+                    else:
+                        for length in range(1, segment + 1):
+                            if self._try_or(j, j + length - 1, i, False):
+                                return True
+                else:
+                    # From the start of i+1
+                    if q_is_end:
+                        for length in range(1, segment + 1):
+                            if self._try_or(j - length + 1, j, i, False):
+                                return True
+                    else:
+                        if self._try_2opt(i, j - 1):
+                            return True
+                        for length in range(1, segment + 1):
+                            if self._try_or(j, j + length - 1, i, True):
+                                return True
+        return False
+
+    def improve(self, budget=None, cancel=None):
+        """Passes over every hop until nothing improves, we run out of
+        budget seconds or cancel (a threading.Event) gets set"""
+        deadline = None if budget is None else time.monotonic() + budget
+        improved = True
+        while improved:
+            improved = False
+            for i in range(-1, self.n):
+                while self._improve_gap(i):
+                    improved = True
+                if i % 64 == 0:
+                    if deadline is not None and time.monotonic() > deadline:
+                        return self
+                    if cancel is not None and cancel.is_set():
+                        return self
+        return self
+
+
+def _improve_block(starts, ends, before, after, neighbours, deadline):
+    """Runs in a worker, improves one block until deadline (wall clock, so
+    it means the same thing in every process), returns (order, flip, moves)"""
+    tour = _Tour(starts, ends, before, after, neighbours)
+    tour.improve(max(deadline - time.time(), 0.0))
+    return tour.order, [tour.flip[chunk] for chunk in tour.order], tour.moves
+
+
+def improve_tour(starts, ends, order=None, flip=None, time_budget=5.0, neighbours=8,
+                 workers=None, block_size=4000, cancel=None, executor=None):
+    """
+    Improve a tour of chunks with the given endpoints. Returns (order,
+    flip, TourStats), order being the chunk indices to draw in, flip
+    whether to draw each one (indexed by chunk) backwards.
+    Tours longer than block_size get split into blocks and improved on a
+    pool of workers processes, otherwise it's done right here. Pass an
+    executor (see util.process_pool) to use one you're keeping around
+    instead of starting a new pool.
+    Setting cancel (a threading.Event) stops it early with what it has, the
+    blocks only find out at the end of their round.
+    """
+    started = time.monotonic()
+    deadline = started + time_budget
+    starts = np.asarray(starts, dtype=np.float64).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=np.float64).reshape(-1, 2)
+    n = len(starts)
+    order = np.arange(n) if order is None else np.asarray(order, dtype=np.int64)
+    flip = np.zeros(n, dtype=bool) if flip is None else np.asarray(flip, dtype=bool).copy()
+    before = pen_up_travel(starts, ends, order, flip)
+    moves = 0
+    rounds = 0
+    if n < 3:
+        return order, flip, TourStats(before, before, 0, 0, time.monotonic() - started)
+
+    if n <= block_size:
+        s, e = oriented(starts, ends, order, flip)
+        tour = _Tour(s, e, neighbours=neighbours).improve(time_budget, cancel)
+        flip[order] ^= np.array(tour.flip, dtype=bool)
+        order = order[tour.order]
+        moves, rounds = tour.moves, 1
+    else:
+        with nullcontext(executor) if executor is not None else process_pool(workers) as executor:
+            idle = 0
+            while time.monotonic() < deadline and idle < 2 and not (cancel is not None and cancel.is_set()):
+                # Every other round the blocks straddle the last round's edges
+                shift = (rounds % 2) * (block_size // 2)
+                edges = [0] + list(range(shift or block_size, n, block_size)) + [n]
+                edges = sorted(set(edges))
+                s, e = oriented(starts, ends, order, flip)
+                wall_deadline = time.time() + max(deadline - time.monotonic(), 0.0)
+                jobs = list()
+                for lo, hi in zip(edges[:-1], edges[1:]):
+                    jobs.append(executor.submit(
+                        _improve_block, s[lo:hi], e[lo:hi],
+                        e[lo - 1] if lo > 0 else None,
+                        s[hi] if hi < n else None,
+                        neighbours, wall_deadline))
+                round_moves = 0
+                for (lo, hi), job in zip(zip(edges[:-1], edges[1:]), jobs):
+                    local_order, local_flip, local_moves = job.result()
+                    block = order[lo:hi]
+                    flip[block[local_order]] ^= np.array(local_flip, dtype=bool)
+                    order[lo:hi] = block[local_order]
+                    round_moves += local_moves
+                moves += round_moves
+                rounds += 1
+                # Stop once both block layouts are as good as they get
+                idle = idle + 1 if round_moves == 0 else 0
+    after = pen_up_travel(starts, ends, order, flip)
+    return order, flip, TourStats(before, after, moves, rounds, time.monotonic() - started)
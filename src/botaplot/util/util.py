@@ -1,13 +1,21 @@
 # Misc utils
+import multiprocessing
 import numpy as np
 from math import sqrt
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
 MAX_LENGTH = 2**24
 
 NextLine = namedtuple("NextLine", ["index", "reverse", "distance", "valid"])
 
 
+def process_pool(workers=None):
+    """A ProcessPoolExecutor for farming work out to other cores. It spawns
+    rather than forks, the Qt app has threads of its own going."""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
 def split_lines_at_discontinuities(coords):
     lines = []
     line = []
@@ -53,16 +61,21 @@ def distance(p0, p1):
     return sqrt(dx*dx+dy*dy)
 
 
-def optimize_lines(lines, limit=30000):
+def optimize_lines(lines, limit=30000, method="hash"):
     """
     Find the closest line endpoint at the end of a given drawn line,
     and add _that_ to the output list, correctly ordered. Ensures we
     have the shortest hops between lines.
-    Brute-force and totally naive. Limit ensures we only scan the next
-    $limit lines for close endpoints, and take the closest, so that we
-    don't burn a ton of CPU searching the entire line-space every scan.
+    The default "hash" method uses an XYHash to search all of the lines.
+    The "window" method is brute-force and totally naive. Limit ensures we
+    only scan the next $limit lines for close endpoints, and take the
+    closest, so that we don't burn a ton of CPU searching the entire
+    line-space every scan.
     """
-    print("Lines is type:", type(lines), lines.__class__)
+    if method == "hash":
+        return _optimize_lines_hashed(lines)
+    elif method != "window":
+        raise ValueError("Unknown optimization method '%s'" % method)
     out_lines = []
     orig_lines = lines.copy()
     line = orig_lines.pop(0)  # Start us out.
@@ -97,3 +110,24 @@ def optimize_lines(lines, limit=30000):
     return out_lines
 
 
+
+
+def _optimize_lines_hashed(lines):
+    from botaplot.models.plottable import XYHash  # Runtime import because of circular dependency.
+    if not lines:
+        return []
+    line = lines[0]
+    out_lines = [line]
+    index = XYHash(lines[1:])
+    while len(index) > 0:
+        found = index.closest(*line[-1])
+        if found is None:
+            break
+        line, reverse, _ = found
+        if reverse:
+            line.reverse()
+        out_lines.append(line)
+    if len(out_lines) < len(lines):
+        drawn = set(id(line) for line in out_lines)
+        out_lines.extend(line for line in lines if id(line) not in drawn)
+    return out_lines
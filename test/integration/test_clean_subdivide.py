@@ -54,8 +54,8 @@ class TestCleanSubdivide(unittest.TestCase):
             num_segs_new += len(newline)
             xp, yp = zip(*line)
             plt.plot(xp, yp, color="g")
-            self.assertListEqual(line[0], newline[0])
-            self.assertListEqual(line[-1], newline[-1])
+            self.assertListEqual(line[0].tolist(), newline[0].tolist())
+            self.assertListEqual(line[-1].tolist(), newline[-1].tolist())
         print("Old method: %d lines" % num_segs_old)
         print("New method: %d lines" % num_segs_new)
         plt.show()
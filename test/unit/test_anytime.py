@@ -0,0 +1,99 @@
+#!/bin/env python
+
+import threading
+import unittest
+
+import numpy as np
+
+from botaplot.models.plottable import Plottable
+from botaplot.util.anytime import AnytimeOptimizer
+from botaplot.util.tour import improve_tour
+
+
+class TestAnytime(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        starts = rng.uniform(0, 100, (500, 2))
+        ends = starts + rng.normal(size=(500, 2))
+        self.tp = Plottable([Plottable.Line([s, e]) for s, e in zip(starts, ends)] + [Plottable.Line([])])
+
+    def travel(self, tp):
+        chunks = [chunk for chunk in tp.chunks if len(chunk)]
+        return sum(np.hypot(*(b.points[0] - a.points[-1])) for a, b in zip(chunks[:-1], chunks[1:]))
+
+    def test_improvements(self):
+        found = list()
+        optimizer = AnytimeOptimizer(self.tp, time_budget=30.0)
+        stats = optimizer.run(lambda *args: found.append(args))
+        stages = [stage for _, _, _, stage in found]
+        self.assertEqual(stages[:3], ["original", "hilbert", "greedy"])
+        self.assertIn("2-opt", stages)
+        travels = [travel for _, _, travel, _ in found]
+        self.assertEqual(travels, sorted(travels, reverse=True))
+        self.assertEqual(stats.improvements, len(found) - 1)
+        self.assertFalse(stats.cancelled)
+        order, flip, travel, _ = optimizer.best()
+        self.assertAlmostEqual(travel, stats.travel_after)
+        self.assertEqual(sorted(order.tolist()), list(range(501)))
+        self.assertEqual(order[-1], 500)  # Empty chunk goes last
+        reordered = self.tp.reordered(order, flip)
+        self.assertAlmostEqual(self.travel(reordered), travel)
+        self.assertEqual(len(reordered), 501)
+
+    def test_tiled(self):
+        # Big drawings get their greedy pass tile by tile, over the bounds they're given
+        optimizer = AnytimeOptimizer(self.tp, time_budget=0.0, workers=2, bounds=(0, 0, 100, 100))
+        optimizer.tiled_above = 100
+        found = list()
+        optimizer.run(lambda *args: found.append(args))
+        self.assertIn("tiled", [stage for _, _, _, stage in found])
+        order, _, _, _ = optimizer.best()
+        self.assertEqual(sorted(order.tolist()), list(range(501)))
+
+    def test_blocks(self):
+        # Each 2-opt slice works in blocks, on the one pool for the run
+        optimizer = AnytimeOptimizer(self.tp, time_budget=30.0, workers=2)
+        optimizer.block_size = 100
+        optimizer.slice_seconds = 1.0
+        found = list()
+        stats = optimizer.run(lambda *args: found.append(args))
+        self.assertIn("2-opt", [stage for _, _, _, stage in found])
+        order, _, travel, _ = optimizer.best()
+        self.assertEqual(sorted(order.tolist()), list(range(501)))
+        self.assertAlmostEqual(self.travel(self.tp.reordered(*optimizer.best()[:2])), travel)
+        self.assertLess(stats.travel_after, stats.travel_before)
+
+    def test_reordered_leaves_original(self):
+        before = [chunk.points.copy() for chunk in self.tp]
+        flip = np.ones(501, dtype=bool)
+        reordered = self.tp.reordered(np.arange(501)[::-1], flip)
+        self.assertTrue(all(np.array_equal(a, b.points) for a, b in zip(before, self.tp)))
+        self.assertTrue(np.array_equal(reordered[1].points, before[499][::-1]))
+
+    def test_cancel(self):
+        optimizer = AnytimeOptimizer(self.tp, time_budget=30.0)
+
+        def cancel_early(order, flip, travel, stage):
+            if stage == "hilbert":
+                optimizer.cancel()
+
+        stats = optimizer.run(cancel_early)
+        self.assertTrue(stats.cancelled)
+        order, flip, travel, stage = optimizer.best()
+        # The greedy pass got cut short, so it's probably worse than Hilbert
+        self.assertIn(stage, ("hilbert", "greedy"))
+        self.assertEqual(sorted(order.tolist()), list(range(501)))
+
+    def test_cancel_tour_and_greedy(self):
+        cancel = threading.Event()
+        cancel.set()
+        starts = np.array([chunk.points[0] for chunk in self.tp.chunks[:-1]])
+        ends = np.array([chunk.points[-1] for chunk in self.tp.chunks[:-1]])
+        order, flip, stats = improve_tour(starts, ends, cancel=cancel)
+        full = improve_tour(starts, ends)[2]
+        self.assertLess(stats.moves, full.moves / 2)
+        self.assertEqual(sorted(order.tolist()), list(range(500)))
+        tp = Plottable(self.tp.chunks[:-1])
+        tp.optimize_lines(cancel=cancel)
+        self.assertEqual(len(tp), 500)
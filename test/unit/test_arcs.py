@@ -0,0 +1,85 @@
+#!/bin/env python
+
+import math
+import unittest
+
+import numpy as np
+
+from botaplot.util.arcs import arc_offset, fit_arcs
+
+
+class TestArcs(unittest.TestCase):
+
+    def circle(self, sweep, count, radius=20.0, center=(50.0, 50.0)):
+        angles = np.linspace(0.0, sweep, count)
+        return np.column_stack((center[0] + radius * np.cos(angles), center[1] + radius * np.sin(angles)))
+
+    def test_circle(self):
+        points = self.circle(1.5 * math.pi, 200)
+        moves = fit_arcs(points, 0.01)
+        self.assertEqual(len(moves), 1)
+        end, center, clockwise = moves[0]
+        self.assertEqual(end, 199)
+        self.assertTrue(np.allclose(center, (50.0, 50.0)))
+        self.assertFalse(clockwise)
+        self.assertTrue(fit_arcs(points[::-1], 0.01)[0][2])
+
+    def test_lines_and_arcs(self):
+        arc = self.circle(math.pi / 2, 30)
+        # Straight off at a corner, then another arc the other way round
+        line = arc[-1] + np.column_stack((np.linspace(2.0, 10.0, 5), np.zeros(5)))
+        other = line[-1] + self.circle(-math.pi / 2, 30, 5.0, (0.0, 0.0)) - (5.0, 0.0)
+        points = np.concatenate((arc, line, other[1:]))
+        moves = fit_arcs(points, 0.01)
+        arcs = [(end, clockwise) for end, center, clockwise in moves if center is not None]
+        self.assertEqual(arcs, [(29, False), (len(points) - 1, True)])
+        straight = [end for end, center, _ in moves if center is None]
+        self.assertEqual(straight, list(range(30, 35)))
+
+    def test_tolerance(self):
+        # Points wobbling off the circle by more than the tolerance never make an arc
+        points = self.circle(math.pi, 100)
+        points[1::2] = 50.0 + (points[1::2] - 50.0) * 1.0005  # 0.01mm out
+        self.assertTrue(all(center is None for _, center, _ in fit_arcs(points, 0.005)))
+        self.assertEqual(len(fit_arcs(points, 0.02)), 1)
+        rng = np.random.default_rng(0)
+        zigzag = np.cumsum(rng.normal(size=(1000, 2)), axis=0)
+        moves = fit_arcs(zigzag, 0.01)
+        self.assertEqual([end for end, _, _ in moves][-1], 999)
+        for start, (end, center, _) in zip([0] + [end for end, _, _ in moves], moves):
+            if center is not None:
+                radius = np.hypot(*(zigzag[start] - center))
+                self.assertLess(np.abs(np.hypot(*(zigzag[start:end + 1] - center).T) - radius).max(), 0.01)
+
+    def test_posted_tolerance(self):
+        # Nearly a whole circle, so the ends are close and rounding them
+        # swings the centre a long way, unless we check what gets posted
+        gap = 2.0 * math.asin(1.55 / (2.0 * 77.8))
+        points = self.circle(2.0 * math.pi - gap, 1600, 77.8, (100.123, 80.457))
+
+        def worst(moves):
+            start, worst = 0, 0.0
+            for end, center, _ in moves:
+                if center is not None:
+                    begin = np.round(points[start], 2)
+                    center = begin + np.round(arc_offset(points[start], points[end], center, 2), 3)
+                    radius = np.hypot(*(begin - center))
+                    worst = max(worst, np.abs(np.hypot(*(points[start:end + 1] - center).T) - radius).max())
+                start = end
+            return worst
+
+        self.assertGreater(worst(fit_arcs(points, 0.02)), 0.1)
+        moves = fit_arcs(points, 0.02, decimals=2)
+        self.assertLessEqual(worst(moves), 0.02)
+        self.assertTrue(all(center is not None for _, center, _ in moves))
+
+    def test_arc_offset(self):
+        start, end = (10.004, 0.0), (0.0, 9.996)
+        i, j = arc_offset(start, end, (0.0, 0.0), 2)
+        center = np.round(start, 2) + (i, j)
+        self.assertAlmostEqual(np.hypot(*(np.round(start, 2) - center)), np.hypot(*(np.round(end, 2) - center)))
+        self.assertLess(np.hypot(*center), 0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
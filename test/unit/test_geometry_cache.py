@@ -0,0 +1,93 @@
+#!/bin/env python
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from botaplot.resources import resource_path
+from botaplot.util.geometry_cache import GeometryCache, SVGHeader
+from botaplot.models.project_model import ProjectModel
+
+
+class TestGeometryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = GeometryCache(self.tmpdir)
+        self.points = np.arange(20, dtype=np.float64).reshape(-1, 2)
+        self.offsets = np.array([0, 4, 10], dtype=np.int64)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_key(self):
+        key = GeometryCache.key(b"<svg/>", distance=0.3, epsilon=0.2)
+        self.assertEqual(key, GeometryCache.key(b"<svg/>", epsilon=0.2, distance=0.3))
+        self.assertNotEqual(key, GeometryCache.key(b"<svg />", distance=0.3, epsilon=0.2))
+        self.assertNotEqual(key, GeometryCache.key(b"<svg/>", distance=0.3, epsilon=0.1))
+
+    def test_roundtrip(self):
+        self.assertIsNone(self.cache.get("nope"))
+        meta = SVGHeader({"height": "10in"}, {"x": 1.0, "y": 2.0, "width": 3.0, "height": 4.0}).as_dict()
+        self.cache.put("abc", self.points, self.offsets, meta)
+        points, offsets, meta = self.cache.get("abc")
+        np.testing.assert_array_equal(points, self.points)
+        np.testing.assert_array_equal(offsets, self.offsets)
+        header = SVGHeader(**meta)
+        self.assertEqual(header.values["height"], "10in")
+        self.assertEqual(header.viewbox.height, 4.0)
+
+    def test_corrupt_entry(self):
+        with open(os.path.join(self.tmpdir, "bad.npz"), "wb") as f:
+            f.write(b"not a zip file")
+        self.assertIsNone(self.cache.get("bad"))
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "bad.npz")))
+
+    def test_lru_eviction(self):
+        self.cache.put("a", self.points, self.offsets)
+        self.cache.put("b", self.points, self.offsets)
+        entry_size = self.cache.size() // 2
+        # Make "a" the most recently used, then add a third one with only room for two
+        past = time.time() - 100
+        os.utime(os.path.join(self.tmpdir, "b.npz"), (past, past))
+        os.utime(os.path.join(self.tmpdir, "a.npz"), (past + 1, past + 1))
+        self.cache.max_bytes = entry_size * 2
+        self.cache.put("c", self.points, self.offsets)
+        self.assertIsNotNone(self.cache.get("a"))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertIsNotNone(self.cache.get("c"))
+        self.assertLessEqual(self.cache.size(), self.cache.max_bytes)
+
+    def test_load_from_svg(self):
+        """A second load comes from the cache and gives the same geometry"""
+        path = resource_path("images", "hearts_cropped_test.svg")
+        old_cache = ProjectModel.geometry_cache
+        ProjectModel.geometry_cache = self.cache
+        try:
+            ProjectModel.load_from_svg(path)
+            first = ProjectModel.current
+            self.assertEqual(len(self.cache.entries()), 1)
+            ProjectModel.load_from_svg(path)
+            second = ProjectModel.current
+        finally:
+            ProjectModel.geometry_cache = old_cache
+        self.assertIsInstance(second.svg, SVGHeader)
+        for a, b in zip(first.plottables["all"][0].buffer(), second.plottables["all"][0].buffer()):
+            np.testing.assert_array_equal(a, b)
+        plottable = second.plottables["all"][0]
+        self.assertEqual(first.get_transform(plottable), second.get_transform(plottable))
+        self.assertEqual(first.get_inv_transform(plottable), second.get_inv_transform(plottable))
+        # The bed, in the drawing's units, then just the bit the drawing covers
+        x, y, scalex, scaley = first.get_transform(plottable)
+        xmin, ymin, xmax, ymax = first.tile_bounds(plottable)
+        (x0, y0), (x1, y1) = first.machine.limits
+        self.assertTrue(x0 - 1e-6 <= xmin * scalex + x < xmax * scalex + x <= x1 + 1e-6)
+        self.assertTrue(y0 - 1e-6 <= min(ymin * scaley + y, ymax * scaley + y) <= y1 + 1e-6)
+        bounds = plottable.bounds
+        self.assertTrue(bounds[0] <= xmin < xmax <= bounds[2] and bounds[1] <= ymin < ymax <= bounds[3])
+        for model in (first, second):
+            model.plot_worker.kill()
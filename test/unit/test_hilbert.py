@@ -0,0 +1,50 @@
+#!/bin/env python
+
+import unittest
+
+import numpy as np
+
+from botaplot.models.plottable import Plottable
+from botaplot.util.hilbert import hilbert_index, hilbert_order
+
+
+class TestHilbert(unittest.TestCase):
+
+    def test_index_is_a_curve(self):
+        """Every cell once, each one next to the one before"""
+        for bits in (1, 3, 4, 6):
+            side = 1 << bits
+            x, y = np.meshgrid(np.arange(side), np.arange(side))
+            x, y = x.ravel(), y.ravel()
+            index = hilbert_index(x, y, bits)
+            self.assertEqual(sorted(index.tolist()), list(range(side * side)))
+            order = np.argsort(index)
+            steps = np.abs(np.diff(x[order])) + np.abs(np.diff(y[order]))
+            self.assertTrue(np.all(steps == 1))
+
+    def test_order_and_direction(self):
+        starts = np.array([[10, 0], [0, 0], [5, 0.1]], dtype=float)
+        ends = np.array([[11, 0], [1, 0], [4, 0.1]], dtype=float)
+        order, flip = hilbert_order(starts, ends)
+        self.assertEqual(sorted(order.tolist()), [0, 1, 2])
+        # Left to right (or right to left), each one pointing onward
+        xs = [(ends if flip[i] else starts)[i][0] for i in order]
+        self.assertTrue(xs == sorted(xs) or xs == sorted(xs, reverse=True))
+        with self.assertRaises(ValueError):
+            hilbert_order(starts, ends, key="nope")
+
+    def test_plottable_hilbert(self):
+        rng = np.random.default_rng(11)
+        starts = rng.uniform(0, 100, (2000, 2))
+        ends = starts + rng.uniform(-0.5, 0.5, (2000, 2))
+
+        def travel(tp):
+            chunks = [chunk for chunk in tp.chunks if len(chunk)]
+            return sum(np.hypot(*(b.points[0] - a.points[-1])) for a, b in zip(chunks[:-1], chunks[1:]))
+
+        tp = Plottable([Plottable.Line([s, e]) for s, e in zip(starts, ends)] + [Plottable.Line([])])
+        before = travel(tp)
+        tp.optimize_lines(method="hilbert")
+        self.assertEqual(len(tp), 2001)
+        self.assertEqual(len(tp[-1]), 0)
+        self.assertLess(travel(tp), before / 10)
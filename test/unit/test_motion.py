@@ -0,0 +1,126 @@
+#!/bin/env python
+
+import math
+import unittest
+
+import numpy as np
+
+from botaplot.models.machine import Machine
+from botaplot.models.plottable import Plottable
+from botaplot.post.gcode_base import GCodePost
+from botaplot.util.metrics import dwell_seconds
+from botaplot.util.motion import parse_gcode, motion_program, simulate
+
+
+class TestMotion(unittest.TestCase):
+
+    # 1000 mm/min is 16.67 mm/s, and at 1000 mm/s^2 it takes 0.14mm to get there
+    speed = 1000.0 / 60.0
+    acceleration = 1000.0
+
+    def seconds(self, commands, **kw):
+        return simulate(commands, acceleration=self.acceleration, **kw).seconds
+
+    def test_parse(self):
+        lines, line, letter, value = parse_gcode([
+            "G01 F1200.00 X-12.5 Y.25 ; G0 X9",
+            "g0x1y2",
+            "M280 S5",
+            "",
+            "G4 P150",
+            "X 3.0"])
+        self.assertEqual(lines, 6)
+        self.assertEqual(line.tolist(), [0, 0, 0, 0, 1, 1, 1, 2, 2, 4, 4])
+        self.assertEqual(bytes(letter.tolist()), b"GFXYGXYMSGP")
+        self.assertEqual(value.tolist(), [1, 1200, -12.5, 0.25, 0, 1, 2, 280, 5, 4, 150])
+        with self.assertRaises(ValueError):
+            parse_gcode("G1 X1.2.3")
+
+    def test_empty(self):
+        for commands in ("", [], ["; nothing but comments", ""]):
+            lines, line, letter, value = parse_gcode(commands)
+            self.assertEqual((line.tolist(), letter.tolist(), value.tolist()), ([], [], []))
+            self.assertEqual(self.seconds(commands), 0.0)
+
+    def test_single_move(self):
+        seconds = self.seconds(["G1 F1000 X100"])
+        self.assertAlmostEqual(seconds, 100.0 / self.speed + self.speed / self.acceleration)
+
+    def test_short_move(self):
+        # Never gets up to speed, accelerates half way then brakes
+        seconds = self.seconds(["G1 F1000 X0.1"])
+        self.assertAlmostEqual(seconds, 2.0 * np.sqrt(0.1 / self.acceleration))
+
+    def test_rapid(self):
+        seconds = self.seconds(["G0 X100"], rapid_feedrate=3000.0)
+        self.assertAlmostEqual(seconds, 100.0 / 50.0 + 50.0 / self.acceleration)
+
+    def test_straight_through(self):
+        one = self.seconds(["G1 F1000 X100"])
+        split = self.seconds(["G1 F1000 X25", "G1 X50", "G1 X100"])
+        self.assertAlmostEqual(one, split)
+
+    def test_corner(self):
+        straight = self.seconds(["G1 F1000 X50", "G1 X100"])
+        corner = self.seconds(["G1 F1000 X50", "G1 Y50"])
+        stopped = self.seconds(["G1 F1000 X50", "M400", "G1 X100"])
+        self.assertGreater(corner, straight)
+        self.assertLess(corner, stopped)
+        self.assertAlmostEqual(stopped, 2.0 * (50.0 / self.speed + self.speed / self.acceleration))
+
+    def test_arcs(self):
+        # Half and whole circles of radius 10 at 10mm/s, with no time to speak of speeding up
+        half = simulate(["G2 F600 X20 Y0 I10 J0"], acceleration=1e9)
+        self.assertAlmostEqual(half.seconds, math.pi, places=4)
+        self.assertAlmostEqual(simulate(["G3 F600 X0 Y0 I10 J0"], acceleration=1e9).seconds, 2 * math.pi, places=4)
+        # Going round the other way is the long way
+        self.assertAlmostEqual(simulate(["G3 F600 X20 Y0 I10 J0"], acceleration=1e9).seconds, math.pi, places=4)
+        self.assertAlmostEqual(simulate(["G3 F600 X10 Y10 I10 J0"], acceleration=1e9).seconds, 1.5 * math.pi, places=4)
+        # Carrying straight on out of an arc along its tangent doesn't slow us down
+        program = motion_program(["G2 F600 X10 Y10 I10 J0", "G1 X20"])
+        self.assertTrue(np.allclose(program.exits[0], program.directions[1]))
+        # But tight ones can't be taken at full speed
+        tight = simulate(["G2 F6000 X0.2 Y0 I0.1 J0"], acceleration=1000.0)
+        self.assertGreater(tight.seconds, 0.1 * math.pi / np.sqrt(1000.0 * 0.1))
+
+    def test_dwells(self):
+        estimate = simulate(["G4 P250", "G1 F1000 X100", "G4 S1.5", "G4 P250 ; G4 S9"])
+        self.assertAlmostEqual(estimate.dwell_seconds, 2.0)
+        self.assertAlmostEqual(estimate.seconds, estimate.move_seconds + 2.0)
+        self.assertEqual(estimate.moves, 1)
+        self.assertEqual(len(estimate.elapsed), 4)
+        self.assertAlmostEqual(estimate.elapsed[0], 0.25)
+        self.assertAlmostEqual(estimate.elapsed[-1], estimate.seconds)
+
+    def test_relative_and_set_position(self):
+        program = motion_program(["G1 X10 Y10", "G91", "G1 X10", "G1 Y-5", "G90", "G92 X0 Y0",
+                                  "G1 X3 Y4", "G28", "G1 X0 Y1"])
+        self.assertEqual(program.lines, 9)
+        self.assertEqual(program.move_lines.tolist(), [0, 2, 3, 6, 8])
+        self.assertTrue(np.allclose(program.lengths, [np.hypot(10, 10), 10, 5, 5, 1]))
+        self.assertEqual(program.stops.tolist(), [True, False, False, True, True])
+
+    def test_machine_posts(self):
+        # Each machine in the catalog can have arcs on without the others
+        posts = [machine.post for machine in Machine.machine_catalog.values()]
+        self.assertEqual(len(set(map(id, posts))), len(posts))
+        self.assertNotIn(Machine.post, posts)
+
+    def test_machine_estimate(self):
+        lines = Plottable([Plottable.Line([(0, 0), (10, 10), (20, 0)]),
+                           Plottable.Line([(50, 50), (60, 60)])])
+        machine = Machine(post=GCodePost())
+        commands = list(machine.post.lines2gcodes_gen(lines))
+        estimate = machine.estimate(commands)
+        self.assertEqual(len(estimate.elapsed), len(commands))
+        # Two drawn, the second pen up move and the trip home, the first one goes nowhere
+        self.assertEqual(estimate.moves, 5)
+        post = machine.post
+        dwells = dwell_seconds(post.preamble + 3 * post.penup + 2 * post.pendown + post.epilog)
+        self.assertAlmostEqual(estimate.dwell_seconds, dwells)
+        # Accelerating never makes us quicker than the naive estimate
+        self.assertGreater(estimate.seconds, machine.post.metrics(lines).seconds)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,17 @@
+import json
 import time
 import unittest
 import uuid
-from botaplot.models.plot_sender import PlotWorker
+
+import numpy as np
+
+from botaplot.models.plot_sender import PlotWorker, PlotProgress
 from botaplot.models.machine import BotAPlot
 from botaplot.protocols import SimpleAsciiProtocol
 from botaplot.transports import BaseTransport
+from botaplot.models.plottable import Plottable
+from botaplot.post.gcode_base import GCodePost
+from botaplot.post.stream import PostStream
 
 class MockTransport(BaseTransport):
 
@@ -13,10 +20,10 @@ class MockTransport(BaseTransport):
         self.cmd_count = 0
         self.delay = 0
 
-    def write(self, *args, **kw):
-        self.cmd_count += 1
+    def _write(self, bytestring):
+        self.cmd_count += len(bytestring.splitlines())
 
-    def readline(self, *args, **kw):
+    def _readline(self):
         if self.cmd_count > 0:
             return("OK".encode('ascii'))
         else:
@@ -26,7 +33,7 @@ class MockTransport(BaseTransport):
 class TestPlotSender(unittest.TestCase):
 
     def setUp(self):
-        machine = BotAPlot(MockTransport())
+        machine = BotAPlot(transport=MockTransport())
         self.sender = PlotWorker.new(machine)
 
     def test_dies(self):
@@ -57,6 +64,10 @@ class TestPlotSender(unittest.TestCase):
             else:
                 result = "NO RESULT"
             time.sleep(0.01)
+        # Flow control metrics come along with it
+        flow = PlotWorker.parse_result(result)['content']
+        self.assertIn('"lookahead"', flow)
+        self.assertIn('"rtt_p90"', flow)
 
     def test_load(self):
         id = str(uuid.uuid1())
@@ -87,5 +98,175 @@ class TestPlotSender(unittest.TestCase):
         self.sender.send(cmd)
         result = PlotWorker.parse_result(self.sender.recv(blocking=True))
 
+    def test_stream_and_start(self):
+        plottable = Plottable([Plottable.Line([(0, 0), (10, 10), (20, 0)]),
+                               Plottable.Line([(50, 50), (60, 60)])])
+        stream = PostStream(GCodePost(), plottable)
+        id = str(uuid.uuid1())
+        self.sender.send_stream(id, stream)
+        result = PlotWorker.parse_result(self.sender.recv(blocking=True))
+        self.assertDictEqual(
+            {'status': 'OK',
+             'id': id,
+             'content': '{"size": %d}' % len(stream)},
+            result)
+
+        id = str(uuid.uuid1())
+        self.sender.send(f"START[{id}]")
+        result = PlotWorker.parse_result(self.sender.recv(blocking=True))
+        self.assertEqual(result['status'], 'OK')
+        self.assertEqual(self.sender.machine.transport.cmd_count, len(stream))
+
+    def test_stream_needs_staging(self):
+        id = str(uuid.uuid1())
+        self.sender.send(f"STREAM[{id}]")
+        result = PlotWorker.parse_result(self.sender.recv(blocking=True))
+        self.assertEqual(result['status'], 'ERR')
+
+
+    def _wait_for(self, predicate, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            self.assertLess(time.monotonic(), deadline, "Timed out")
+            time.sleep(0.001)
+
+    def _timed(self, cmd):
+        """Send cmd, and return its result and how long that took"""
+        start = time.monotonic()
+        self.sender.send(cmd)
+        result = PlotWorker.parse_result(self.sender.recv(blocking=True))
+        return result, time.monotonic() - start
+
+    def test_idle_command_latency(self):
+        for cmd in ('CMD[a]:["M280 S5"]', "MOVE[b]:10,-5", "MOVE[c]:!10,20", "PENUP[d]"):
+            result, seconds = self._timed(cmd)
+            self.assertEqual(result['id'], cmd[cmd.index("[") + 1])
+            self.assertEqual(result['status'], 'OK')
+            self.assertLess(seconds, 0.005)
+        result, _ = self._timed("MOVE[e]:1,2,3")
+        self.assertEqual(result['status'], 'ERR')
+        # Nothing to pause
+        result, _ = self._timed("PAUSE[f]")
+        self.assertEqual(result['status'], 'ERR')
+
+    def test_paused_command_latency(self):
+        transport = self.sender.machine.transport
+        protocol = self.sender.machine.protocol
+        self.sender.send(f"LOAD[load]:" + "G01 X1 Y1\n" * 100000)
+        self.sender.recv(blocking=True)
+        self.sender.send("START[plot]")
+        self._wait_for(lambda: transport.cmd_count > 10)
+
+        # Moving has to wait for a pause
+        result, seconds = self._timed("MOVE[move]:10,0")
+        self.assertEqual(result['status'], 'ERR')
+        self.assertLess(seconds, 0.005)
+
+        start = time.monotonic()
+        self.sender.send("PAUSE[pause]")
+        self.assertTrue(protocol.paused)
+        self.assertLess(time.monotonic() - start, 0.005)
+        result = PlotWorker.parse_result(self.sender.recv(blocking=True))
+        self.assertEqual((result['id'], result['status']), ("pause", "OK"))
+        count = transport.cmd_count
+        time.sleep(0.01)
+        self.assertEqual(transport.cmd_count, count)
+
+        # Direct commands still go out while we're paused
+        for cmd in ('CMD[a]:["M280 S5"]', "MOVE[b]:10,-5", "PENUP[c]"):
+            result, seconds = self._timed(cmd)
+            self.assertEqual(result['id'], cmd[cmd.index("[") + 1])
+            self.assertEqual(result['status'], 'OK')
+            self.assertLess(seconds, 0.005)
+        # But not loading something else
+        result, _ = self._timed("LOAD[load]:G28")
+        self.assertEqual(result['status'], 'ERR')
+
+        # Resume, then cancel
+        count = transport.cmd_count
+        result, seconds = self._timed("START[resume]")
+        self.assertEqual((result['id'], result['status']), ("resume", "OK"))
+        self._wait_for(lambda: transport.cmd_count > count + 10)
+        self.assertEqual(self._timed("PAUSE[pause]")[0]['status'], "OK")
+        result, _ = self._timed("CANCEL[cancel]")
+        self.assertEqual((result['id'], result['status']), ("cancel", "OK"))
+        result = PlotWorker.parse_result(self.sender.recv(blocking=True))
+        self.assertEqual(result['id'], "plot")
+        self.assertEqual(self.sender.progress_q.get(False)[2], "JOB CANCELLED")
+        self.assertLess(transport.cmd_count, 100000)
+
+    def test_status_while_plotting(self):
+        transport = self.sender.machine.transport
+        self.sender.send(f"LOAD[load]:" + "G01 X1 Y1\n" * 100000)
+        self.sender.recv(blocking=True)
+        self.sender.send("START[plot]")
+        self._wait_for(lambda: transport.cmd_count > 1000)
+        result, seconds = self._timed("STATUS[status]")
+        self.assertEqual((result['id'], result['status']), ("status", "OK"))
+        status = json.loads(result['content'])
+        self.assertEqual(status['state'], "BUSY")
+        self.assertGreater(status['flow']['acks'], 0)
+        self.assertLess(seconds, 0.005)
+        # The same metrics come with every progress snapshot
+        self.assertGreater(self.sender.progress.snapshot().flow.acks, 0)
+        self.sender.machine.protocol.die = True
+        self.assertEqual(PlotWorker.parse_result(self.sender.recv(blocking=True))['id'], "plot")
+
+    def test_progress_is_coalesced(self):
+        self.sender.send(f"LOAD[load]:" + "G01 X1 Y1\n" * 20000)
+        self.sender.recv(blocking=True)
+        self.sender.send("START[plot]")
+        result = PlotWorker.parse_result(self.sender.recv(blocking=True))
+        self.assertEqual(result['status'], 'OK')
+        # Nothing queued up per command, just the latest state
+        self.assertEqual(self.sender.progress_q.qsize(), 0)
+        snapshot = self.sender.progress.snapshot()
+        self.assertEqual(snapshot.total, 20001)
+        self.assertEqual(snapshot.done, 20000)
+        self.assertEqual(snapshot.last, "")
+
+
+class TestPlotProgress(unittest.TestCase):
+
+    def test_snapshot(self):
+        progress = PlotProgress()
+        progress.rate_window = 0.01
+        progress.reset(1000)
+        snapshot = progress.snapshot()
+        self.assertEqual(snapshot.done, 0)
+        self.assertIsNone(snapshot.eta)
+        for i in range(100):
+            progress.update(i, 1000, "G01 X%d" % i)
+        time.sleep(0.02)
+        snapshot = progress.snapshot()
+        self.assertEqual(snapshot.done, 99)
+        self.assertEqual(snapshot.last, "G01 X99")
+        self.assertEqual(snapshot.seq, 100)
+        self.assertGreater(snapshot.rate, 0.0)
+        self.assertAlmostEqual(snapshot.eta, 901 / snapshot.rate)
+
+    def test_estimated_eta(self):
+        progress = PlotProgress()
+        estimate = np.arange(1, 1001, dtype=np.float64) * 0.5  # Half a second a command
+        progress.reset(1000, estimate)
+        self.assertAlmostEqual(progress.snapshot().eta, 500.0)
+        progress.update(100, 1000, "G01 X1")
+        self.assertAlmostEqual(progress.snapshot().eta, 450.0)
+        # 100 commands took 100s when we expected 50, so we're running twice as slow
+        progress.calibrate_after = 0.0
+        progress._started -= 100.0
+        self.assertAlmostEqual(progress.snapshot().eta, 900.0, places=0)
+
+    def test_late_estimate(self):
+        # The stream's estimate turns up after the plot's started
+        stream = PostStream(GCodePost(), Plottable([Plottable.Line([[0, 0], [1, 1]])]))
+        progress = PlotProgress()
+        progress.reset(1000, program=stream)
+        self.assertIsNone(progress.snapshot().eta)
+        stream.estimate = np.arange(1, 1001, dtype=np.float64) * 0.5
+        progress.update(100, 1000, "G01 X1")
+        self.assertAlmostEqual(progress.snapshot().eta, 450.0)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,18 +2,178 @@
 
 import unittest
 import math
+import random
+import numpy as np
 from botaplot.models.plottable import Plottable, XYHash
 from weakref import WeakSet
 from scipy.sparse import dok_matrix
 
 class TestXYHash(unittest.TestCase):
 
+    def setUp(self):
+        rand = random.Random(1234)
+        self.lines = [
+            Plottable.Line([(rand.uniform(0, 200), rand.uniform(0, 200)),
+                            (rand.uniform(0, 200), rand.uniform(0, 200))])
+            for i in range(500)]
+
+    def _brute_closest(self, lines, x, y):
+        best = None
+        for line in lines:
+            for reverse, point in (False, line[0]), (True, line[-1]):
+                d = math.hypot(point[0] - x, point[1] - y)
+                if best is None or d < best[2]:
+                    best = (line, reverse, d)
+        return best
+
     def test_base_xyhash(self):
         tline = Plottable.Line([
             (20, 20), (20, 40),
             (35, 50), (50, 40),
-            (50, 20), (20, 20)]
-        ),
+            (50, 20), (20, 21)]
+        )
+        xyhash = XYHash([tline])
+        self.assertEqual(len(xyhash), 1)
+        self.assertIn(tline, xyhash)
+        line, reverse, d = xyhash.closest(21, 22, remove=False)
+        self.assertIs(line, tline)
+        self.assertTrue(reverse)
+        self.assertAlmostEqual(d, math.hypot(1, 1))
+        self.assertEqual(xyhash.closest(21, 22, max_distance=1.0), None)
+        self.assertIs(xyhash.closest(21, 19)[0], tline)
+        self.assertEqual(len(xyhash), 0)
+        self.assertEqual(xyhash.closest(21, 22), None)
+
+    def test_closest_matches_brute_force(self):
+        xyhash = XYHash(self.lines)
+        remaining = list(self.lines)
+        rand = random.Random(4321)
+        while remaining:
+            x, y = rand.uniform(-50, 250), rand.uniform(-50, 250)
+            expected = self._brute_closest(remaining, x, y)
+            found = xyhash.closest(x, y)
+            self.assertIs(found[0], expected[0])
+            self.assertEqual(found[1], expected[1])
+            self.assertAlmostEqual(found[2], expected[2])
+            remaining.remove(found[0])
+        self.assertEqual(len(xyhash), 0)
+
+    def test_remove(self):
+        xyhash = XYHash(self.lines)
+        self.assertTrue(xyhash.remove(self.lines[0]))
+        self.assertFalse(xyhash.remove(self.lines[0]))
+        self.assertNotIn(self.lines[0], xyhash)
+        self.assertEqual(len(xyhash), len(self.lines) - 1)
+
+
+class TestOptimize(unittest.TestCase):
+
+    def _travel(self, chunks):
+        return sum(math.hypot(b[0][0] - a[-1][0], b[0][1] - a[-1][1])
+                   for a, b in zip(chunks[:-1], chunks[1:]))
+
+    def test_optimize_reverses(self):
+        tp = Plottable(
+            [
+                Plottable.Line([(20, 20), (120, 20), (20, 30)]),
+                Plottable.Line([(20, 40), (120, 42)]),
+                Plottable.Line([(20, 30.5), (120, 32)]),
+            ])
+        tp.optimize_lines()
+        self.assertEqual(tuple(tp[1][0]), (20, 30.5))
+        self.assertEqual(tuple(tp[2][0]), (120, 42))
+
+    def test_optimize_is_nearest_neighbour(self):
+        rand = random.Random(99)
+        lines = [[(rand.uniform(0, 100), rand.uniform(0, 100)),
+                  (rand.uniform(0, 100), rand.uniform(0, 100))]
+                 for i in range(300)]
+        tp = Plottable([Plottable.Line(list(line)) for line in lines])
+        tp.optimize_lines()
+        self.assertEqual(len(tp), len(lines))
+        self.assertEqual(
+            sorted(tuple(sorted(map(tuple, chunk))) for chunk in tp),
+            sorted(tuple(sorted(line)) for line in lines))
+        # Every hop should be to the closest remaining endpoint
+        for i in range(1, len(tp) - 1):
+            end = tp[i][-1]
+            hop = math.hypot(tp[i + 1][0][0] - end[0], tp[i + 1][0][1] - end[1])
+            for chunk in tp.chunks[i + 1:]:
+                for point in chunk[0], chunk[-1]:
+                    self.assertLessEqual(
+                        hop, math.hypot(point[0] - end[0], point[1] - end[1]) + 1e-9)
+
+    def test_hash_beats_window(self):
+        rand = random.Random(7)
+        lines = [[(rand.uniform(0, 100), rand.uniform(0, 100)),
+                  (rand.uniform(0, 100), rand.uniform(0, 100))]
+                 for i in range(1000)]
+        hashed = Plottable([Plottable.Line(list(line)) for line in lines])
+        windowed = Plottable([Plottable.Line(list(line)) for line in lines])
+        hashed.optimize_lines()
+        windowed.optimize_lines(method="window", limit=10)
+        self.assertLess(self._travel(hashed), self._travel(windowed))
+
+
+class TestMerge(unittest.TestCase):
+
+    def test_merge_shuffled_pieces(self):
+        """A curve drawn as shuffled, half reversed pieces comes back whole"""
+        t = np.linspace(0, 10, 101)
+        curve = np.column_stack((t * 10, np.sin(t) * 20))
+        rand = random.Random(5)
+        pieces = [curve[i:i + 11] for i in range(0, 100, 10)]
+        pieces = [piece[::-1] if rand.random() < 0.5 else piece for piece in pieces]
+        rand.shuffle(pieces)
+        stray = Plottable.Line([(500, 500), (600, 600)])
+        # Neither of these lifts the pen
+        dot, empty = Plottable.Line([(700, 700)]), Plottable.Line(np.empty((0, 2)))
+        tp = Plottable([Plottable.Line(piece) for piece in pieces] + [stray, dot, empty])
+        stats = tp.merge_endpoints(0.01)
+        # Two of the shuffled pieces already meet end to start
+        self.assertEqual(stats.lifts_before, 10)
+        self.assertEqual(stats.lifts_after, 2)
+        merged = [chunk for chunk in tp if chunk is not stray][0].points
+        if merged[0][0] != curve[0][0]:
+            merged = merged[::-1]
+        np.testing.assert_array_equal(merged, curve)
+
+    def test_merge_tolerance_and_pens(self):
+        tp = Plottable([
+            Plottable.Line([(0, 0), (10, 0)]),
+            Plottable.Line([(10.05, 0), (20, 0)]),
+            Plottable.Line([(20, 0.5), (30, 0)]),
+            Plottable.Line([(30, 0), (40, 0)], pen=2),
+        ])
+        stats = tp.merge_endpoints(0.1)
+        # GCodePost drags straight on to the pen 2 line where it starts
+        self.assertEqual(stats.lifts_after, 2)
+        self.assertEqual(len(tp), 3)
+        self.assertEqual(tp[0].points.tolist(), [[0, 0], [10, 0], [10.05, 0], [20, 0]])
+        self.assertEqual([chunk.pen for chunk in tp], [1, 1, 2])
+
+        # A closer end with another pen doesn't hide one with ours
+        tp = Plottable([
+            Plottable.Line([(0, 0), (10, 0)]),
+            Plottable.Line([(10.01, 0), (10.01, 10)], pen=2),
+            Plottable.Line([(10.05, 0), (20, 0)]),
+        ])
+        self.assertEqual(tp.merge_endpoints(0.1).lifts_after, 2)
+        self.assertEqual(tp[0].points.tolist(), [[0, 0], [10, 0], [10.05, 0], [20, 0]])
+
+    def test_merge_weights_and_pen_drag(self):
+        def _lines():
+            return Plottable([
+                Plottable.Line([(0, 0), (10, 0)]),
+                Plottable.Line([(10, 0), (20, 0)], weight=2.0),
+                Plottable.Line([(20.05, 0), (30, 0)], weight=2.0),
+            ])
+        tp = _lines()
+        stats = tp.merge_endpoints(0.1)
+        self.assertEqual(stats[:2], (2, 1))
+        self.assertEqual([chunk.weight for chunk in tp], [1.0, 2.0])
+        # Dragging over the gap already saved the lift we merged away
+        self.assertEqual(_lines().merge_endpoints(0.1, pen_drag=0.75)[:2], (1, 1))
 
 
 class TestPlottable(unittest.TestCase):
@@ -47,6 +207,57 @@ class TestPlottable(unittest.TestCase):
         tmp = self.plottable.pop()
         self.assertEqual(len(self.plottable), 1)
 
+    def test_line_storage(self):
+        line = self.plottable[0]
+        self.assertIsInstance(line.points, np.ndarray)
+        self.assertEqual(line.points.shape, (6, 2))
+        self.assertEqual(line.points.dtype, np.float64)
+        self.assertListEqual(list(line)[1], [20.0, 40.0])
+        self.assertEqual(tuple(line[-1]), (20.0, 20.0))
+        line.reverse()
+        self.assertEqual(tuple(line[1]), (50.0, 20.0))
+
+    def test_buffer_roundtrip(self):
+        points, offsets = self.plottable.buffer()
+        self.assertEqual(points.shape, (22, 2))
+        self.assertListEqual(offsets.tolist(), [0, 6, 22])
+        copy = Plottable.from_buffer(points, offsets)
+        self.assertEqual(len(copy), 2)
+        for a, b in zip(copy, self.plottable):
+            np.testing.assert_array_equal(a.points, b.points)
+        self.assertIs(copy[0].points.base, copy[1].points.base)
+
+    def test_pack(self):
+        self.plottable.pack()
+        self.assertIsNotNone(self.plottable[0].points.base)
+        self.assertIs(self.plottable[0].points.base, self.plottable[1].points.base)
+
+    def test_bounds(self):
+        xmin, ymin, xmax, ymax = self.plottable.bounds
+        self.assertAlmostEqual(xmin, 35 - math.sqrt(450.0))
+        self.assertAlmostEqual(ymax, 35 + math.sqrt(450.0))
+        self.assertEqual(self.plottable[0].bounds, (20.0, 20.0, 50.0, 50.0))
+
+    def test_transform(self):
+        expected = [[(5 + 2 * x, 7 - 3 * y) for (x, y) in chunk] for chunk in self.plottable]
+        transformed = self.plottable.transform(5, 7, 2, -3)
+        for chunk, points in zip(transformed, expected):
+            np.testing.assert_allclose(chunk, points)
+        self.plottable.transform_self(5, 7, 2, -3)
+        for chunk, points in zip(self.plottable, expected):
+            self.assertIsInstance(chunk, Plottable.Line)
+            np.testing.assert_allclose(chunk.points, points)
+
+    def test_clamp(self):
+        self.plottable.clamp(230.0, 10.0, True)
+        xmin, ymin, xmax, ymax = self.plottable.bounds
+        self.assertAlmostEqual(xmin, 10.0)
+        self.assertAlmostEqual(ymin, 10.0)
+        self.assertAlmostEqual(xmax, 220.0)
+        self.assertAlmostEqual(ymax, 220.0)
+        # Inverted, so the bottom of the square is now at the top
+        self.assertGreater(self.plottable[0][0][1], self.plottable[0][1][1])
+
     def _disabled_test_optimize(self):
         """Optimization is currently disabled"""
         tp = Plottable(
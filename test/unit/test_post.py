@@ -2,13 +2,25 @@
 
 import unittest
 import math
-from io import StringIO
+import threading
+import time
+from io import StringIO, BytesIO
+
+import numpy as np
+
+from botaplot.models.machine import Machine
 from botaplot.models.plottable import Plottable
+from botaplot.post.fixed import FixedTemplate, fill
 from botaplot.post.gcode_base import GCodePost
+from botaplot.post.stream import PostStream
+from botaplot.util.feeds import plan_feeds
+from botaplot.util.metrics import dwell_seconds
+from botaplot.util.motion import simulate
 
 class TestPosts(unittest.TestCase):
 
     def setUp(self):
+        self.threads = threading.active_count()
         radius = math.sqrt(15.0*15.0+15.0*15.0)
         self.chunks = Plottable([
             Plottable.Line([
@@ -51,5 +63,208 @@ class TestPosts(unittest.TestCase):
             'G01 F1200.00 X50.00 Y20.00', 'G01 F1200.00 X54.60 Y26.88'
         ])
 
+    def by_line(self, post, lines):
+        return "".join("%s\n" % stanza for stanza in post.lines2gcodes_gen(lines))
 
+    def test_bulk_matches_by_line(self):
+        post = GCodePost()
+        rng = np.random.default_rng(2)
+        lines = [rng.uniform(-10, 240, (rng.integers(1, 6), 2)) for _ in range(500)]
+        for i in range(0, 500, 9):
+            lines[i + 1] = lines[i][-1:] + rng.uniform(0, 0.5, (3, 2))  # Short drags
+        lines[7][1] = (-0.001, 0.005)  # -0.00 and a tie
+        lines[8][0] = (np.nan, 2.0)
+        for chunks in ([], [[(1, 2)]], self.chunks, lines):
+            for block_size in (None, 200):
+                bulk = b"".join(post.gcode_blocks(chunks, block_size)).decode("ascii")
+                self.assertEqual(bulk, self.by_line(post, chunks))
+        # Formats post.fixed can't do get the % treatment
+        post.draw_format = "G01 F%d X%.3f Y%.3f"
+        post.penup = post.penup + ["M117 100% up"]
+        ofp = StringIO()
+        post.write_lines_to_fp(lines, ofp)
+        self.assertEqual(ofp.getvalue(), self.by_line(post, lines))
+        binary = BytesIO()
+        post.write_lines_to_fp(lines, binary)
+        self.assertEqual(binary.getvalue().decode("ascii"), ofp.getvalue())
+
+    def test_fixed_fill(self):
+        values = np.array([[0.0, -0.0], [0.125, -0.004], [1234.5678, 9.995], [-7, 1e-9]])
+        templates = [FixedTemplate("G0 X%4.2f Y%4.2f\n"), FixedTemplate("G1 F%5.1f X%7.3f Y%.0f 100%%\n").bind(0, 5)]
+        kinds = [0, 1, 1, 0]
+        expected = "".join(("G0 X%4.2f Y%4.2f\n", "G1 F%5.1f X%7.3f Y%.0f 100%%\n")[kind] % ((5,) * kind + tuple(row))
+                           for kind, row in zip(kinds, values.tolist()))
+        self.assertEqual(fill(templates, kinds, values).decode("ascii"), expected)
+        self.assertIsNone(fill(templates, kinds, values + np.inf))
+        with self.assertRaises(ValueError):
+            FixedTemplate("G0 X%d")
+
+    def test_compact(self):
+        post = GCodePost()
+        post.compact = True
+        post.precision = 1
+        chunks = [[(20, 20), (20, 40), (20.01, 40.02), (35, 40)], [(35.2, 40), (50, 50)], [(5, 5)],
+                  [(100, 100), (90.04, 100)]]
+        commands = list(post.lines2gcodes_gen(chunks))
+        self.assertEqual(len(commands), post.count_commands(chunks))
+        moves = [command for command in commands if command[0] in "GXY" and command[:3] not in ("G4 ", "G28", "G90", "G92")]
+        self.assertListEqual(moves, [
+            "G0X20Y20", "G1F1200Y40", "X35",  # The 0.01mm move rounds to nothing
+            "X35.2", "X50Y50",  # Short drag, no comment and still G1
+            "G0X100Y100", "G1X90", "G0X15Y230"])
+        self.assertEqual(b"".join(post.gcode_blocks(chunks, 10)).decode("ascii"), "\n".join(commands) + "\n")
+
+        post.relative = True
+        relative = list(post.lines2gcodes_gen(chunks))
+        self.assertEqual(len(relative), post.count_commands(chunks))
+        moves = [command for command in relative if command[0] in "GXY" and command[:3] not in ("G4 ", "G28", "G92")]
+        self.assertListEqual(moves, ["G90", "G0X20Y20", "G91", "G1F1200Y20", "X15", "X0.2", "X14.8Y10",
+                                     "G0X50Y50", "G1X-10", "G90", "G0X15Y230"])
+        # Same job as far as the machine is concerned
+        verbose = GCodePost()
+        self.assertAlmostEqual(simulate(relative).seconds, simulate(list(verbose.lines2gcodes_gen(chunks))).seconds,
+                               places=2)
+        stats = post.compaction(chunks)
+        self.assertEqual(stats.bytes_before, len(self.by_line(verbose, chunks)))
+        self.assertEqual(stats.bytes_after, len("\n".join(relative)) + 1)
+        self.assertEqual(stats.commands_after, stats.commands_before + 1)  # G91 and G90, one move fewer
+        self.assertGreater(stats.saved, 0)
+        self.assertEqual(len(PostStream(post, chunks)), len(list(PostStream(post, chunks))))
+
+    def test_arcs(self):
+        post = GCodePost()
+        post.arc_tolerance = 0.02
+        angles = np.linspace(0.0, math.pi, 50)
+        chunks = [np.column_stack((50 + 20 * np.cos(angles), 50 + 20 * np.sin(angles))),
+                  [(0, 0), (1, 0), (2, 0)],
+                  np.column_stack((10 + 5 * np.cos(-angles), 10 + 5 * np.sin(-angles)))]
+        commands = list(post.lines2gcodes_gen(chunks))
+        self.assertEqual(len(commands), post.count_commands(chunks))
+        moves = [command for command in commands if command.startswith(("G0 ", "G01", "G02", "G03"))]
+        self.assertListEqual(moves, [
+            "G0 X70.00 Y50.00", "G03 F1200.00 X30.00 Y50.00 I-20.000 J0.000",
+            "G0 X0.00 Y0.00", "G01 F1200.00 X1.00 Y0.00", "G01 F1200.00 X2.00 Y0.00",
+            "G0 X15.00 Y10.00", "G02 F1200.00 X5.00 Y10.00 I-5.000 J0.000"])
+        self.assertEqual(b"".join(post.gcode_blocks(chunks)).decode("ascii"), "\n".join(commands) + "\n")
+        # The machine goes the same way round, in far fewer commands
+        straight = list(GCodePost().lines2gcodes_gen(chunks))
+        self.assertAlmostEqual(simulate(commands).seconds, simulate(straight).seconds, places=1)
+        self.assertEqual(len(straight) - len(commands), 2 * 48)  # 49 G01s to one arc, twice
+
+        post.compact = True
+        compact = [command for command in post.lines2gcodes_gen(chunks) if command.startswith(("G0X", "G1", "G2X", "G3", "X"))]
+        self.assertListEqual(compact, ["G0X70Y50", "G3F1200X30I-20", "G0X0Y0", "G1X1", "X2", "G0X15Y10",
+                                       "G2X5I-5", "G0X15Y230"])
+        post.relative = True
+        relative = list(post.lines2gcodes_gen(chunks))
+        self.assertIn("G3F1200X-40I-20", relative)
+        self.assertAlmostEqual(simulate(relative).seconds, simulate(straight).seconds, places=1)
+
+    def test_feed_planning(self):
+        post = GCodePost()
+        post.max_feedrate = 6000.0
+        # Long sides, a sharp turn round a short one, and a line carrying straight on
+        chunks = [[(0, 0), (100, 0), (100, 1), (0, 1)], [(0, 50), (50, 50), (100, 50)]]
+        feeds = plan_feeds([(0, 0), (100, 0), (100, 1), (0, 1)], [0, 4], 1200.0, 6000.0, 1000.0, 0.05)
+        self.assertEqual(feeds[0], 1200.0)
+        self.assertListEqual(feeds[[1, 3]].tolist(), [6000.0, 6000.0])
+        self.assertTrue(1200.0 < feeds[2] < 6000.0)
+        # Chunks are planned on their own, stopping at both ends
+        self.assertListEqual(plan_feeds([(0, 0), (0.01, 0), (1, 1), (1.01, 1)], [0, 2, 4],
+                                        1200.0, 6000.0, 1000.0, 0.05).tolist(), [1200.0] * 4)
+
+        commands = list(post.lines2gcodes_gen(chunks))
+        self.assertEqual(len(commands), post.count_commands(chunks))
+        self.assertEqual(b"".join(post.gcode_blocks(chunks)).decode("ascii"), "\n".join(commands) + "\n")
+        draws = [command for command in commands if command.startswith("G01")]
+        self.assertListEqual(draws, ["G01 F6000.00 X100.00 Y0.00", "G01 F1980.00 X100.00 Y1.00",
+                                     "G01 F6000.00 X0.00 Y1.00", "G01 X50.00 Y50.00", "G01 X100.00 Y50.00"])
+        stats = post.feed_savings(chunks)
+        self.assertEqual(stats.feeds, 3)
+        self.assertGreater(stats.saved, 0.0)
+        self.assertAlmostEqual(stats.seconds_after, simulate(commands).seconds)
+
+        post.compact = True
+        compact = [command for command in post.lines2gcodes_gen(chunks) if command[:2] in ("G1", "F1", "F6", "X1", "X5")]
+        self.assertListEqual(compact, ["G1F6000X100", "F1980Y1", "F6000X0", "G1X50", "X100"])
+        # Planning off is one feed all the way
+        post.max_feedrate = None
+        self.assertEqual(post.feed_savings(chunks).saved, 0.0)
+
+    def test_feed_planning_machine(self):
+        # Feeds get planned, and savings simulated, with the limits of the machine we post for
+        chunks = [[(0, 0), (100, 0), (100, 1), (0, 1)]]
+        default, gentle = Machine(post=GCodePost()), Machine(post=GCodePost(), acceleration=100.0)
+        for machine in (default, gentle):
+            self.assertIs(machine.post.machine, machine)
+            machine.post.max_feedrate = 6000.0
+        corner = [next(float(command.split()[1][1:]) for command in machine.post.lines2gcodes_gen(chunks)
+                       if command.endswith("X100.00 Y1.00")) for machine in (default, gentle)]
+        self.assertLess(corner[1], corner[0])
+        stats = gentle.post.feed_savings(chunks)
+        self.assertAlmostEqual(stats.seconds_after, gentle.estimate(gentle.post.lines2gcodes_gen(chunks)).seconds)
+        # Planning's opt in, like arcs
+        self.assertTrue(all(machine.post.max_feedrate is None for machine in Machine.machine_catalog.values()))
+
+    def test_count_commands(self):
+        post = GCodePost()
+        self.assertEqual(post.count_commands(self.chunks),
+                         len(list(post.lines2gcodes_gen(self.chunks))))
+        # Short drags skip the pen stanzas, and dots are skipped entirely
+        chunks = Plottable([
+            Plottable.Line([(0, 0), (10, 0)]),
+            Plottable.Line([(10.1, 0), (20, 0)]),
+            Plottable.Line([(50, 50)]),
+            Plottable.Line([(30, 0), (40, 0), (40, 10)]),
+        ])
+        self.assertEqual(post.count_commands(chunks),
+                         len(list(post.lines2gcodes_gen(chunks))))
+        self.assertEqual(post.count_commands([]),
+                         len(list(post.lines2gcodes_gen([]))))
+
+    def test_dwell_seconds(self):
+        self.assertAlmostEqual(dwell_seconds(GCodePost.pendown), 0.27)
+        self.assertAlmostEqual(dwell_seconds(["G4 S2", "g04 p500 ; half", "G40", "; G4 P100"]), 2.5)
+
+    def test_metrics(self):
+        post = GCodePost()
+        chunks = Plottable([
+            Plottable.Line([(0, 0), (10, 0)]),
+            Plottable.Line([(10.1, 0), (20, 0)]),  # Short drag, no lift
+            Plottable.Line([(50, 50)]),  # Dots get skipped
+            Plottable.Line([(30, 0), (40, 0), (40, 10)]),
+            Plottable.Line([]),
+        ])
+        metrics = post.metrics(chunks)
+        self.assertAlmostEqual(metrics.pen_down_mm, 40.0)
+        self.assertAlmostEqual(metrics.pen_up_mm, 10.0)
+        self.assertEqual(metrics.points, 7)
+        # As many lifts as the post writes pen up stanzas, less the one up front
+        gcode = list(post.lines2gcodes_gen(chunks))
+        self.assertEqual(metrics.lifts, gcode.count(post.penup[0]) - 1)
+        self.assertAlmostEqual(metrics.seconds, 40.0 / 20 + 10.0 / 50 + dwell_seconds(gcode))
+        # Lists of points work too
+        self.assertEqual(post.metrics([list(chunk) for chunk in chunks]), metrics)
+        self.assertEqual(post.metrics([]).lifts, 0)
+        self.assertEqual(post.metrics(self.chunks).lifts, 2)
+
+    def test_stream(self):
+        post = GCodePost()
+        stream = PostStream(post, self.chunks, batch_size=4, maxsize=2)
+        expected = list(post.lines2gcodes_gen(self.chunks))
+        self.assertEqual(len(stream), len(expected))
+        self.assertListEqual(list(stream), expected)
+        # And it can be replayed
+        self.assertListEqual(list(stream), expected)
 
+    def test_stream_early_exit(self):
+        stream = PostStream(GCodePost(), self.chunks, batch_size=1, maxsize=1)
+        for i, cmd in enumerate(stream):
+            if i == 3:
+                break
+        # The producer should notice and go away rather than block forever
+        for i in range(100):
+            if threading.active_count() == self.threads:
+                break
+            time.sleep(0.01)
+        self.assertEqual(threading.active_count(), self.threads)
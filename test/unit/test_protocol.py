@@ -0,0 +1,99 @@
+import unittest
+from botaplot.models.machine import BotAPlot
+from botaplot.protocols import SimpleAsciiProtocol
+from botaplot.transports import BaseTransport
+from botaplot.transports.fake import FakeControllerTransport
+
+
+class RecordingTransport(BaseTransport):
+    """Takes whatever gets written, and never answers"""
+
+    def __init__(self):
+        self.writes = list()
+
+    def _write(self, bytestring):
+        self.writes.append(bytestring)
+        return len(bytestring)
+
+
+class TestFlowControl(unittest.TestCase):
+
+    def setUp(self):
+        self.cmds = ["G01 F1200.00 X%4.2f Y%4.2f" % (i * 0.5, i * 0.25) for i in range(200)]
+
+    def _plot(self, protocol, **kw):
+        transport = FakeControllerTransport(**kw)
+        try:
+            protocol.plot(self.cmds, transport)
+        finally:
+            transport.close()
+        return transport
+
+    def test_line_counting(self):
+        protocol = SimpleAsciiProtocol()
+        transport = self._plot(protocol, baudrate=None)
+        self.assertEqual(transport.commands, len(self.cmds))
+        self.assertTrue(protocol.ready)
+
+    def test_char_counting_never_overflows(self):
+        protocol = SimpleAsciiProtocol(flow_control="chars", rx_buffer_size=64)
+        transport = self._plot(protocol, rx_buffer_size=64, planner_size=4,
+                               baudrate=None, move_time=0.0005)
+        self.assertEqual(transport.commands, len(self.cmds))
+        self.assertEqual(transport.overflows, 0)
+        self.assertLessEqual(transport.max_rx_bytes, 64)
+        # And we actually used the buffer, rather than one line at a time
+        self.assertGreater(transport.max_rx_bytes, 2 * len(self.cmds[-1]))
+
+    def test_line_counting_can_overflow(self):
+        transport = self._plot(SimpleAsciiProtocol(), rx_buffer_size=64, planner_size=4,
+                               baudrate=None, move_time=0.0005)
+        self.assertGreater(transport.overflows, 0)
+
+    def test_adaptive_opens_up_for_latency(self):
+        # Nothing queues up in the controller, it's all link latency, so more in flight is quicker
+        protocol = SimpleAsciiProtocol(flow_control="adaptive")
+        self._plot(protocol, rx_buffer_size=4096, planner_size=256, baudrate=None, latency=0.005)
+        metrics = protocol.metrics()
+        self.assertGreater(metrics.lookahead, 8)
+        self.assertLessEqual(metrics.lookahead, protocol.max_lookahead)
+        self.assertEqual(metrics.acks, len(self.cmds))
+        self.assertEqual(metrics.in_flight, 0)
+        self.assertTrue(0.005 <= metrics.rtt_p50 <= metrics.rtt_p90 <= metrics.rtt_p99)
+
+    def test_adaptive_backs_off_when_planner_is_full(self):
+        # Every command queues behind slow moves, more in flight would just sit in the RX buffer
+        protocol = SimpleAsciiProtocol(flow_control="adaptive")
+        transport = self._plot(protocol, rx_buffer_size=4096, planner_size=4, baudrate=None, move_time=0.002)
+        self.assertEqual(transport.commands, len(self.cmds))
+        self.assertLessEqual(protocol.metrics().lookahead, 4)
+        self.assertLess(transport.max_rx_bytes, 8 * len(self.cmds[-1]))
+
+    def test_no_waiting(self):
+        # Without OKs to wait for, commands still go out a window at a time, not all at the end
+        transport = RecordingTransport()
+        written = list()
+        SimpleAsciiProtocol(False).plot(
+            self.cmds, transport, callback=lambda i, total, cmd: written.append(sum(
+                write.count(b"\n") for write in transport.writes)))
+        self.assertEqual(len(transport.writes), len(self.cmds) // transport.lookahead)
+        self.assertEqual(b"".join(transport.writes).decode("ascii").splitlines(), self.cmds)
+        self.assertTrue(all(i - done < transport.lookahead for i, done in enumerate(written)))
+        # Nothing's coming back to time, so nothing's kept for timing it
+        protocol = SimpleAsciiProtocol(False)
+        protocol.plot(self.cmds, RecordingTransport())
+        self.assertEqual(len(protocol._sent), 0)
+
+    def test_invalid_flow_control(self):
+        with self.assertRaises(ValueError):
+            SimpleAsciiProtocol(flow_control="magic")
+
+    def test_machine_selects_flow_control(self):
+        machine = BotAPlot(flow_control="chars", rx_buffer_size=256)
+        self.assertEqual(machine.protocol.flow_control, "chars")
+        self.assertEqual(machine.protocol.rx_buffer_size, 256)
+        self.assertEqual(BotAPlot().protocol.flow_control, "lines")
+
+
+if __name__ == '__main__':
+    unittest.main()
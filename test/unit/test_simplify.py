@@ -0,0 +1,64 @@
+#!/bin/env python
+
+import unittest
+import warnings
+
+import numpy as np
+from rdp import rdp
+
+from botaplot.models.plottable import Plottable
+from botaplot.util.simplify import simplify_buffer
+
+
+class TestSimplify(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(1234)
+        self.lines = list()
+        for i in range(60):
+            n = int(rng.integers(1, 80))
+            if i % 3 == 0:
+                line = np.cumsum(rng.normal(size=(n, 2)), axis=0)
+            elif i % 3 == 1:
+                t = np.linspace(0, 6, n)
+                line = np.column_stack((t * 5, np.sin(t) * 3))
+            else:
+                # Lots of ties, and some closed loops
+                line = np.round(np.cumsum(rng.normal(size=(n, 2)), axis=0))
+                if n > 2:
+                    line[-1] = line[0]
+            self.lines.append(line)
+        self.offsets = np.concatenate(([0], np.cumsum([len(line) for line in self.lines])))
+        self.points = np.concatenate(self.lines)
+
+    def test_matches_rdp(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")  # rdp's 2D np.cross
+            for epsilon in (0.0, 0.2, 1.0):
+                points, offsets, _ = simplify_buffer(self.points, self.offsets, epsilon)
+                for i, line in enumerate(self.lines):
+                    np.testing.assert_array_equal(rdp(line, epsilon=epsilon),
+                                                  points[offsets[i]:offsets[i + 1]])
+
+    def test_visvalingam(self):
+        points, offsets, keep = simplify_buffer(self.points, self.offsets, 0.5, method="visvalingam")
+        self.assertLess(len(points), len(self.points))
+        for i, line in enumerate(self.lines):
+            simple = points[offsets[i]:offsets[i + 1]]
+            self.assertEqual(simple[0].tolist(), line[0].tolist())
+            self.assertEqual(simple[-1].tolist(), line[-1].tolist())
+        # A straight line goes down to its ends
+        points, offsets, _ = simplify_buffer([[0, 0], [1, 0], [2, 0], [3, 0]], [0, 4], 0.1, method="visvalingam")
+        self.assertEqual(points.tolist(), [[0, 0], [3, 0]])
+        with self.assertRaises(ValueError):
+            simplify_buffer(self.points, self.offsets, method="nope")
+
+    def test_plottable_simplify(self):
+        plottable = Plottable([Plottable.Line(line) for line in self.lines])
+        stats = plottable.simplify(0.2)
+        self.assertEqual(stats.points_before, len(self.points))
+        self.assertEqual(stats.points_after, plottable.point_count)
+        self.assertLess(stats.points_after, stats.points_before)
+        self.assertEqual(len(plottable), len(self.lines))
+        for chunk, line in zip(plottable, self.lines):
+            self.assertEqual(chunk.points[0].tolist(), line[0].tolist())
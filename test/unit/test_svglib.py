@@ -7,8 +7,9 @@ import cmath
 from io import StringIO
 from botaplot.models.plottable import Plottable
 from botaplot.resources import resource_path
-from botaplot.util.svg_util import subdivide_path, svg2lines
-from svgelements import (SVG, Path, Move, Shape)
+from botaplot.util.svg_util import subdivide_path, svg2lines, flatten_path
+from svgelements import (SVG, Path, Move, Shape, CubicBezier, Ellipse)
+import numpy as np
 import json
 
 
@@ -39,8 +40,9 @@ class TestSVGLib(unittest.TestCase):
         # subd = subdivide_path(self.svg, 50)
         subd = svg2lines(self.svg)
         print("There are %d" % len(subd), "lines")
-        print("SUBD:", json.dumps(subd, indent=2))
-        self.assertEqual(len(subd), 9)
+        print("SUBD:", json.dumps([line.tolist() for line in subd], indent=2))
+        self.assertEqual(len(subd), 4)
+        self.assertEqual(len(svg2lines(self.svg, join=False)), 9)
 
     def test_minimal_lines(self):
         svg = SVG.parse(resource_path("images", "hearts_cropped_test.svg"))
@@ -52,8 +54,77 @@ class TestSVGLib(unittest.TestCase):
         self.assertAlmostEqual(svg.viewbox.height, 720.0, 3)
         lines = svg2lines(svg)
         print("LEN:", len(lines))
-        print("LINES:", json.dumps(lines))
-        self.assertEqual(len(lines), 44)
+        print("LINES:", json.dumps([line.tolist() for line in lines]))
+        self.assertEqual(len(lines), 6)
+
+    def test_joined_subpaths(self):
+        """Joining subpaths keeps every point, just not the shared ones twice"""
+        svg = SVG.parse(resource_path("images", "hearts_cropped_test.svg"))
+        joined = svg2lines(svg)
+        pieces = svg2lines(svg, join=False)
+        self.assertEqual(len(joined), 6)
+        self.assertEqual(len(pieces), 44)
+        self.assertEqual(sum(len(line) for line in joined),
+                         sum(len(line) for line in pieces) - (len(pieces) - len(joined)))
+        self.assertEqual(joined[0][0].tolist(), pieces[0][0].tolist())
+        self.assertEqual(joined[-1][-1].tolist(), pieces[-1][-1].tolist())
+
+    def test_shapes(self):
+        """Straight edged shapes give their vertices, curved ones get sampled"""
+        svg = SVG.parse(StringIO(
+            '<svg xmlns="http://www.w3.org/2000/svg" width="100" height="100">'
+            '<polyline points="0,0 10,0 10,10" transform="translate(5,5)"/>'
+            '<polygon points="0,0 10,0 10,10"/>'
+            '<rect x="1" y="2" width="10" height="5"/>'
+            '<circle cx="10" cy="20" r="5"/>'
+            '</svg>'), reify=True)
+        polyline, polygon, rect, circle = [e for e in svg.elements() if isinstance(e, Shape)]
+        self.assertEqual(subdivide_path(polyline, 0.5).tolist(), [[5, 5], [15, 5], [15, 15]])
+        self.assertEqual(subdivide_path(polygon, 0.5).tolist(), [[0, 0], [10, 0], [10, 10], [0, 0]])
+        self.assertEqual(subdivide_path(rect, 0.5).tolist(), [[1, 2], [11, 2], [11, 7], [1, 7], [1, 2]])
+        points = subdivide_path(circle, 0.5)
+        self.assertEqual(points.shape, (64, 2))
+        for i in (0, 10, 63):
+            self.assertAlmostEqual(points[i][0], circle.point(i / 63.0).x)
+            self.assertAlmostEqual(points[i][1], circle.point(i / 63.0).y)
+
+    def test_flatten_tolerance(self):
+        """Adaptive flattening stays within tolerance of the curve"""
+        def max_error(points, curve):
+            worst = 0.0
+            for p in curve:
+                a, b = points[:-1], points[1:]
+                ab = b - a
+                t = np.clip(((p - a) * ab).sum(axis=1) / np.maximum((ab * ab).sum(axis=1), 1e-30), 0, 1)
+                worst = max(worst, np.sqrt(((p - (a + t[:, None] * ab)) ** 2).sum(axis=1)).min())
+            return worst
+
+        tolerance = 0.05
+        cubic = CubicBezier((0, 0), (40, 50), (-10, 30), (30, 5))
+        arc = Path("M0,0 A 20 8 30 1 1 25 10")[1]
+        for segment in (cubic, arc):
+            points = flatten_path(segment, tolerance)
+            self.assertLessEqual(max_error(points, segment.npoint(np.linspace(0, 1, 1000))), tolerance)
+            self.assertLess(len(points), len(subdivide_path(segment, 0.3)))
+        ellipse = Ellipse(10, 10, 20, 5)
+        points = flatten_path(ellipse, tolerance)
+        self.assertLessEqual(max_error(points, [list(ellipse.point(t)) for t in np.linspace(0, 1, 500)]),
+                             tolerance)
+
+        svg = SVG.parse(resource_path("images", "hearts_cropped_test.svg"))
+        fixed = svg2lines(svg, 0.3)
+        adaptive = svg2lines(svg, tolerance=tolerance)
+        self.assertEqual(len(adaptive), len(fixed))
+        self.assertLess(sum(len(line) for line in adaptive), sum(len(line) for line in fixed))
+
+    def test_parallel_lines(self):
+        """Flattening across processes gives the same lines in the same order"""
+        svg = SVG.parse(resource_path("images", "hearts_cropped_test.svg"))
+        lines = svg2lines(svg, 0.3)
+        parallel = svg2lines(svg, 0.3, parallel=True, workers=2, batch_size=4)
+        self.assertEqual(len(parallel), len(lines))
+        for a, b in zip(lines, parallel):
+            self.assertEqual(a.tolist(), b.tolist())
 
 
 
@@ -0,0 +1,70 @@
+#!/bin/env python
+
+import unittest
+
+import numpy as np
+
+from botaplot.models.plottable import Plottable
+from botaplot.util.tiles import tiled_order, tile_grid
+from botaplot.util.tour import pen_up_travel
+
+
+class TestTiles(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(5)
+        self.starts = rng.uniform(0, 100, (3000, 2))
+        self.ends = self.starts + rng.uniform(-1, 1, (3000, 2))
+
+    def test_grid(self):
+        self.assertEqual(tile_grid((0, 0, 100, 100), 10, workers=4), (4, 4))
+        columns, rows = tile_grid((0, 0, 400, 100), 10, workers=1)
+        self.assertGreater(columns, rows)
+        columns, rows = tile_grid((0, 0, 100, 100), 10 ** 6, per_tile=10000, workers=1)
+        self.assertGreaterEqual(columns * rows, 100)
+
+    def test_serpentine(self):
+        """One stroke per tile, they get visited a row at a time, back and forth"""
+        starts = np.array([[x * 10 + 5, y * 10 + 5] for y in range(3) for x in range(3)], dtype=float)
+        order, flip, stats = tiled_order(starts, starts + 1, bounds=(0, 0, 30, 30), grid=(3, 3), workers=2)
+        self.assertEqual(order.tolist(), [0, 1, 2, 5, 4, 3, 6, 7, 8])
+        self.assertEqual(stats.tiles, 9)
+
+    def test_stitching(self):
+        """A tile gets drawn backwards when its far end is closer"""
+        starts = np.array([[1, 1], [6, 5], [6, 9]], dtype=float)
+        ends = np.array([[1, 9], [7, 5], [6, 9.5]], dtype=float)
+        order, flip, _ = tiled_order(starts, ends, bounds=(0, 0, 10, 10), grid=(2, 1), workers=2)
+        # The right tile's greedy starts at its left edge, from (6, 5), but
+        # the pen is up at (1, 9) so it's closer to start from (6, 9.5)
+        self.assertEqual(order.tolist(), [0, 2, 1])
+        self.assertEqual(flip.tolist(), [False, True, True])
+
+    def test_stitching_rotates(self):
+        """Or gets entered part way along, when the pen is nearer a chunk in the middle"""
+        starts = np.array([[1, 1], [6, 5.2], [6, 7], [6, 3]], dtype=float)
+        ends = np.array([[3, 1], [6, 6], [6, 8], [6, 4]], dtype=float)
+        order, flip, stats = tiled_order(starts, ends, bounds=(0, 0, 10, 10), grid=(2, 1), workers=2)
+        # The right tile's greedy goes up from (6, 5.2) then back down for
+        # the last one, from (3, 1) it's shorter to do that one first
+        self.assertEqual(order.tolist(), [0, 3, 1, 2])
+        self.assertEqual(flip.tolist(), [False, False, False, True])
+        self.assertAlmostEqual(stats.travel, np.hypot(3, 3) + 2.2 + 1)
+
+    def test_tiled_order(self):
+        none = pen_up_travel(self.starts, self.ends)
+        _, _, one = tiled_order(self.starts, self.ends, grid=(1, 1))
+        order, flip, stats = tiled_order(self.starts, self.ends, grid=(3, 2), workers=2)
+        self.assertEqual(sorted(order.tolist()), list(range(3000)))
+        self.assertAlmostEqual(stats.travel, pen_up_travel(self.starts, self.ends, order, flip))
+        self.assertLess(stats.travel, none / 20)
+        # Not much worse than doing it in one go
+        self.assertLess(stats.travel, 1.5 * one.travel)
+
+    def test_plottable_tiled(self):
+        tp = Plottable([Plottable.Line([s, e]) for s, e in zip(self.starts, self.ends)] + [Plottable.Line([])])
+        tp.optimize_lines(method="tiled", bounds=(0, 0, 100, 100))
+        self.assertEqual(len(tp), 3001)
+        self.assertEqual(len(tp[-1]), 0)
+        self.assertEqual(sorted(tuple(sorted(map(tuple, chunk))) for chunk in tp.chunks[:-1]),
+                         sorted(tuple(sorted((tuple(s), tuple(e)))) for s, e in zip(self.starts, self.ends)))
@@ -0,0 +1,71 @@
+#!/bin/env python
+
+import unittest
+
+import numpy as np
+
+from botaplot.models.plottable import Plottable
+from botaplot.util.tour import improve_tour, pen_up_travel, oriented, _Tour
+from botaplot.util.util import process_pool
+
+
+class TestTour(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        self.starts = rng.uniform(0, 100, (400, 2))
+        self.ends = self.starts + rng.normal(size=(400, 2)) * 3
+
+    def test_moves_keep_count(self):
+        """Every move's delta matches the travel it actually saves"""
+        tour = _Tour(self.starts, self.ends)
+        before = tour.travel()
+        self.assertAlmostEqual(before, pen_up_travel(self.starts, self.ends))
+        tour.improve()
+        self.assertGreater(tour.moves, 0)
+        self.assertEqual(sorted(tour.order), list(range(400)))
+        self.assertAlmostEqual(tour.travel(), pen_up_travel(self.starts, self.ends, tour.order, tour.flip))
+        self.assertLess(tour.travel(), before)
+
+    def test_reversal(self):
+        """Strokes along a line, every other one drawn backwards"""
+        starts = np.array([[0, 0], [3, 0], [4, 0], [6, 0]], dtype=float)
+        ends = np.array([[1, 0], [2, 0], [5, 0], [7, 0]], dtype=float)
+        order, flip, stats = improve_tour(starts, ends, order=[0, 2, 1, 3])
+        self.assertAlmostEqual(stats.travel_before, 9.0)
+        self.assertAlmostEqual(stats.travel_after, 3.0)
+        self.assertEqual(flip.tolist(), [False, True, False, False])
+        s, e = oriented(starts, ends, order, flip)
+        self.assertTrue(np.all(np.diff(s[:, 0]) > 0))
+
+    def test_improve_tour_blocks(self):
+        """The process pool version gets the same sort of result"""
+        order, flip, stats = improve_tour(self.starts, self.ends, time_budget=30.0,
+                                          workers=2, block_size=100)
+        self.assertEqual(sorted(order.tolist()), list(range(400)))
+        self.assertGreaterEqual(stats.rounds, 2)
+        self.assertLess(stats.travel_after, 0.8 * stats.travel_before)
+        self.assertAlmostEqual(stats.travel_after, pen_up_travel(self.starts, self.ends, order, flip))
+
+    def test_improve_tour_shared_pool(self):
+        """Successive calls can share a pool, which is left running for the caller"""
+        with process_pool(2) as executor:
+            order, flip, first = improve_tour(self.starts, self.ends, time_budget=2.0,
+                                              block_size=100, executor=executor)
+            order, flip, second = improve_tour(self.starts, self.ends, order, flip, time_budget=2.0,
+                                               block_size=100, executor=executor)
+            self.assertEqual(executor.submit(abs, -3).result(), 3)
+        self.assertEqual(sorted(order.tolist()), list(range(400)))
+        self.assertLessEqual(second.travel_after, first.travel_after)
+        self.assertAlmostEqual(second.travel_after, pen_up_travel(self.starts, self.ends, order, flip))
+
+    def test_plottable_improve_order(self):
+        tp = Plottable([Plottable.Line([s, e]) for s, e in zip(self.starts, self.ends)])
+        tp.optimize_lines()
+        stats = tp.improve_order(time_budget=30.0)
+        self.assertLessEqual(stats.travel_after, stats.travel_before)
+        self.assertEqual(len(tp), 400)
+        travel = sum(np.hypot(*(b.points[0] - a.points[-1])) for a, b in zip(tp.chunks[:-1], tp.chunks[1:]))
+        self.assertAlmostEqual(travel, stats.travel_after)
+        self.assertEqual(sorted(tuple(sorted(map(tuple, chunk))) for chunk in tp),
+                         sorted(tuple(sorted((tuple(s), tuple(e)))) for s, e in zip(self.starts, self.ends)))
@@ -0,0 +1,153 @@
+import os
+import socket
+import threading
+import unittest
+
+from botaplot.protocols import SimpleAsciiProtocol
+from botaplot.transports import TelnetTransport, SerialTransport
+
+
+class CountingTelnetTransport(TelnetTransport):
+
+    writes = 0
+
+    def _write(self, bytestring):
+        self.writes += 1
+        return super()._write(bytestring)
+
+
+class FakeSmoothie(object):
+    """A controller on a local socket: says ok to every line, error to any
+    with BAD in, and throws in a status report every status_every lines"""
+
+    def __init__(self, status_every=10):
+        self.status_every = status_every
+        self.received = list()
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        connection, _ = self.server.accept()
+        with connection, connection.makefile("rwb") as fp:
+            fp.write(b"Smoothie command shell\r\n")
+            fp.flush()
+            for line in fp:
+                self.received.append(line.strip().decode("ascii"))
+                if len(self.received) % self.status_every == 0:
+                    fp.write(b"<Idle|MPos:0.0000,0.0000,0.0000>\r\n")
+                fp.write(b"error:Unsupported command\r\n" if b"BAD" in line else b">ok\r\n")
+                fp.flush()
+
+    def close(self):
+        self.server.close()
+        self.thread.join(5.0)
+
+
+class TestTransports(unittest.TestCase):
+
+    def setUp(self):
+        self.cmds = ["G01 F1200.00 X%4.2f Y%4.2f" % (i * 0.5, i * 0.25) for i in range(300)]
+
+    def test_telnet(self):
+        server = FakeSmoothie()
+        transport = CountingTelnetTransport("127.0.0.1", server.port)
+        seen = list()
+        transport.on_status = seen.append
+        try:
+            protocol = SimpleAsciiProtocol()
+            protocol.plot(self.cmds, transport)
+            self.assertTrue(protocol.ready)
+            self.assertListEqual(server.received, self.cmds)
+            # Status reports don't get taken for answers, they get kept
+            self.assertEqual(len(seen), 30)
+            self.assertEqual(list(transport.status), seen)
+            self.assertEqual(seen[0], b"<Idle|MPos:0.0000,0.0000,0.0000>")
+            # Whole windows full of commands go out at once
+            self.assertLess(transport.writes, len(self.cmds) / 2)
+
+            # And errors still stop the job
+            with self.assertRaises(IOError):
+                protocol.plot(self.cmds[:50] + ["BAD"] + self.cmds[:50], transport)
+        finally:
+            transport._file.close()
+            transport.sock.close()
+            server.close()
+
+    def test_telnet_by_chars(self):
+        # Without the reader thread, status reports would look like bad answers
+        server = FakeSmoothie(status_every=len(self.cmds) + 1)
+        transport = TelnetTransport("127.0.0.1", server.port)
+        try:
+            protocol = SimpleAsciiProtocol(flow_control="chars", rx_buffer_size=128)
+            protocol.reader_thread = False
+            protocol.plot(self.cmds, transport)
+            self.assertListEqual(server.received, self.cmds)
+        finally:
+            transport._file.close()
+            transport.sock.close()
+            server.close()
+
+    def test_serial_over_pty(self):
+        master, slave = os.openpty()
+        received = list()
+
+        def controller():
+            data = b""
+            while len(received) < len(self.cmds):
+                data += os.read(master, 4096)
+                *lines, data = data.split(b"\n")
+                received.extend(line.strip().decode("ascii") for line in lines)
+                os.write(master, b"ok\n" * len(lines))
+
+        thread = threading.Thread(target=controller, daemon=True)
+        thread.start()
+        transport = SerialTransport(os.ttyname(slave))
+        try:
+            SimpleAsciiProtocol().plot(self.cmds, transport)
+            thread.join(5.0)
+            self.assertListEqual(received, self.cmds)
+        finally:
+            transport.file.close()
+            os.close(slave)
+            os.close(master)
+
+    def test_partial_lines_kept(self):
+        """Bytes the reader reads past its last answer aren't lost when it stops"""
+        master, slave = os.openpty()
+        transport = SerialTransport(os.ttyname(slave))
+        try:
+            transport.file
+            # All in before the reader looks, so it reads the half answer too
+            os.write(master, b"ok\nok")
+            transport.start_reader()
+            transport.write(b"G0 X1\n")
+            self.assertEqual(transport.readline(), b"ok\n")
+            transport.stop_reader()
+
+            os.write(master, b"\nok\n")
+            self.assertEqual(transport.readline(), b"ok\n")
+            self.assertEqual(transport.readline(), b"ok\n")
+
+            # Nor when it starts up again
+            os.write(master, b"ok\nok")
+            transport.start_reader()
+            transport.write(b"G0 X2\n")
+            self.assertEqual(transport.readline(), b"ok\n")
+            transport.stop_reader()
+            os.write(master, b"\n")
+            transport.start_reader()
+            transport.write(b"G0 X3\n")
+            self.assertEqual(transport.readline(), b"ok\n")
+            transport.stop_reader()
+        finally:
+            transport.file.close()
+            os.close(slave)
+            os.close(master)
+
+
+if __name__ == '__main__':
+    unittest.main()